@@ -0,0 +1,269 @@
+"""
+Batch re-scoring (backfill) of historical sensor_data with one registry model version.
+Writes one predictions row per sensor_data row, carrying its sensor_data_id and the
+model_version, dated at the reading's timestamp, so model versions can be compared on
+the same history. The live views (latest prediction, charts, rollups) skip these rows;
+/fetchpredictions?source=backfill lists them.
+
+    python backfill.py                       # the active version, resuming its checkpoint
+    python backfill.py --version v0003 --workers 8
+    python backfill.py --version v0003 --restart
+
+sensor_data is read in (timestamp, id) keyset chunks (no long-lived cursor or transaction).
+Each chunk, plus the temporal_context_rows() rows before it of each stream (master id) as
+history for the rolling features, is featurized per stream and scored in a spawned worker
+process that loads the model once, memory-mapped. Results are written in chunk order, one transaction per chunk that first
+replaces the version's earlier predictions for those rows (when it has any), so a re-run
+never duplicates. After each commit a JSON checkpoint records the last (timestamp, id)
+written; the next run with the same checkpoint continues there.
+
+Kept free of database imports at module level: pool workers are spawned and import this module.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from compiled_model import compile_verified
+from model_registry import ModelRegistry, validate_model
+from predictor import FEATURE_NAMES, MODEL_FEATURE_NAMES, StatusThresholds
+from temporal_features import TEMPORAL_MAX_GAP, temporal_config, temporal_context_rows
+from training_data import model_feature_frame, row_columns, stream_rows
+
+BACKFILL_CHUNK_ROWS = 20000 # sensor_data rows per chunk (one pool task, one write transaction)
+
+_worker = {} # In each pool worker: the model and the feature names it reads
+
+
+class BackfillError(Exception):
+    """The backfill cannot run (e.g. unknown model version, checkpoint of another version)."""
+
+
+def _load_model(registry_dir: str, version: str):
+    """The compiled form of `version` (compiled now if it was published without one), else its pipeline."""
+    registry = ModelRegistry(registry_dir)
+    model = registry.load_compiled(version, mmap=True)
+    if model is not None:
+        return model
+    pipeline = registry.load(version, mmap=True)
+    try:
+        return compile_verified(pipeline)
+    except ValueError:
+        for step in getattr(pipeline, "named_steps", {}).values():
+            if hasattr(step, "n_jobs"):
+                step.n_jobs = 1 # The pool already spreads the work over the cores
+        return pipeline
+
+
+def _init_worker(registry_dir: str, version: str):
+    model = _load_model(registry_dir, version)
+    _worker["model"] = model
+    _worker["features"] = validate_model(model, MODEL_FEATURE_NAMES)
+
+
+def _score_chunk(timestamps: np.ndarray, streams: np.ndarray, features: np.ndarray, columns: list[str], n_history: int) -> np.ndarray:
+    """Pool task: leak probabilities of the rows after the first `n_history` (which only feed the rolling features)."""
+    X = model_feature_frame(pd.DataFrame(features, columns=columns, copy=False), timestamps, streams)
+    return _worker["model"].predict_proba(X[_worker["features"]].iloc[n_history:])[:, 1]
+
+
+def stream_tails(streams: np.ndarray, n: int) -> np.ndarray:
+    """Indices (ascending) of the last `n` rows of each stream."""
+    keep = np.zeros(len(streams), dtype=bool)
+    for stream in np.unique(streams):
+        keep[np.flatnonzero(streams == stream)[-n:]] = True
+    return np.flatnonzero(keep)
+
+
+def read_history(conn, statement, position_timestamp: datetime.datetime, n_columns: int, n_context: int,
+                 max_gap: float = TEMPORAL_MAX_GAP, chunk_size: int = 10000) -> tuple:
+    """
+    The rows the rolling features after `position_timestamp` depend on, as (timestamps,
+    streams, features), oldest first: the last `n_context` rows of each stream with a row
+    within `max_gap` seconds before it (any other stream starts a new segment anyway).
+    `statement` selects the rows up to the position, newest first.
+    """
+    cutoff = np.datetime64(position_timestamp - datetime.timedelta(seconds=max_gap), "us")
+    active, counts, parts = set(), {}, []
+    for _, timestamps, streams, features in stream_rows(conn, statement, n_columns, chunk_size, labels=False):
+        in_window = timestamps >= cutoff
+        active.update(np.unique(streams[in_window]).tolist())
+        keep = np.zeros(len(streams), dtype=bool)
+        for stream in active:
+            rows = np.flatnonzero(streams == stream)[:n_context - counts.get(stream, 0)]
+            keep[rows] = True
+            counts[stream] = counts.get(stream, 0) + len(rows)
+        parts.append((timestamps[keep], streams[keep], features[keep]))
+        if not in_window[-1] and all(counts[stream] >= n_context for stream in active):
+            break
+    if not parts:
+        return np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=str), np.empty((0, n_columns))
+    return tuple(np.concatenate(arrays)[::-1] for arrays in zip(*parts))
+
+
+def classify(probabilities: np.ndarray, thresholds: StatusThresholds) -> np.ndarray:
+    """Status per probability, with the same rules as the live classify_probability()."""
+    return np.where(probabilities > thresholds.danger, "DANGER", np.where(probabilities > thresholds.warning, "WARNING", "SAFE"))
+
+
+def read_checkpoint(path: str) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path: str, checkpoint: dict):
+    """Writes the checkpoint atomically (temp file + rename), so a crash never leaves a torn file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_backfill(registry_dir: str, version: str | None = None, checkpoint_path: str | None = None, restart: bool = False,
+                 chunk_size: int = BACKFILL_CHUNK_ROWS, workers: int | None = None, progress=None) -> dict:
+    """
+    Scores every sensor_data row after the checkpoint with `version` (default: the active
+    one) and returns a summary. `progress(rows_done, rows_total)` is called after each chunk.
+    """
+    from sqlalchemy import func, select, tuple_
+    from database import engine, create_schema, SensorData, PredictionResult, SENSOR_DATA_COLUMNS
+
+    create_schema() # The provenance columns may be newer than the database
+    registry = ModelRegistry(registry_dir)
+    version = version or registry.active_version()
+    if version is None or version not in registry.versions():
+        raise BackfillError(f"Model version {version} not found in registry '{registry_dir}'.")
+    metadata = registry.metadata(version)
+    thresholds = StatusThresholds(**metadata.get("thresholds", {}))
+    if metadata.get("temporal_features", temporal_config()) != temporal_config():
+        print(f" Warning: {version} was trained with temporal features {metadata['temporal_features']}, scoring with {temporal_config()}.")
+
+    checkpoint_path = checkpoint_path or f"backfill_{version}.checkpoint.json"
+    checkpoint = None if restart else read_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint.get("version") != version:
+        raise BackfillError(f"Checkpoint '{checkpoint_path}' belongs to model version {checkpoint.get('version')}.")
+    position = (datetime.datetime.fromisoformat(checkpoint["last_timestamp"]), checkpoint["last_id"]) if checkpoint else None
+    rows_scored = checkpoint["rows_scored"] if checkpoint else 0
+
+    columns = [f for f in FEATURE_NAMES if f in SENSOR_DATA_COLUMNS]
+    table = SensorData.__table__
+    ts, id_col = table.c.timestamp, table.c.id
+    key = tuple_(ts, id_col)
+    selected = row_columns(table, columns)
+    n_context = temporal_context_rows()
+
+    def after(start):
+        return select(*selected).where(key > tuple_(*start)) if start is not None else select(*selected)
+
+    def read_chunk(start):
+        with engine.connect() as conn:
+            return next(stream_rows(conn, after(start).order_by(ts, id_col).limit(chunk_size), len(columns), chunk_size, labels=False), None)
+
+    with engine.connect() as conn:
+        total = conn.execute(select(func.count()).select_from(after(position).subquery())).scalar()
+        # Earlier runs of this version left rows to replace (live predictions have no sensor_data_id)
+        replace = conn.execute(select(PredictionResult.id).where(
+            PredictionResult.model_version == version, PredictionResult.sensor_data_id.is_not(None)).limit(1)).first() is not None
+        history = (np.empty(0, dtype="datetime64[us]"), np.empty(0, dtype=str), np.empty((0, len(columns))))
+        if position is not None: # The rows before the checkpoint, as history for the rolling features
+            statement = select(*selected).where(key <= tuple_(*position)).order_by(ts.desc(), id_col.desc())
+            history = read_history(conn, statement, position[0], len(columns), n_context)
+
+    workers = workers or (len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count())
+    print(f"\n Backfilling {total} sensor_data rows with model version {version} ({workers} worker processes, "
+          f"{'resuming after ' + checkpoint['last_timestamp'] if checkpoint else 'from the start'})...")
+    started = time.perf_counter()
+    done = 0
+    status_counts = {"SAFE": 0, "WARNING": 0, "DANGER": 0}
+    pending = deque() # (future, ids, timestamps, start) in chunk order
+    read_position, exhausted = position, False
+    # Spawned, not forked: this process holds DB connections a fork would share
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(registry_dir, version)) as pool:
+        while pending or not exhausted:
+            # Keep every worker busy: read ahead up to two chunks per worker
+            while not exhausted and len(pending) < 2 * workers:
+                chunk = read_chunk(read_position)
+                if chunk is None:
+                    exhausted = True
+                    break
+                ids, timestamps, streams, features = chunk
+                all_timestamps = np.concatenate([history[0], timestamps])
+                all_streams = np.concatenate([history[1], streams])
+                all_features = np.concatenate([history[2], features])
+                future = pool.submit(_score_chunk, all_timestamps, all_streams, all_features, columns, len(history[0]))
+                pending.append((future, ids, timestamps, read_position))
+                tail = stream_tails(all_streams, n_context)
+                history = (all_timestamps[tail], all_streams[tail], all_features[tail])
+                read_position = (timestamps[-1].item(), int(ids[-1]))
+                exhausted = len(ids) < chunk_size
+            if not pending:
+                break
+
+            future, ids, timestamps, start = pending.popleft()
+            probabilities = future.result()
+            statuses = classify(probabilities, thresholds)
+            end = (timestamps[-1].item(), int(ids[-1]))
+            rows = [
+                {"prediction_timestamp": t, "status": s, "probability": p, "sensor_data_id": i, "model_version": version}
+                for t, s, p, i in zip(timestamps.tolist(), statuses.tolist(), probabilities.tolist(), ids.tolist())
+            ]
+            with engine.begin() as conn:
+                if replace: # Replace, not append: a chunk re-run after a crash (or a second run) leaves one row per reading
+                    chunk_ids = select(id_col).where(key <= tuple_(*end))
+                    if start is not None:
+                        chunk_ids = chunk_ids.where(key > tuple_(*start))
+                    conn.execute(PredictionResult.__table__.delete().where(
+                        PredictionResult.model_version == version, PredictionResult.sensor_data_id.in_(chunk_ids)))
+                conn.execute(PredictionResult.__table__.insert(), rows)
+            done += len(rows)
+            for status, count in zip(*np.unique(statuses, return_counts=True)):
+                status_counts[str(status)] += int(count)
+            write_checkpoint(checkpoint_path, {
+                "version": version,
+                "last_timestamp": end[0].isoformat(),
+                "last_id": end[1],
+                "rows_scored": rows_scored + done,
+                "updated_at": datetime.datetime.utcnow().isoformat(),
+            })
+            if progress is not None:
+                progress(done, total)
+
+    seconds = time.perf_counter() - started
+    print(f" Backfill done: {done} rows in {seconds:.1f} s ({done / seconds if seconds else 0:.0f} rows/s), {status_counts}.")
+    return {
+        "version": version,
+        "rows_scored": done,
+        "rows_scored_total": rows_scored + done,
+        "seconds": seconds,
+        "rows_per_second": done / seconds if seconds else 0.0,
+        "status_counts": status_counts,
+        "checkpoint": checkpoint_path,
+    }
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--version", default=None, help="model version to score with (default: the active one)")
+    parser.add_argument("--registry-dir", default=os.getenv("MODEL_REGISTRY_DIR", "model_registry"), help="model registry directory")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: backfill_<version>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and re-score from the first row")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_ROWS, help="sensor_data rows per chunk")
+    parser.add_argument("--workers", type=int, default=None, help="scoring processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+    try:
+        run_backfill(args.registry_dir, args.version, args.checkpoint, args.restart, args.chunk_size, args.workers)
+    except BackfillError as e:
+        parser.exit(1, f" {e}\n")
+
+
+if __name__ == "__main__":
+    main_cli()
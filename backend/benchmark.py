@@ -0,0 +1,364 @@
+"""
+Ingest and inference benchmark. Replays synthetic payloads shaped like the master
+firmware's JSON into the ingest pipeline's receive stage at a fixed rate, standing in
+for the MQTT client (no broker or network needed), and saves the results as JSON.
+
+    python benchmark.py --rate 200 --duration 30
+    python benchmark.py --rate 500 --compare benchmark_results/<earlier run>.json
+    python benchmark.py --startup-only    # cold start of one API process against its budget
+
+By default it writes to a fresh SQLite file, never to the configured DATABASE_URL, and
+imports the legacy model into a temporary registry unless MODEL_REGISTRY_DIR is set.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTUP_BUDGET_SECONDS = 2.0 # Fresh interpreter to model loaded (import main + prepare_serving), per API process
+STARTUP_BUDGET_RSS_MB = 120 # Peak resident memory of that process
+TRAINING_ONLY_MODULES = ("pandas", "sklearn", "scipy", "pyarrow") # Must stay out of the serving process
+
+_STARTUP_SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.prepare_serving()
+ready = time.perf_counter()
+try: # Peak RSS of this image (ru_maxrss would include the parent's peak from before exec)
+    with open("/proc/self/status") as f:
+        max_rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except OSError:
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    "import_seconds": imported - started,
+    "prepare_seconds": ready - imported,
+    "max_rss_mb": max_rss_kb / 1024,
+    "model_version": main.served_version(),
+    "training_modules": [m for m in %r if m in sys.modules],
+}))
+"""
+
+
+class LatencyRecorder:
+    """Stands in for the pipeline's row_latency histogram, keeping every sample per table."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def labels(self, table_name: str):
+        return _Samples(self.samples.setdefault(table_name, []))
+
+
+class _Samples:
+    __slots__ = ("observe",)
+
+    def __init__(self, values: list):
+        self.observe = values.append
+
+
+def firmware_payload(rng: random.Random, leak: bool = False) -> dict:
+    """One master publish: three worker aggregates, plus DHT readings unless the sensor failed."""
+    payload = {}
+    for worker in (1, 2, 3):
+        base = rng.uniform(600, 950) if leak else rng.uniform(80, 350)
+        spread = rng.uniform(5, 60)
+        payload[f"worker_{worker}_mean"] = round(base, 2)
+        payload[f"worker_{worker}_min"] = int(base - spread)
+        payload[f"worker_{worker}_max"] = int(base + spread)
+        payload[f"worker_{worker}_variance"] = round(spread * spread / 3, 2)
+    if rng.random() > 0.02: # The firmware omits humidity/temp when the DHT read fails
+        payload["humidity"] = round(rng.uniform(30, 70), 1)
+        payload["temp"] = round(rng.uniform(18, 35), 1)
+    return payload
+
+
+def percentiles(values: list[float], points=(50, 90, 95, 99, 99.9)) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {f"p{p:g}": ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] for p in points}
+    result.update(mean=sum(ordered) / len(ordered), max=ordered[-1])
+    return result
+
+
+def measure_startup(runs: int = 3) -> dict:
+    """
+    Cold start of an API process, each run in a fresh interpreter on the current
+    environment (DATABASE_URL, MODEL_REGISTRY_DIR): median times, peak RSS, and whether
+    they fit STARTUP_BUDGET_SECONDS / STARTUP_BUDGET_RSS_MB without training-only modules.
+    """
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SCRIPT % (TRAINING_ONLY_MODULES,)],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True,
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_seconds"] = time.perf_counter() - started # Includes interpreter startup
+        samples.append(sample)
+    result = {
+        key: statistics.median(s[key] for s in samples)
+        for key in ("import_seconds", "prepare_seconds", "process_seconds")
+    }
+    result.update(
+        runs=runs,
+        max_rss_mb=max(s["max_rss_mb"] for s in samples),
+        model_version=samples[-1]["model_version"],
+        training_modules=samples[-1]["training_modules"],
+        budget_seconds=STARTUP_BUDGET_SECONDS,
+        budget_rss_mb=STARTUP_BUDGET_RSS_MB,
+    )
+    result["within_budget"] = (result["process_seconds"] <= STARTUP_BUDGET_SECONDS
+                               and result["max_rss_mb"] <= STARTUP_BUDGET_RSS_MB and not result["training_modules"])
+    return result
+
+
+def print_startup(startup: dict):
+    print(f" Startup: {startup['process_seconds']:.2f} s to ready (import {startup['import_seconds']:.2f} s, "
+          f"schema + model {startup['prepare_seconds']:.2f} s), peak RSS {startup['max_rss_mb']:.0f} MB; "
+          f"budget {startup['budget_seconds']:.1f} s / {startup['budget_rss_mb']} MB: "
+          f"{'OK' if startup['within_budget'] else 'EXCEEDED'}"
+          + (f" (training-only modules loaded: {', '.join(startup['training_modules'])})" if startup["training_modules"] else ""))
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_stage(fn, items, repeat: int = 1) -> dict:
+    """Mean and median microseconds per call of `fn(item)` over `items`."""
+    samples = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter_ns()
+            fn(item)
+            samples.append((time.perf_counter_ns() - start) / 1000)
+    samples.sort()
+    return {"mean_us": sum(samples) / len(samples), "median_us": samples[len(samples) // 2], "calls": len(samples)}
+
+
+def profile_stages(main, payloads: list[dict]) -> dict:
+    """Cost of each step run_ml_prediction takes for one payload, and of the batched path."""
+    from temporal_features import TemporalFeatureEngine
+    encoded = [json.dumps(p).encode("utf-8") for p in payloads]
+    engine = TemporalFeatureEngine()
+    rows = [json.loads(raw) for raw in encoded]
+    stages = {
+        "json_decode": time_stage(lambda raw: json.loads(raw.decode("utf-8")), encoded),
+        "temporal_update": time_stage(lambda row: engine.update(row, time.time()), rows),
+        "pack_features": time_stage(lambda row: main.feature_packer.pack([row]), rows),
+    }
+    model = main.served_model
+    if model is not None:
+        matrices = [main.feature_packer.pack([row]) for row in rows]
+        if model.feature_idx is not None:
+            matrices = [X[:, model.feature_idx] for X in matrices]
+        stages["predict_proba"] = time_stage(model.pipeline.predict_proba, matrices[:200])
+    stages["run_ml_prediction"] = time_stage(lambda row: main.run_ml_prediction(dict(row)), rows[:200])
+    batch = rows[:main.PREDICT_BATCH_SIZE]
+    X = main.feature_packer.pack(batch)
+    batched = time_stage(lambda _: main.score_feature_matrix(X, batch), range(20))
+    stages["score_batch_per_row"] = dict(batched, mean_us=batched["mean_us"] / len(batch),
+                                         median_us=batched["median_us"] / len(batch), batch_size=len(batch))
+    stages["model_version"] = model.version if model is not None else None
+    stages["model_type"] = type(model.pipeline).__name__ if model is not None else None
+    return stages
+
+
+async def run_load(main, rate: float, duration: float, prediction_ratio: float, leak_ratio: float, seed: int, drain_timeout: float) -> dict:
+    """
+    Publishes at `rate` msg/s for `duration` s into the pipeline from the event loop
+    (like the MQTT client), then waits until every message has been written, failed or
+    dropped. Latency is recorded per row, from receipt to the commit of its row.
+    """
+    from database import PredictionResult
+    pipeline = main.pipeline
+    rng = random.Random(seed)
+    n_messages = int(rate * duration)
+    messages = []
+    for _ in range(n_messages):
+        topic = main.MQTT_TOPIC_PREDICTION if rng.random() < prediction_ratio else main.MQTT_TOPIC_COLLECTION
+        messages.append((topic, json.dumps(firmware_payload(rng, leak=rng.random() < leak_ratio)).encode("utf-8")))
+    n_predictions = sum(topic == main.MQTT_TOPIC_PREDICTION for topic, _ in messages)
+
+    def counts() -> tuple[int, int, int]:
+        return (pipeline.rows_written, pipeline.rows_failed,
+                pipeline.messages_dropped + pipeline.payloads_dropped + pipeline.rows_dropped)
+
+    last_commit = [time.perf_counter()]
+    original_on_flush = pipeline.on_flush
+    original_row_latency = pipeline.row_latency
+
+    def on_flush(table, rows):
+        last_commit[0] = time.perf_counter()
+        if original_on_flush is not None:
+            original_on_flush(table, rows)
+
+    recorder = LatencyRecorder()
+    pipeline.on_flush = on_flush
+    pipeline.row_latency = recorder
+    before = counts()
+    dispatch_lag = []
+    receive_us = []
+    try:
+        start = time.perf_counter()
+        for i, (topic, payload) in enumerate(messages):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.perf_counter()
+            dispatch_lag.append((now - scheduled) * 1000)
+            await pipeline.receive(topic, payload)
+            receive_us.append((time.perf_counter() - now) * 1e6)
+        publish_done = time.perf_counter()
+        # Every message ends up as exactly one written, failed or dropped row
+        deadline = publish_done + drain_timeout
+        while sum(counts()) - sum(before) < n_messages and time.perf_counter() < deadline:
+            await asyncio.sleep(0.01)
+    finally:
+        pipeline.on_flush = original_on_flush
+        pipeline.row_latency = original_row_latency
+
+    rows_written, rows_failed, dropped = (now - then for now, then in zip(counts(), before))
+    latencies = [s * 1000 for s in recorder.samples.get(PredictionResult.__tablename__, [])]
+    return {
+        "messages": n_messages,
+        "prediction_messages": n_predictions,
+        "target_rate": rate,
+        "achieved_rate": n_messages / (publish_done - start),
+        "publish_seconds": publish_done - start,
+        "db_rows_written": rows_written,
+        "db_rows_per_second": rows_written / (last_commit[0] - start),
+        "rows_dropped": dropped,
+        "rows_failed": rows_failed,
+        "receive_us": percentiles(receive_us),
+        "dispatch_lag_ms": percentiles(dispatch_lag),
+        "latency_valid": len(latencies) == n_predictions,
+        "end_to_end_latency_ms": percentiles(latencies),
+    }
+
+
+async def run_pipeline_load(main, args) -> dict:
+    """Starts the pipeline on this loop, warms it up, measures one load run and drains it."""
+    await main.pipeline.start(main.create_async_db_engine(pool_size=main.INGEST_WRITERS))
+    try:
+        # Warm up (executor threads, pooled connections, first inserts, model pages) before measuring
+        await run_load(main, rate=min(args.rate, 100), duration=1, prediction_ratio=args.prediction_ratio,
+                       leak_ratio=args.leak_ratio, seed=args.seed + 2, drain_timeout=args.drain_timeout)
+        return await run_load(main, args.rate, args.duration, args.prediction_ratio, args.leak_ratio, args.seed, args.drain_timeout)
+    finally:
+        await main.pipeline.stop()
+
+
+def compare(current: dict, previous: dict):
+    """Prints the headline metrics next to an earlier result."""
+    metrics = [
+        ("load", "achieved_rate"), ("load", "db_rows_per_second"),
+        ("load", "end_to_end_latency_ms", "p50"), ("load", "end_to_end_latency_ms", "p99"),
+        ("load", "receive_us", "p50"),
+        ("stages", "run_ml_prediction", "mean_us"), ("stages", "score_batch_per_row", "mean_us"),
+        ("startup", "process_seconds"), ("startup", "max_rss_mb"),
+    ]
+    print(f"\n Compared with {previous.get('commit')} ({previous.get('created_at')}):")
+    for path in metrics:
+        old, new = previous, current
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new.get(key, {}) if isinstance(new, dict) else {}
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+            print(f"   {'.'.join(path):45s} {old:12.2f} -> {new:12.2f} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=200, help="messages per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--prediction-ratio", type=float, default=0.5, help="share of messages on the prediction topic")
+    parser.add_argument("--leak-ratio", type=float, default=0.05, help="share of payloads that look like a leak")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for queued rows after the load")
+    parser.add_argument("--database-url", default=None, help="database to write to (default: a fresh temporary SQLite file)")
+    parser.add_argument("--output", default=None, help="result file (default: benchmark_results/<time>_<commit>.json)")
+    parser.add_argument("--compare", default=None, help="earlier result file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="log every message (LOG_LEVEL=DEBUG)")
+    parser.add_argument("--startup-runs", type=int, default=3, help="fresh API processes started to time cold start")
+    parser.add_argument("--startup-only", action="store_true", help="only measure cold start; exit status 1 if over budget")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="gasleak-bench-")
+    # Must be set before main/database are imported (the engine is created at import time)
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("MODEL_REGISTRY_DIR", os.path.join(workdir, "model_registry")) # Never publish into the deployment's registry
+    os.environ["LOG_LEVEL"] = "DEBUG" if args.verbose else "WARNING"
+    import main
+
+    # Schema and registry first, so the timed processes start like a replica of a running deployment
+    main.create_schema()
+    main.import_legacy_model()
+    main.load_model()
+    startup = measure_startup(args.startup_runs)
+    if args.startup_only:
+        print_startup(startup)
+        sys.exit(0 if startup["within_budget"] else 1)
+    rng = random.Random(args.seed + 1)
+    stages = profile_stages(main, [firmware_payload(rng, leak=rng.random() < args.leak_ratio) for _ in range(1000)])
+    load = asyncio.run(run_pipeline_load(main, args))
+
+    commit = git_commit()
+    result = {
+        "commit": commit,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "args": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": main.engine.dialect.name,
+            "ingest_flush_size": main.INGEST_FLUSH_SIZE,
+            "ingest_writers": main.INGEST_WRITERS,
+            "inference_workers": main.INFERENCE_WORKERS,
+            "predict_batch_size": main.PREDICT_BATCH_SIZE,
+            "predict_batch_window": main.PREDICT_BATCH_WINDOW,
+            "model_compiled": main.MODEL_COMPILED,
+        },
+        "startup": startup,
+        "stages": stages,
+        "load": load,
+    }
+    output = args.output or os.path.join("benchmark_results", f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    latency = load["end_to_end_latency_ms"]
+    print(f" Load: {load['messages']} messages at {load['achieved_rate']:.0f}/s (target {args.rate:.0f}/s), "
+          f"{load['db_rows_per_second']:.0f} DB rows/s, {load['rows_dropped']} dropped.")
+    if latency:
+        print(f" End-to-end prediction latency: p50 {latency['p50']:.1f} ms, p99 {latency['p99']:.1f} ms"
+              + ("" if load["latency_valid"] else " (incomplete: rows were dropped or failed)"))
+    print(f" run_ml_prediction: {stages['run_ml_prediction']['mean_us']:.0f} us/row, "
+          f"batched scoring: {stages['score_batch_per_row']['mean_us']:.1f} us/row")
+    print_startup(startup)
+    print(f" Results saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main_cli()
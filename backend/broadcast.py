@@ -0,0 +1,90 @@
+"""In-process fan-out of new rows to live dashboard clients (Server-Sent Events)."""
+import asyncio
+import datetime
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_json(value) -> str:
+    """JSON with datetimes as ISO 8601 strings, as stream clients receive them."""
+    return json.dumps(value, default=_json_default)
+
+
+def format_sse(event: str, data: dict) -> str:
+    """Encodes one Server-Sent Events message."""
+    return f"event: {event}\ndata: {to_json(data)}\n\n"
+
+
+class _Subscriber:
+    """One connected client: a bounded queue of pre-encoded SSE messages."""
+
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+
+class Broadcaster:
+    """
+    Fans out events (rows the ingest pipeline stored, rows relayed from other processes)
+    to the live-stream subscribers. Everything runs on the event loop. Each subscriber has a
+    buffer of `client_buffer` messages; a client that lets its buffer fill up is
+    disconnected instead of slowing everyone else down.
+    """
+
+    def __init__(self, client_buffer: int = 100, heartbeat: float = 15.0):
+        self.client_buffer = client_buffer
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self.slow_consumers_dropped = 0
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, data: dict):
+        """Encodes the event once and queues it for every subscriber (call on the event loop)."""
+        if not self._subscribers:
+            return # Nobody is listening, skip the encoding work
+        message = format_sse(event, data)
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+
+    def subscribe(self) -> _Subscriber:
+        subscriber = _Subscriber(self.client_buffer)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        self._subscribers.discard(subscriber)
+
+    async def stream(self, subscriber: _Subscriber):
+        """Yields SSE chunks for one subscriber, with keep-alive comments while idle."""
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=self.heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if message is None: # Dropped as a slow consumer
+                return
+            yield message
+
+    def _drop(self, subscriber: _Subscriber):
+        self._subscribers.discard(subscriber)
+        subscriber.dropped = True
+        self.slow_consumers_dropped += 1
+        # Discard its backlog and wake the stream so it closes the connection
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        logger.warning("Dropped slow live-stream client (buffer of %d full).", self.client_buffer)
@@ -0,0 +1,157 @@
+"""
+Compiled form of the served model: a StandardScaler + RandomForest pipeline flattened
+into a few contiguous NumPy arrays and evaluated for a whole batch at once, without
+sklearn's per-call validation and thread dispatch.
+
+  * The scaler is folded into the split thresholds: (x - mean) / scale <= t  <=>  x < t' * scale + mean,
+    where t' is the point at which sklearn's float32 cast of the scaled value starts rounding
+    above t (trees compare float32 inputs), so the compiled splits agree with sklearn exactly
+  * All trees share one node table; node i sends a row to children[i, 0] when
+    x[feature[i]] < threshold[i], else to children[i, 1]
+  * Leaves point to themselves (threshold +inf), so a row can keep stepping once it reaches
+    one; the walk stops when every row has reached a leaf in every tree (at most `depth` steps)
+  * value[i] is the class-1 fraction of leaf i; the forest probability is the mean over trees
+"""
+import warnings
+import numpy as np
+
+
+class CompiledForest:
+    """Stands in for the fitted pipeline wherever only predict_proba is used (binary leak labels)."""
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, children: np.ndarray, value: np.ndarray,
+                 roots: np.ndarray, depth: int, n_features: int, feature_names=None):
+        self.feature = feature # int32 per node (0 for leaves)
+        self.threshold = threshold # float64 per node, in raw (unscaled) feature units
+        self.children = children # int32, flat [left, right] pairs per node
+        self.value = value # float64 per node: P(leak) at that node
+        self.roots = roots # int32 root node of each tree
+        self.depth = depth
+        # The attributes validate_model() reads from a fitted sklearn model
+        self.n_features_in_ = n_features
+        if feature_names is not None:
+            self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.classes_ = np.array([0, 1])
+
+    def __setstate__(self, state):
+        # Loaded with mmap_mode the arrays are np.memmap; plain ndarray views over the same
+        # pages skip the subclass overhead on every fancy-indexing step
+        self.__dict__.update({k: np.asarray(v) if isinstance(v, np.memmap) else v for k, v in state.items()})
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """[P(no leak), P(leak)] per row of X (raw features, same columns as the pipeline)."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X has shape {X.shape}, expected (n, {self.n_features_in_})")
+        flat = X.ravel()
+        row_start = (np.arange(X.shape[0]) * self.n_features_in_)[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))) # (rows, trees)
+        for step in range(self.depth):
+            go_right = flat[row_start + self.feature[node]] >= self.threshold[node]
+            node = self.children[2 * node + go_right]
+            if step % 4 == 3 and (self.children[2 * node] == node).all():
+                break # Every row is at a leaf in every tree (deep trees are rarely deep everywhere)
+        leak = self.value[node].mean(axis=1)
+        return np.column_stack([1.0 - leak, leak])
+
+
+def _float32_cutoff(threshold: np.ndarray) -> np.ndarray:
+    """
+    sklearn sends a row left when float32(x) <= threshold. That holds exactly when x is below
+    the midpoint between the largest float32 <= threshold and the next float32 up.
+    """
+    below = threshold.astype(np.float32)
+    below = np.where(below > threshold, np.nextafter(below, np.float32(-np.inf)), below)
+    return (below.astype(np.float64) + np.nextafter(below, np.float32(np.inf)).astype(np.float64)) / 2
+
+
+def compile_pipeline(model) -> CompiledForest:
+    """
+    Flattens a fitted pipeline of StandardScaler steps ending in a binary
+    RandomForestClassifier (or a bare forest). Raises ValueError for anything else.
+    """
+    steps = list(model.steps) if hasattr(model, "steps") else [("model", model)]
+    *transforms, (_, forest) = steps
+    n_features = forest.n_features_in_
+    mean, scale = np.zeros(n_features), np.ones(n_features) # Combined affine map of the scalers
+    for name, step in transforms:
+        if not hasattr(step, "scale_") or not hasattr(step, "with_mean"):
+            raise ValueError(f"cannot compile pipeline step '{name}' ({type(step).__name__})")
+        step_mean = step.mean_ if step.with_mean else 0.0
+        step_scale = step.scale_ if step.with_std else 1.0
+        mean, scale = mean + step_mean * scale, scale * step_scale
+    if not hasattr(forest, "estimators_") or list(getattr(forest, "classes_", [])) != [0, 1]:
+        raise ValueError(f"cannot compile {type(forest).__name__}: expected a fitted binary random forest")
+
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset, depth = 0, 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        if tree.n_outputs != 1:
+            raise ValueError("cannot compile multi-output trees")
+        node_ids = np.arange(tree.node_count) + offset
+        leaf = tree.children_left == -1
+        feature = np.where(leaf, 0, tree.feature)
+        features.append(feature)
+        thresholds.append(np.where(leaf, np.inf, _float32_cutoff(tree.threshold) * scale[feature] + mean[feature]))
+        children.append(np.column_stack([
+            np.where(leaf, node_ids, tree.children_left + offset),
+            np.where(leaf, node_ids, tree.children_right + offset),
+        ]).ravel())
+        counts = tree.value[:, 0, :]
+        values.append(counts[:, 1] / counts.sum(axis=1))
+        roots.append(offset)
+        offset += tree.node_count
+        depth = max(depth, tree.max_depth)
+
+    return CompiledForest(
+        feature=np.concatenate(features).astype(np.int32),
+        threshold=np.concatenate(thresholds).astype(np.float64),
+        children=np.concatenate(children).astype(np.int32),
+        value=np.concatenate(values).astype(np.float64),
+        roots=np.array(roots, dtype=np.int32),
+        depth=depth,
+        n_features=n_features,
+        feature_names=getattr(model, "feature_names_in_", None),
+    )
+
+
+def boundary_rows(compiled: CompiledForest, n_rows: int = 2000, seed: int = 0) -> np.ndarray:
+    """
+    Rows whose every feature sits just either side (1e-12 relative) of one of the model's own
+    split points: where a wrong comparison or a float32 rounding slip would show first.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.zeros((n_rows, compiled.n_features_in_))
+    is_split = np.isfinite(compiled.threshold)
+    for f in range(compiled.n_features_in_):
+        cuts = compiled.threshold[is_split & (compiled.feature == f)]
+        cuts = rng.choice(cuts if len(cuts) else [0.0], n_rows)
+        X[:, f] = cuts + rng.choice([-1e-12, 1e-12], n_rows) * np.maximum(np.abs(cuts), 1.0)
+    return X
+
+
+def max_probability_error(compiled: CompiledForest, model, X) -> float:
+    """Largest absolute difference between the compiled and the original predict_proba on X."""
+    return float(np.max(np.abs(compiled.predict_proba(X)[:, 1] - model.predict_proba(X)[:, 1]))) if len(X) else 0.0
+
+
+def compile_verified(model, X=None, tolerance: float = 1e-9) -> CompiledForest:
+    """
+    compile_pipeline(), checked against the model's own predict_proba on `X` (e.g. held-out
+    rows) plus boundary_rows(). Raises ValueError if they disagree by more than `tolerance`.
+    """
+    compiled = compile_pipeline(model)
+    probes = boundary_rows(compiled)
+    if X is not None:
+        probes = np.vstack([np.asarray(X, dtype=np.float64), probes])
+    with warnings.catch_warnings(): # Pipelines fitted on a DataFrame warn about the bare matrix
+        warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+        error = max_probability_error(compiled, model, probes)
+    if error > tolerance:
+        raise ValueError(f"compiled model differs from the pipeline by up to {error:.3g}")
+    return compiled
@@ -0,0 +1,165 @@
+"""Database configuration, ORM models and schema setup shared by the API and worker processes."""
+import os
+import uuid
+import datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, make_url, text, Column, Integer, Float, DateTime, String, Boolean, Index, Table
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.declarative import declarative_base
+
+# --- Environment and Database Configuration ---
+load_dotenv() #
+DATABASE_URL = os.getenv("DATABASE_URL") #
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL environment variable not set") #
+
+engine = create_engine(DATABASE_URL) #
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) #
+Base = declarative_base() #
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"} # Async driver per backend (ingest pipeline)
+
+def create_async_db_engine(pool_size: int = 2):
+    """
+    Async engine on the same database, for the ingest pipeline's writers. Created on
+    demand (call it from the event loop that will use it). Prepared-statement caching
+    is off, since the Supabase pooler (PgBouncer, transaction mode) can't keep it.
+    """
+    url = make_url(DATABASE_URL)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}' databases")
+    kwargs = {}
+    if backend == "postgresql":
+        kwargs = {
+            "pool_size": pool_size,
+            "max_overflow": 0,
+            "pool_pre_ping": True,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            },
+        }
+    return create_async_engine(url.set(drivername=ASYNC_DRIVERS[backend]), **kwargs)
+
+# --- Database Model (Sensor Data - potentially unlabeled) ---
+class SensorData(Base):
+    """Stores raw aggregated sensor data, intended for labeling or analysis."""
+    __tablename__ = "sensor_data" #
+
+    id = Column(Integer, primary_key=True, index=True) #
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True) # Added index
+    worker_1_mean = Column(Float, nullable=True) #
+    worker_1_min = Column(Integer, nullable=True) #
+    worker_1_max = Column(Integer, nullable=True) #
+    worker_1_variance = Column(Float, nullable=True) #
+    worker_2_mean = Column(Float, nullable=True) #
+    worker_2_min = Column(Integer, nullable=True) #
+    worker_2_max = Column(Integer, nullable=True) #
+    worker_2_variance = Column(Float, nullable=True) #
+    worker_3_mean = Column(Float, nullable=True) #
+    worker_3_min = Column(Integer, nullable=True) #
+    worker_3_max = Column(Integer, nullable=True) #
+    worker_3_variance = Column(Float, nullable=True) #
+    humidity = Column(Float, nullable=True) #
+    temp = Column(Float, nullable=True) #
+    master_id = Column(String, nullable=True) # Master node that sent it (temporal features are per master); NULL = the 'default' stream
+    # Label column, updated via API
+    is_leak = Column(Boolean, nullable=True, index=True, default=False) # Default to False
+
+    __table_args__ = (
+        Index('ix_sensor_data_timestamp_id', 'timestamp', 'id'), # Keyset pagination / export order
+    )
+
+# --- Database Model (Prediction Results) ---
+class PredictionResult(Base):
+    """Stores the results of the gas leak prediction model."""
+    __tablename__ = "predictions" # Table name for predictions
+
+    id = Column(Integer, primary_key=True, index=True)
+    prediction_timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True) # Timestamp of prediction
+    status = Column(String, index=True) # SAFE, WARNING, DANGER
+    probability = Column(Float) # Confidence score (0.0 to 1.0)
+    # Provenance: the sensor_data row that was scored (re-scored history only; live payloads are not stored there)
+    sensor_data_id = Column(Integer, nullable=True) # No FK, so retention can purge sensor_data freely
+    model_version = Column(String, nullable=True) # Registry version that scored it (NULL = placeholder rules)
+
+    __table_args__ = (
+        Index('ix_predictions_prediction_timestamp_id', 'prediction_timestamp', 'id'), # Keyset pagination / export order
+        Index('ix_predictions_model_version_sensor_data_id', 'model_version', 'sensor_data_id'), # Backfill replace / model comparison
+    )
+
+# --- Database Model (Label Change Log) ---
+class LabelChange(Base):
+    """
+    One row per label edit on sensor_data. The highest id is the label-change
+    watermark: training caches compare it to know which rows were relabeled.
+    """
+    __tablename__ = "label_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sensor_data_id = Column(Integer, index=True) # No FK, so retention can purge sensor_data freely
+    changed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+# --- Database Model (Ingest Slot Leases) ---
+class IngestSlot(Base):
+    """
+    One row per ingest slot of a scaled-out deployment: the backend process holding it
+    and when it last renewed its lease (see partitioning.SlotLeases).
+    """
+    __tablename__ = "ingest_slots"
+
+    slot = Column(Integer, primary_key=True, autoincrement=False)
+    owner = Column(String, nullable=True) # Process id (host-pid-random); NULL = free
+    heartbeat_at = Column(DateTime, nullable=True) # Last renewal, UTC
+    requested_by = Column(String, nullable=True) # A process without a slot asking the owner to hand this one over
+
+# --- Rollup Tables (aggregates that outlive the raw rows, see retention.py) ---
+ROLLUP_SENSOR_COLUMNS = ['worker_1_mean', 'worker_2_mean', 'worker_3_mean', 'humidity', 'temp'] # Summarized per bucket
+ROLLUP_GRANULARITIES = {"1m": 60, "1h": 3600} # Table suffix -> bucket width in seconds
+
+def _sensor_rollup_table(suffix: str) -> Table:
+    columns = [Column('bucket_start', DateTime, primary_key=True), Column('sample_count', Integer)]
+    for name in ROLLUP_SENSOR_COLUMNS:
+        columns += [Column(f'{name}_min', Float), Column(f'{name}_max', Float), Column(f'{name}_avg', Float)]
+    return Table(f"sensor_data_{suffix}", Base.metadata, *columns)
+
+def _prediction_rollup_table(suffix: str) -> Table:
+    return Table(
+        f"predictions_{suffix}", Base.metadata,
+        Column('bucket_start', DateTime, primary_key=True),
+        Column('prediction_count', Integer),
+        Column('safe_count', Integer),
+        Column('warning_count', Integer),
+        Column('danger_count', Integer),
+        Column('probability_min', Float),
+        Column('probability_max', Float),
+        Column('probability_avg', Float),
+    )
+
+SENSOR_ROLLUP_TABLES = {suffix: _sensor_rollup_table(suffix) for suffix in ROLLUP_GRANULARITIES} # sensor_data_1m, sensor_data_1h
+PREDICTION_ROLLUP_TABLES = {suffix: _prediction_rollup_table(suffix) for suffix in ROLLUP_GRANULARITIES} # predictions_1m, predictions_1h
+
+def create_schema(bind=engine):
+    """
+    Creates missing tables, and the columns and indexes added to existing tables since they
+    were created (create_all skips those). Idempotent; called at API startup, not on import.
+    """
+    Base.metadata.create_all(bind=bind) # Create tables if they don't exist
+    for table in (SensorData.__table__, PredictionResult.__table__):
+        existing = {c["name"] for c in inspect(bind).get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing: # Nullable, no default: a cheap catalog-only change
+                with bind.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}'))
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+SENSOR_DATA_COLUMNS = [c.name for c in SensorData.__table__.columns if c.name != 'id']
+
+
+if __name__ == "__main__":
+    # Schema setup as its own step (e.g. once per deploy, with DB_CREATE_SCHEMA=0 on the replicas)
+    create_schema()
+    print(f" Schema is up to date ({len(Base.metadata.tables)} tables).")
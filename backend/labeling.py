@@ -0,0 +1,49 @@
+"""Set-based bulk labeling of sensor_data rows, logged to the label-change table."""
+from sqlalchemy import and_, func, or_, select, text
+
+
+def label_selection(sensor_table, ids=None, start=None, end=None, thresholds=None):
+    """
+    WHERE clause for the rows to label: ids in `ids` and/or timestamps in [start, end),
+    narrowed by `thresholds`, a list of (column name, min, max) with inclusive, optional bounds.
+    """
+    conditions = []
+    if ids is not None:
+        conditions.append(sensor_table.c.id.in_(ids))
+    if start is not None:
+        conditions.append(sensor_table.c.timestamp >= start)
+    if end is not None:
+        conditions.append(sensor_table.c.timestamp < end)
+    for column_name, minimum, maximum in thresholds or []:
+        column = sensor_table.c[column_name]
+        if minimum is not None:
+            conditions.append(column >= minimum)
+        if maximum is not None:
+            conditions.append(column <= maximum)
+    return and_(*conditions)
+
+
+def serialize_label_changes(conn, changes_table):
+    """
+    Makes label transactions wait for each other (until commit), so change-log ids commit
+    in id order and the watermark never skips a change still in flight. SQLite already
+    runs one write transaction at a time.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"LOCK TABLE {changes_table.name} IN SHARE ROW EXCLUSIVE MODE"))
+
+
+def apply_labels(conn, sensor_table, changes_table, selection, is_leak: bool) -> tuple[int, int]:
+    """
+    Sets is_leak on every selected row whose label differs, with one INSERT ... SELECT
+    into the change log and one UPDATE. Returns (rows updated, label-change watermark).
+    Run it inside a transaction so the log and the labels commit together.
+    """
+    serialize_label_changes(conn, changes_table)
+    changing = and_(selection, or_(sensor_table.c.is_leak.is_(None), sensor_table.c.is_leak != is_leak))
+    conn.execute(
+        changes_table.insert().from_select(["sensor_data_id"], select(sensor_table.c.id).where(changing))
+    )
+    updated = conn.execute(sensor_table.update().where(changing).values(is_leak=is_leak)).rowcount
+    watermark = conn.execute(select(func.max(changes_table.c.id))).scalar() or 0
+    return updated, watermark
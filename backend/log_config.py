@@ -0,0 +1,53 @@
+"""Leveled logging for the API process, rate-limited per call site so hot paths can't flood the output."""
+import logging
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Passes at most `burst` records per call site (file and line) every `interval`
+    seconds. The first record let through after a quiet spell says how many were dropped.
+    """
+
+    def __init__(self, interval: float = 10.0, burst: int = 5):
+        super().__init__()
+        self.interval = interval
+        self.burst = max(1, burst)
+        self._sites = {} # (pathname, lineno) -> [window start, passed in window, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.interval <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None:
+                site = self._sites[key] = [now, 0, 0]
+            if now - site[0] >= self.interval:
+                site[0], site[1] = now, 0
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            suppressed, site[2] = site[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar message(s) suppressed]"
+        return True
+
+
+def configure_logging(level: str = "INFO", interval: float = 10.0, burst: int = 5):
+    """Sends this app's log records to stderr through one rate-limited handler (idempotent)."""
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if any(getattr(handler, "_gasleak", False) for handler in root.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RateLimitFilter(interval, burst))
+    handler._gasleak = True
+    root.addHandler(handler)
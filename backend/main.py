@@ -1,84 +1,229 @@
 import os
 import json
+import logging
+import asyncio
+import base64
+import socket
+import threading
+import time
+import warnings
 import datetime
+import uuid
 import numpy as np
-import pandas as pd
-from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Request, status as http_status
+from typing import Literal
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query, status as http_status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, Float, DateTime, String, ForeignKey, Boolean
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from sqlalchemy.ext.declarative import declarative_base
-from pydantic import BaseModel, Field
-import paho.mqtt.client as mqtt
+from fastapi.responses import StreamingResponse
+from sqlalchemy import case, exists, func, or_, select, tuple_
+from sqlalchemy.orm import Session
+from pydantic import BaseModel, Field, field_validator
+import aiomqtt
 import joblib
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report
-from sklearn.preprocessing import StandardScaler
-from sklearn.pipeline import Pipeline
-
-# --- Environment and Database Configuration ---
-load_dotenv() #
-DATABASE_URL = os.getenv("DATABASE_URL") #
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable not set") #
-
-engine = create_engine(DATABASE_URL) #
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine) #
-Base = declarative_base() #
+from database import (
+    engine, create_async_db_engine, create_schema, SessionLocal, SensorData, PredictionResult, LabelChange, IngestSlot, SENSOR_DATA_COLUMNS,
+    ROLLUP_SENSOR_COLUMNS, ROLLUP_GRANULARITIES, SENSOR_ROLLUP_TABLES, PREDICTION_ROLLUP_TABLES,
+)
+from pipeline import AsyncIngestPipeline
+from predictor import MODEL_FEATURE_NAMES, FeaturePacker, ServedModel, StatusThresholds, check_readings
+from temporal_features import STREAM_KEY_FIELD, TemporalFeatureEngine, stream_key
+from partitioning import IngestPartition, SlotLeases, shared_topic
+from broadcast import Broadcaster, to_json
+from export import EXPORT_FORMATS, iter_export
+from downsample import bucket_stats_query, lttb
+from labeling import label_selection, apply_labels, serialize_label_changes
+from retention import RetentionPolicy, RetentionWorker, Rollup
+from metrics import MetricsRegistry
+from log_config import configure_logging
+from training_jobs import TrainingJobConflict, TrainingJobManager
+from model_registry import ModelRegistry, validate_model
+from compiled_model import compile_verified
+
+# --- Logging Configuration ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO") # DEBUG shows one line per MQTT message / prediction
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", "10")) # Seconds per rate-limit window (0 = no limit)
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", "5")) # Records per call site and window before suppression
+configure_logging(LOG_LEVEL, LOG_RATE_INTERVAL, LOG_RATE_BURST)
+logger = logging.getLogger("main")
 
 # --- MQTT Broker Configuration ---
-MQTT_BROKER = "test.mosquitto.org" #
-MQTT_PORT = 1883 #
+MQTT_BROKER = os.getenv("MQTT_BROKER", "test.mosquitto.org") # Host of the broker the master node publishes to
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883")) #
 MQTT_SUBSCRIBE_TOPICS = [ # Topics the backend listens to
     ("master/backend/collection", 0),
     ("master/backend/prediction", 0)
 ]
 MQTT_TOPIC_COLLECTION = "master/backend/collection" # Data for labeling/training
 MQTT_TOPIC_PREDICTION = "master/backend/prediction" # Data for live prediction
+MQTT_RECONNECT_INTERVAL = float(os.getenv("MQTT_RECONNECT_INTERVAL", "5")) # Seconds between reconnect attempts
+
+# --- Scale-out Configuration (several backend processes sharing the MQTT load, see partitioning.py) ---
+INGEST_PARTITIONS = int(os.getenv("INGEST_PARTITIONS", "1")) # Ingest slots the prediction streams are split into (1 = this process handles everything)
+INGEST_PARTITION_ID = os.getenv("INGEST_PARTITION_ID") # Slot this process prefers, 0-based (unset = any free one)
+INGEST_LEASE_TTL = float(os.getenv("INGEST_LEASE_TTL", "15")) # Seconds without a heartbeat before a slot counts as abandoned (hosts' clocks must agree well within it)
+INGEST_HEARTBEAT = float(os.getenv("INGEST_HEARTBEAT", "5")) # Seconds between slot lease renewals
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "gasleak-backend") # Shared-subscription group splitting the collection topic
+MQTT_TOPIC_STREAM_RELAY = f"backend/{MQTT_SHARE_GROUP}/stream" # Rows each process stored, for the /stream clients of the others
+PROCESS_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}" # This process in slot leases and relayed stream events
+
+# --- Ingest Pipeline Configuration ---
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "200")) # Rows per bulk INSERT
+INGEST_MAX_LATENCY = float(os.getenv("INGEST_MAX_LATENCY", "0.5")) # Max seconds a row waits before being flushed
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000")) # Max items per pipeline stage queue before backpressure kicks in
+INGEST_PUT_TIMEOUT = float(os.getenv("INGEST_PUT_TIMEOUT", "5.0")) # Seconds a stage waits on a full queue before dropping
+INGEST_WRITERS = int(os.getenv("INGEST_WRITERS", "2")) # Concurrent bulk INSERT transactions (= async DB pool size)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1)))) # Prediction batches scored concurrently (executor threads)
+
+# --- Prediction Batching Configuration ---
+PREDICT_BATCH_WINDOW = float(os.getenv("PREDICT_BATCH_WINDOW", "0.01")) # Seconds to gather prediction messages into one batch
+PREDICT_BATCH_SIZE = int(os.getenv("PREDICT_BATCH_SIZE", "256")) # Max rows per predict_proba call
+
+# --- Live Stream Configuration ---
+STREAM_CLIENT_BUFFER = int(os.getenv("STREAM_CLIENT_BUFFER", "100")) # Queued events per client before it is dropped as too slow
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15")) # Seconds between keep-alive comments on idle streams
+STREAM_RELAY_BUFFER = int(os.getenv("STREAM_RELAY_BUFFER", "10000")) # Stored rows waiting to be relayed to the other processes (INGEST_PARTITIONS > 1) before new ones are dropped
 
 # --- Constants ---
-MODEL_FILENAME = "gas_leak_model.joblib" # File to save/load the trained model
-
-# --- Database Model (Sensor Data - potentially unlabeled) ---
-class SensorData(Base):
-    """Stores raw aggregated sensor data, intended for labeling or analysis."""
-    __tablename__ = "sensor_data" #
-
-    id = Column(Integer, primary_key=True, index=True) #
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True) # Added index
-    worker_1_mean = Column(Float, nullable=True) #
-    worker_1_min = Column(Integer, nullable=True) #
-    worker_1_max = Column(Integer, nullable=True) #
-    worker_1_variance = Column(Float, nullable=True) #
-    worker_2_mean = Column(Float, nullable=True) #
-    worker_2_min = Column(Integer, nullable=True) #
-    worker_2_max = Column(Integer, nullable=True) #
-    worker_2_variance = Column(Float, nullable=True) #
-    worker_3_mean = Column(Float, nullable=True) #
-    worker_3_min = Column(Integer, nullable=True) #
-    worker_3_max = Column(Integer, nullable=True) #
-    worker_3_variance = Column(Float, nullable=True) #
-    humidity = Column(Float, nullable=True) #
-    temp = Column(Float, nullable=True) #
-    # Label column, updated via API
-    is_leak = Column(Boolean, nullable=True, index=True, default=False) # Default to False
-
-# --- Database Model (Prediction Results) ---
-class PredictionResult(Base):
-    """Stores the results of the gas leak prediction model."""
-    __tablename__ = "predictions" # Table name for predictions
-
-    id = Column(Integer, primary_key=True, index=True)
-    prediction_timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True) # Timestamp of prediction
-    status = Column(String, index=True) # SAFE, WARNING, DANGER
-    probability = Column(Float) # Confidence score (0.0 to 1.0)
-    # Optional: Link back to sensor data if needed
-    # sensor_data_raw = Column(JSONB, nullable=True) # Store the raw input that led to prediction
-
-# Create tables if they don't exist
-Base.metadata.create_all(bind=engine) #
+MODEL_FILENAME = "gas_leak_model.joblib" # Legacy single-file model, imported into the registry on first start
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "model_registry") # Versioned model artifacts + ACTIVE pointer
+MODEL_POINTER_CHECK_INTERVAL = float(os.getenv("MODEL_POINTER_CHECK_INTERVAL", "5")) # Seconds between checks for a model activated by another process
+MODEL_COMPILED = os.getenv("MODEL_COMPILED", "1") != "0" # Serve the compiled tree ensemble (0 = the sklearn pipeline)
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "1") != "0" # Create/upgrade the schema at startup (0 = done separately: python database.py)
+
+# --- Training Worker Configuration ---
+TRAINING_JOBS_DIR = os.getenv("TRAINING_JOBS_DIR", "training_jobs") # Job records + run lock, shared by every API process of a deployment
+TRAINING_CACHE_FILENAME = os.getenv("TRAINING_CACHE_FILENAME", "training_data_cache.npz") # Cached labeled feature matrix
+TRAINING_CHUNK_SIZE = int(os.getenv("TRAINING_CHUNK_SIZE", "50000")) # Rows fetched per cursor chunk when loading training data
+TRAINING_MAX_CORES = int(os.getenv("TRAINING_MAX_CORES", str(max(1, (os.cpu_count() or 2) // 2)))) # CPUs the training worker may use
+TRAINING_MEMORY_LIMIT_MB = int(os.getenv("TRAINING_MEMORY_LIMIT_MB", "0")) # Address-space cap for the worker, split across a search's pool workers (0 = unlimited)
+TRAINING_NICE = int(os.getenv("TRAINING_NICE", "10")) # Lower the worker's CPU priority below the API's
+TRAINING_CV_FOLDS = int(os.getenv("TRAINING_CV_FOLDS", "4")) # Rolling-origin folds of a hyperparameter search run
+TRAINING_LATENCY_WEIGHT = float(os.getenv("TRAINING_LATENCY_WEIGHT", "0.02")) # Search score lost per doubling of per-prediction inference cost
+
+# --- Retention / Rollup Configuration ---
+RETENTION_SENSOR_DAYS = float(os.getenv("RETENTION_SENSOR_DAYS", "0")) # Days to keep unreviewed raw sensor_data rows (never relabeled, not a leak); purged ones leave the training set (0 = forever)
+RETENTION_PREDICTION_DAYS = float(os.getenv("RETENTION_PREDICTION_DAYS", "0")) # Days to keep raw prediction rows (0 = forever)
+RETENTION_MINUTE_ROLLUP_DAYS = float(os.getenv("RETENTION_MINUTE_ROLLUP_DAYS", "0")) # Days to keep per-minute rollups (0 = forever); hourly ones are kept
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "300")) # Seconds between rollup/purge passes
+RETENTION_GRACE = float(os.getenv("RETENTION_GRACE", "60")) # Seconds after a bucket closes before it is rolled up
+RETENTION_DELETE_CHUNK = int(os.getenv("RETENTION_DELETE_CHUNK", "5000")) # Rows per DELETE transaction
+RETENTION_CHUNK_PAUSE = float(os.getenv("RETENTION_CHUNK_PAUSE", "0.05")) # Seconds between DELETE chunks, so ingest writes get in
+
+# --- Retention (rollups into sensor_data_1m/1h and predictions_1m/1h, then purge) ---
+def _rollups(tables: dict) -> list[Rollup]:
+    return [
+        Rollup(tables[suffix], width, RETENTION_MINUTE_ROLLUP_DAYS if suffix == "1m" else None)
+        for suffix, width in ROLLUP_GRANULARITIES.items()
+    ]
+
+_sensor_aggregates = {"sample_count": func.count()}
+for _name in ROLLUP_SENSOR_COLUMNS:
+    _sensor_aggregates.update({
+        f"{_name}_min": func.min(SensorData.__table__.c[_name]),
+        f"{_name}_max": func.max(SensorData.__table__.c[_name]),
+        f"{_name}_avg": func.avg(SensorData.__table__.c[_name]),
+    })
+
+# Predictions scored on arrival; re-scored history (backfill.py) carries its sensor_data_id and is dated in the past
+LIVE_PREDICTIONS = PredictionResult.sensor_data_id.is_(None)
+
+retention_worker = RetentionWorker(
+    engine,
+    policies=[
+        RetentionPolicy(
+            SensorData.__table__, SensorData.__table__.c.timestamp, _sensor_aggregates, _rollups(SENSOR_ROLLUP_TABLES),
+            keep_days=RETENTION_SENSOR_DAYS,
+            # Labeled data is never purged: leaks, and every row a label was set on (logged in label_changes).
+            # Unreviewed readings (ingest stores them as is_leak=False) expire and leave the training set
+            keep_condition=or_(
+                SensorData.is_leak.is_(True),
+                exists().where(LabelChange.sensor_data_id == SensorData.id),
+            ),
+        ),
+        RetentionPolicy(
+            PredictionResult.__table__, PredictionResult.__table__.c.prediction_timestamp,
+            {
+                "prediction_count": func.count(),
+                "safe_count": func.sum(case((PredictionResult.status == "SAFE", 1), else_=0)),
+                "warning_count": func.sum(case((PredictionResult.status == "WARNING", 1), else_=0)),
+                "danger_count": func.sum(case((PredictionResult.status == "DANGER", 1), else_=0)),
+                "probability_min": func.min(PredictionResult.probability),
+                "probability_max": func.max(PredictionResult.probability),
+                "probability_avg": func.avg(PredictionResult.probability),
+            },
+            _rollups(PREDICTION_ROLLUP_TABLES),
+            keep_days=RETENTION_PREDICTION_DAYS,
+            keep_condition=PredictionResult.sensor_data_id.is_not(None), # Re-scored history is not live data: kept, not rolled up
+            rollup_condition=LIVE_PREDICTIONS,
+        ),
+    ],
+    interval=RETENTION_INTERVAL,
+    grace=RETENTION_GRACE,
+    chunk_size=RETENTION_DELETE_CHUNK,
+    pause=RETENTION_CHUNK_PAUSE,
+)
+
+# --- Live Stream Broadcaster (fan-out of newly stored rows to dashboard clients) ---
+broadcaster = Broadcaster(client_buffer=STREAM_CLIENT_BUFFER, heartbeat=STREAM_HEARTBEAT)
+
+stream_relay = asyncio.Queue(STREAM_RELAY_BUFFER) if INGEST_PARTITIONS > 1 else None # Each process stores only its share
+
+def publish_flushed_rows(table, rows: list[dict]):
+    """Ingest flush listener: pushes every newly stored row to live stream subscribers, here and in the other processes."""
+    event = "sensor_data" if table is SensorData.__table__ else "prediction"
+    for row in rows:
+        broadcaster.publish(event, row)
+        if stream_relay is not None:
+            try:
+                stream_relay.put_nowait((event, row))
+            except asyncio.QueueFull:
+                STREAM_RELAY_DROPPED.inc()
+
+async def relay_stream_events(mqtt_client: aiomqtt.Client):
+    """Publishes the rows this process stored on the relay topic (runs while the MQTT client is connected)."""
+    while True:
+        event, row = await stream_relay.get()
+        await mqtt_client.publish(MQTT_TOPIC_STREAM_RELAY, to_json({"origin": PROCESS_ID, "event": event, "data": row}))
+
+def receive_stream_relay(payload: bytes):
+    """Forwards a row another process stored to this process's live stream subscribers."""
+    try:
+        message = json.loads(payload)
+        if message["origin"] != PROCESS_ID:
+            broadcaster.publish(message["event"], message["data"])
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning("Ignoring malformed stream relay message: %s", e)
+
+# --- Metrics (Prometheus text format on /metrics) ---
+metrics = MetricsRegistry()
+MESSAGES_RECEIVED = metrics.counter("gasleak_mqtt_messages_total", "MQTT messages received, by topic.", ("topic",))
+MESSAGES_FAILED = metrics.counter("gasleak_mqtt_messages_failed_total", "MQTT messages that could not be processed, by reason.", ("reason",))
+MESSAGES_NOT_OWNED = metrics.counter("gasleak_mqtt_messages_not_owned_total", "Prediction messages left to the backend process owning their stream.")
+STREAM_RELAY_DROPPED = metrics.counter("gasleak_stream_relay_dropped_total", "Stored rows not relayed to the other processes' live streams (relay buffer full).")
+PLACEHOLDER_FALLBACKS = metrics.counter("gasleak_placeholder_predictions_total", "Rows scored by the placeholder rules instead of the model, by reason.", ("reason",))
+JSON_DECODE_SECONDS = metrics.histogram("gasleak_json_decode_seconds", "Time to decode one MQTT payload.")
+FEATURE_SECONDS = metrics.histogram("gasleak_feature_engineering_seconds", "Time to build the features of one prediction batch.")
+PREDICT_SECONDS = metrics.histogram("gasleak_predict_proba_seconds", "Time of one predict_proba call (one batch).")
+PREDICT_BATCH_ROWS = metrics.histogram("gasleak_prediction_batch_rows", "Rows per scored prediction batch.", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+DB_COMMIT_SECONDS = metrics.histogram("gasleak_db_commit_seconds", "Time of one bulk INSERT transaction.")
+MESSAGE_LATENCY_SECONDS = metrics.histogram("gasleak_message_latency_seconds", "Seconds from MQTT receipt to the committed row, by table.", ("table",))
+
+def build_sensor_row(payload_dict: dict) -> dict:
+    """Turns a collection payload into a full sensor_data row (same keys for every row, as executemany needs)."""
+    unknown = set(payload_dict) - set(SENSOR_DATA_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown sensor_data fields: {sorted(unknown)}")
+    row = {col: payload_dict.get(col) for col in SENSOR_DATA_COLUMNS}
+    key = payload_dict.get(STREAM_KEY_FIELD)
+    row[STREAM_KEY_FIELD] = None if key is None else str(key) # Same stream key as the prediction payloads
+    row['timestamp'] = datetime.datetime.utcnow() # Time of receipt, not time of flush
+    row['is_leak'] = False # Explicitly set as not a leak
+    return row
+
+def naive_utc(value: datetime.datetime | None) -> datetime.datetime | None:
+    """Query timestamps as the tables store them: naive UTC (an offset, e.g. '...Z', is converted away)."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
 
 # --- Pydantic Models (for API validation and response) ---
 class SensorDataResponse(BaseModel): # For sending SensorData out via API
@@ -98,6 +243,7 @@ class SensorDataResponse(BaseModel): # For sending SensorData out via API
     worker_3_variance: float | None = None #
     humidity: float | None = None #
     temp: float | None = None #
+    master_id: str | None = None # Master node (stream) the reading came from
     is_leak: bool | None = None # Include the label
 
     class Config:
@@ -108,6 +254,8 @@ class PredictionResponse(BaseModel): # For sending PredictionResult out via API
     prediction_timestamp: datetime.datetime
     status: str
     probability: float
+    sensor_data_id: int | None = None # Set on re-scored history (see backfill.py)
+    model_version: str | None = None
 
     class Config:
         from_attributes = True
@@ -115,10 +263,68 @@ class PredictionResponse(BaseModel): # For sending PredictionResult out via API
 class TrainingStatusResponse(BaseModel): # For /train-model and /model-status responses
     message: str
     model_exists: bool = False
+    job_id: str | None = None # Started (or currently running) training job, if any
+    active_version: str | None = None # Model version currently served
+
+class ModelVersionResponse(BaseModel): # For /models
+    version: str
+    active: bool = False
+    created_at: str | None = None
+    metrics: dict | None = None
+
+class TrainingJobResponse(BaseModel): # For /train-jobs status polling
+    job_id: str
+    status: str # queued, running, succeeded, failed
+    stage: str | None = None # e.g. 'loading data', 'fitting model'
+    progress: float = 0.0 # 0.0 to 1.0
+    created_at: datetime.datetime
+    started_at: datetime.datetime | None = None
+    finished_at: datetime.datetime | None = None
+    error: str | None = None
+    result: dict | None = None # Evaluation summary of a succeeded job
 
 class LabelUpdateRequest(BaseModel): # For receiving label updates via API
     is_leak: bool # Expecting {"is_leak": true} or {"is_leak": false}
 
+MAX_BULK_LABEL_IDS = 10000 # Upper bound on ids per bulk label request (keeps the IN list within driver limits)
+
+class SensorThreshold(BaseModel): # Optional value filter for bulk labeling (inclusive bounds)
+    column: Literal[
+        'worker_1_mean', 'worker_1_min', 'worker_1_max', 'worker_1_variance',
+        'worker_2_mean', 'worker_2_min', 'worker_2_max', 'worker_2_variance',
+        'worker_3_mean', 'worker_3_min', 'worker_3_max', 'worker_3_variance',
+        'humidity', 'temp',
+    ]
+    min: float | None = None
+    max: float | None = None
+
+class BulkLabelRequest(BaseModel): # Label many rows at once: by ids and/or a time range, optionally filtered
+    is_leak: bool
+    ids: list[int] | None = Field(None, max_length=MAX_BULK_LABEL_IDS)
+    start: datetime.datetime | None = None # Inclusive
+    end: datetime.datetime | None = None # Exclusive
+    thresholds: list[SensorThreshold] = []
+
+    _naive_utc = field_validator('start', 'end')(naive_utc) # Compared with the stored (naive UTC) timestamps
+
+class BulkLabelResponse(BaseModel):
+    updated: int # Rows whose label actually changed
+    label_watermark: int # Latest label-change id (what training caches compare against)
+
+class TimeBucketsResponse(BaseModel): # For /timeseries (bucketed min/max/mean per series)
+    start: datetime.datetime
+    end: datetime.datetime
+    bucket_seconds: float
+    # One entry per non-empty bucket: bucket_start, sensor_count, prediction_count and
+    # '<series>_min' / '<series>_max' / '<series>_mean' for every series
+    buckets: list[dict[str, datetime.datetime | float | int | None]]
+
+class DownsampledSeriesResponse(BaseModel): # For /timeseries/lttb (shape-preserving point selection)
+    field: str
+    total_points: int
+    timestamps: list[datetime.datetime]
+    values: list[float]
+
 # --- FastAPI Application Setup ---
 app = FastAPI(title="IoT Gas Leak Backend") # Updated title
 
@@ -129,6 +335,7 @@ app.add_middleware(
     allow_credentials=True, #
     allow_methods=["*", "PUT", "PATCH"], # Allow all standard methods + PUT/PATCH for updates
     allow_headers=["*"], #
+    expose_headers=["X-Next-Cursor"], # Let the browser read pagination cursors
 )
 
 # --- Database Session Dependency ---
@@ -140,77 +347,161 @@ def get_db(): #
     finally:
         db.close() # Ensure session is closed
 
-# --- Global variable for the ML model ---
-ml_pipeline = None
+# --- Global variables for the ML model ---
+served_model = None # ServedModel(pipeline, version, feature_idx, thresholds) currently in use
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR)
+_model_lock = threading.Lock() # Serializes loads/swaps (readers just take a reference)
 
 # --- ML Model Loading ---
-def load_model():
-    """Loads the trained model from disk if it exists."""
-    global ml_pipeline
-    if os.path.exists(MODEL_FILENAME):
+def import_legacy_model():
+    """Publishes and activates the old single-file model when the registry is still empty."""
+    if model_registry.versions() or not os.path.exists(MODEL_FILENAME):
+        return
+    try:
+        legacy = joblib.load(MODEL_FILENAME)
+        legacy_features = validate_model(legacy, MODEL_FEATURE_NAMES)
         try:
-            ml_pipeline = joblib.load(MODEL_FILENAME)
-            print(f" Successfully loaded model from {MODEL_FILENAME}")
-        except Exception as e:
-            print(f" Error loading model '{MODEL_FILENAME}': {e}")
-            ml_pipeline = None
-    else:
-        print(f" Model file '{MODEL_FILENAME}' not found. Prediction will use placeholder logic.")
-        ml_pipeline = None
+            compiled = compile_verified(legacy)
+        except ValueError as e:
+            compiled = None
+            logger.warning("Could not compile legacy model '%s' (%s); it will be served by sklearn.", MODEL_FILENAME, e)
+        version = model_registry.publish(legacy, compiled=compiled, metadata={"imported_from": MODEL_FILENAME, "feature_names": legacy_features})
+        model_registry.activate(version)
+        logger.info("Imported legacy model '%s' into the registry as %s.", MODEL_FILENAME, version)
+    except Exception as e:
+        logger.error("Could not import legacy model '%s': %s", MODEL_FILENAME, e)
 
-# --- ML Prediction Logic ---
-# Features used by the model (MUST match training script)
-FEATURE_NAMES = [
-    'worker_1_mean', 'worker_1_min', 'worker_1_max', 'worker_1_variance',
-    'worker_2_mean', 'worker_2_min', 'worker_2_max', 'worker_2_variance',
-    'worker_3_mean', 'worker_3_min', 'worker_3_max', 'worker_3_variance',
-    'humidity', 'temp',
-    'spatial_variance', 'max_all_sensors', 'avg_all_sensors' # Engineered features
-]
+def served_version() -> str | None:
+    model = served_model
+    return model.version if model is not None else None
 
-def run_ml_prediction(data_dict: dict) -> tuple[str, float]:
+def load_serving_model(version: str):
     """
-    Performs feature engineering and runs prediction using the loaded ML model or a placeholder.
-    Returns (status_string, probability_float).
+    The compiled form of a version when there is one (MODEL_COMPILED), compiled now for
+    versions published without it, and the sklearn pipeline when it cannot be compiled.
     """
-    global ml_pipeline
-
-    # 1. Engineer Features (ensure consistency with training)
-    w_means = [ data_dict.get(f, 0) or 0 for f in ['worker_1_mean', 'worker_2_mean', 'worker_3_mean'] ]
-    # Handle case where means might be None or 0
-    data_dict['spatial_variance'] = np.var(w_means) if any(w_means) else 0.0
-    data_dict['max_all_sensors'] = np.max(w_means) if any(w_means) else 0.0
-    data_dict['avg_all_sensors'] = np.mean(w_means) if any(w_means) else 0.0
+    compiled = model_registry.load_compiled(version, mmap=True) if MODEL_COMPILED else None
+    if compiled is not None:
+        return compiled
+    pipeline = model_registry.load(version, mmap=True)
+    if MODEL_COMPILED:
+        try:
+            return compile_verified(pipeline)
+        except ValueError as e:
+            logger.info("Serving model version %s through sklearn: %s", version, e)
+    return pipeline
 
-    # 2. Prepare Input DataFrame (handle missing values)
-    input_data = {feat: [data_dict.get(feat, 0) or 0] for feat in FEATURE_NAMES} # Default missing to 0
-    input_df = pd.DataFrame(input_data)
+def load_model(version: str | None = None) -> bool:
+    """
+    Loads the given (default: active) registry version, memory-mapped, validates it
+    against MODEL_FEATURE_NAMES and swaps it in. On any failure the current model keeps serving.
+    With an explicit `version`, the ACTIVE pointer is moved only after validation passed.
+    """
+    global served_model
+    with _model_lock:
+        target = version or model_registry.active_version()
+        if target is None:
+            logger.warning("No active model in registry '%s'. Prediction will use placeholder logic.", MODEL_REGISTRY_DIR)
+            return False
+        try:
+            pipeline = load_serving_model(target)
+            model_features = validate_model(pipeline, MODEL_FEATURE_NAMES)
+        except Exception as e:
+            logger.error("Error loading model version %s: %s. Keeping version %s.", target, e, served_version())
+            return False
+        if version is not None:
+            model_registry.activate(version)
+        # Columns of the packed matrix this model reads (older models use fewer features)
+        feature_idx = None if model_features == MODEL_FEATURE_NAMES else np.array([MODEL_FEATURE_NAMES.index(f) for f in model_features])
+        thresholds = StatusThresholds(**model_registry.metadata(target).get("thresholds", {})) # Tuned by a search run, else the defaults
+        served_model = ServedModel(pipeline, target, feature_idx, thresholds) # Single reference swap; in-flight batches keep the old one
+        logger.info("Successfully loaded model version %s from %s", target, MODEL_REGISTRY_DIR)
+        return True
+
+async def model_pointer_loop():
+    """
+    Picks up an ACTIVE pointer moved by another process (another replica, trainer.py
+    --activate) every MODEL_POINTER_CHECK_INTERVAL seconds, whether or not this process
+    is scoring anything. Loads run in a thread, off the event loop and the scoring executor.
+    """
+    while True:
+        await asyncio.sleep(MODEL_POINTER_CHECK_INTERVAL)
+        try:
+            active = await asyncio.to_thread(model_registry.active_version)
+            if active is not None and active != served_version():
+                await asyncio.to_thread(load_model)
+        except Exception as e:
+            logger.error("Could not check the active model version: %s", e)
 
-    # 3. Predict using loaded pipeline (if available)
-    if ml_pipeline is not None:
+# --- ML Prediction Logic ---
+feature_packer = FeaturePacker(MODEL_FEATURE_NAMES) # Packs payloads straight into the model's input matrix
+temporal_engine = TemporalFeatureEngine() # Rolling per-stream history for the temporal features
+
+# Predict_proba is called with a NumPy matrix; the pipeline was fitted on a DataFrame, which is harmless
+warnings.filterwarnings("ignore", message="X does not have valid feature names", category=UserWarning)
+
+def classify_probability(leak_probability: float, thresholds: StatusThresholds = StatusThresholds()) -> str:
+    """Determine status based on the model's probability thresholds."""
+    if leak_probability > thresholds.danger:  # High confidence leak
+        return "DANGER"
+    elif leak_probability > thresholds.warning: # Medium confidence leak
+        return "WARNING"
+    else: # Low confidence leak
+        return "SAFE"
+
+def score_feature_matrix(X: np.ndarray, rows: list[dict]) -> list[tuple[str, float, str | None]]:
+    """
+    Scores a packed feature matrix (one row per payload in `rows`) with a single
+    predict_proba call, falling back to the placeholder rules per row.
+    Returns one (status_string, probability_float, model_version) per row (version None for the placeholder).
+    """
+    model = served_model # Local reference, so a concurrent reload can't swap it mid-batch
+    PREDICT_BATCH_ROWS.observe(len(rows))
+    if model is not None:
         try:
+            if model.feature_idx is not None:
+                X = X[:, model.feature_idx]
             # Predict probability for each class: [P(class_0), P(class_1)]
-            probabilities = ml_pipeline.predict_proba(input_df)[0]
-            leak_probability = probabilities[1] # Probability of leak (class 1)
-
-            # Determine status based on probability threshold (adjust as needed)
-            if leak_probability > 0.7:  # High confidence leak
-                status = "DANGER"
-            elif leak_probability > 0.4: # Medium confidence leak
-                status = "WARNING"
-            else: # Low confidence leak
-                status = "SAFE"
-
-            print(f" Model Prediction - Status: {status}, Probability: {leak_probability:.4f}")
-            return status, float(leak_probability) # Ensure float
-
+            with PREDICT_SECONDS.time():
+                leak_probabilities = model.pipeline.predict_proba(X)[:, 1].tolist() # Probability of leak (class 1)
+            results = [(classify_probability(p, model.thresholds), p, model.version) for p in leak_probabilities]
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Model prediction - scored %d row(s), max probability: %.4f", len(results), max(leak_probabilities))
+            return results
         except Exception as e:
-            print(f" Error during model prediction: {e}. Falling back to placeholder.")
-            # Fallback if prediction fails for any reason
-            return run_placeholder_prediction(data_dict)
+            PLACEHOLDER_FALLBACKS.labels("error").inc(len(rows))
+            logger.error("Error during model prediction: %s. Falling back to placeholder.", e)
     else:
-        # Fallback if model isn't loaded
-        return run_placeholder_prediction(data_dict)
+        PLACEHOLDER_FALLBACKS.labels("no_model").inc(len(rows))
+    # Fallback if model isn't loaded or prediction failed for any reason
+    return [run_placeholder_prediction(row) + (None,) for row in rows]
+
+def update_temporal_state(rows: list[dict], received_ats: list[float]):
+    """Feeds a batch of prediction payloads into the rolling history, in arrival order."""
+    for row, received_at in zip(rows, received_ats):
+        temporal_engine.update(row, received_at)
+
+_pack_buffers = threading.local() # One preallocated feature matrix per inference thread, reused for every batch
+
+def score_payloads(rows: list[dict]) -> list[tuple[str, float, str | None]]:
+    """Packs and scores a batch of payloads whose temporal features are already set (runs in an executor thread)."""
+    with FEATURE_SECONDS.time():
+        buffer = getattr(_pack_buffers, "matrix", None)
+        if buffer is None:
+            buffer = _pack_buffers.matrix = feature_packer.empty(PREDICT_BATCH_SIZE)
+        X = feature_packer.pack(rows, out=buffer) # A view of the buffer: scored before this thread packs again
+    return score_feature_matrix(X, rows)
+
+def run_ml_prediction(data_dict: dict) -> tuple[str, float]:
+    """
+    Performs feature engineering and runs prediction using the loaded ML model or a placeholder.
+    Returns (status_string, probability_float).
+    """
+    with FEATURE_SECONDS.time():
+        temporal_engine.update(data_dict, time.time())
+        X = feature_packer.pack([data_dict])
+    status, probability, _ = score_feature_matrix(X, [data_dict])[0]
+    return status, probability
 
 def run_placeholder_prediction(data_dict: dict) -> tuple[str, float]:
     """Simple rule-based placeholder if no ML model is loaded."""
@@ -225,197 +516,300 @@ def run_placeholder_prediction(data_dict: dict) -> tuple[str, float]:
     else:
         return "SAFE", 0.05
 
-# --- Background Model Training Task ---
-def train_model_task():
-    """Fetches LABELED data, trains, evaluates, and saves the model pipeline."""
-    global ml_pipeline
-    print("\n Starting background model training task...")
-    db: Session | None = None # Ensure db is defined for finally block
-    try:
-        db = SessionLocal()
-        # 1. Fetch ALL labeled/unlabeled data (adjust query if needed, e.g., filter by timestamp)
-        # We need both is_leak=True and is_leak=False examples
-        data_query = db.query(SensorData).filter(SensorData.is_leak != None).order_by(SensorData.timestamp).all()
-
-        if not data_query or len(data_query) < 20: # Need a reasonable amount of data
-            print(" Not enough labeled data found in 'sensor_data' table for training (need at least 20 rows).")
-            return
-
-        # 2. Convert to DataFrame
-        df = pd.DataFrame([vars(s) for s in data_query])
-        df = df.drop(columns=['id', '_sa_instance_state'], errors='ignore') # Clean up SQLAlchemy state
-
-        # 3. Ensure Labels Exist and Convert
-        if TARGET_COLUMN not in df.columns:
-             print(f" ERROR: Target column '{TARGET_COLUMN}' missing. Training aborted.")
-             return
-        df = df.dropna(subset=[TARGET_COLUMN]) # Remove rows where label is explicitly NULL
-        df[TARGET_COLUMN] = df[TARGET_COLUMN].astype(int) # Convert True/False/1/0 to integer
-
-        # Check for both classes
-        label_counts = df[TARGET_COLUMN].value_counts()
-        print("\n Label Distribution for Training:")
-        print(label_counts)
-        if len(label_counts) < 2 or 1 not in label_counts or 0 not in label_counts:
-             print(f" ERROR: Training requires examples of both '{TARGET_COLUMN}=0' and '{TARGET_COLUMN}=1'. Found: {list(label_counts.index)}. Aborting.")
-             return
-
-        # 4. Feature Engineering (MUST MATCH PREDICTION)
-        print(" Performing feature engineering...")
-        df['spatial_variance'] = df[['worker_1_mean', 'worker_2_mean', 'worker_3_mean']].var(axis=1, skipna=True).fillna(0)
-        df['max_all_sensors'] = df[['worker_1_mean', 'worker_2_mean', 'worker_3_mean']].max(axis=1, skipna=True).fillna(0)
-        df['avg_all_sensors'] = df[['worker_1_mean', 'worker_2_mean', 'worker_3_mean']].mean(axis=1, skipna=True).fillna(0)
-        # --- Add TEMPORAL features here if desired (e.g., using .diff()) ---
-
-        # 5. Prepare data for model (Handle NaNs in features)
-        X = df[FEATURE_NAMES].fillna(0) # Fill any missing sensor readings with 0
-        y = df[TARGET_COLUMN]
-
-        # 6. Temporal Train/Test Split (Important!)
-        print(" Splitting data temporally (80% train, 20% test)...")
-        split_index = int(len(X) * 0.8)
-        X_train, X_test = X.iloc[:split_index], X.iloc[split_index:]
-        y_train, y_test = y.iloc[:split_index], y.iloc[split_index:]
-
-        if X_train.empty or X_test.empty:
-            print(" Not enough data for a meaningful train/test split after filtering.")
-            return
-
-        print(f"   Train set size: {len(X_train)}")
-        print(f"   Test set size: {len(X_test)}")
-
-        # 7. Define and Train Model Pipeline
-        print(" Defining model pipeline (StandardScaler + RandomForest)...")
-        pipeline = Pipeline([
-            ('scaler', StandardScaler()), # Scale features
-            ('classifier', RandomForestClassifier( # Train RandomForest
-                n_estimators=100,          # More trees generally better, but slower
-                random_state=42,           # For reproducibility
-                class_weight='balanced',   # Crucial for imbalanced datasets
-                n_jobs=-1                  # Use all CPU cores
-             ))
-        ])
-
-        print(" Training the model pipeline...")
-        pipeline.fit(X_train, y_train)
-        print(" Training complete.")
-
-        # 8. Evaluate Model on Test Set
-        print("\n Evaluating model on the unseen test set...")
-        y_pred_test = pipeline.predict(X_test)
-        print("\n Classification Report (Test Set):")
-        # Ensure target names match your classes (0 and 1)
-        print(classification_report(y_test, y_pred_test, target_names=['No Leak (0)', 'Leak (1)'], zero_division=0))
-
-        # 9. Save the Trained Pipeline
-        print(f"\n Saving the trained pipeline to {MODEL_FILENAME}...")
-        joblib.dump(pipeline, MODEL_FILENAME)
-        print(f" Model pipeline saved successfully.")
-
-        # 10. Reload the newly trained model for immediate use
-        load_model()
+# --- Background Model Training (separate worker process) ---
+def on_training_succeeded(result: dict):
+    """Called in the API process when a training worker has published a new model version."""
+    logger.info("Training finished (accuracy %.3f), activating model version %s...", result['accuracy'], result['version'])
+    if not load_model(result['version']):
+        raise RuntimeError(f"model version {result['version']} failed validation and was not activated")
+
+training_jobs = TrainingJobManager(
+    job_kwargs={
+        "registry_dir": MODEL_REGISTRY_DIR,
+        "cache_path": TRAINING_CACHE_FILENAME,
+        "chunk_size": TRAINING_CHUNK_SIZE,
+        "max_cores": TRAINING_MAX_CORES,
+        "memory_limit_mb": TRAINING_MEMORY_LIMIT_MB or None,
+        "nice": TRAINING_NICE,
+        "cv_folds": TRAINING_CV_FOLDS,
+        "latency_weight": TRAINING_LATENCY_WEIGHT,
+    },
+    state_dir=TRAINING_JOBS_DIR,
+    on_success=on_training_succeeded,
+)
 
-    except Exception as e:
-        print(f" An error occurred during training: {e}")
-    finally:
-        if db:
-            db.close() # Ensure DB session is closed
 
+# --- Ingest Pipeline (decode -> scoring -> bulk writes, see pipeline.py) ---
+def prediction_row(data_dict: dict, status: str, probability: float, model_version: str | None = None) -> tuple:
+    """The predictions row for one scored payload (called by the pipeline's scoring stage)."""
+    logger.debug("Scored prediction (Status: %s, Prob: %.3f)", status, probability)
+    row = {
+        'prediction_timestamp': datetime.datetime.utcnow(),
+        'status': status,
+        'probability': probability,
+        'model_version': model_version,
+    }
+    return PredictionResult.__table__, row
 
-# --- MQTT Client Logic ---
-def on_connect(client, userdata, flags, rc):
-    """Callback when MQTT connection is established."""
-    if rc == 0:
-        print(" Connected to MQTT Broker!")
-        res, _ = client.subscribe(MQTT_SUBSCRIBE_TOPICS) # Subscribe to list
-        if res == mqtt.MQTT_ERR_SUCCESS:
-            print(f" Subscribed to topics: {[t[0] for t in MQTT_SUBSCRIBE_TOPICS]}")
-        else:
-            print(f" Failed to subscribe to topics, error code: {res}")
-    else:
-        print(f" Failed to connect to MQTT, return code {rc}")
-
-def on_message(client, userdata, msg):
-    """Callback when an MQTT message is received on a subscribed topic."""
-    topic = msg.topic
-    print(f"\n Message received on topic '{topic}'")
-    db: Session | None = None
+async def handle_message(topic: str, payload: bytes, received_at: float):
+    """
+    Decode stage for one MQTT message: collection rows go straight to the writers,
+    prediction payloads to the scoring stage.
+    """
+    MESSAGES_RECEIVED.labels(topic).inc()
+    logger.debug("Message received on topic '%s'", topic)
     try:
-        payload_dict = json.loads(msg.payload.decode('utf-8'))
-        # print("   Payload:", payload_dict) # Uncomment for detailed debugging
+        with JSON_DECODE_SECONDS.time():
+            payload_dict = json.loads(payload.decode('utf-8'))
+        # logger.debug("Payload: %s", payload_dict) # Uncomment for detailed debugging
 
-        db = SessionLocal() # Get DB session
+        check_readings(payload_dict) # A malformed reading rejects this message only (ValueError below)
 
         # --- Handle Data Collection Topic ---
         if topic == MQTT_TOPIC_COLLECTION:
             # Remove label if accidentally sent from master, default to False
             payload_dict.pop('is_leak', None)
-            db_data = SensorData(**payload_dict)
-            db_data.is_leak = False # Explicitly set as not a leak
-            db.add(db_data)
-            db.commit()
-            db.refresh(db_data)
-            print(f"    Saved data for collection (ID: {db_data.id})")
+            row = build_sensor_row(payload_dict)
+            if await pipeline.persist(SensorData.__table__, row, received_at):
+                logger.debug("Queued data for collection")
 
         # --- Handle Data Prediction Topic ---
         elif topic == MQTT_TOPIC_PREDICTION:
-            # Run prediction logic
-            status, probability = run_ml_prediction(payload_dict)
-
-            # Save the prediction result
-            db_prediction = PredictionResult(
-                status=status,
-                probability=probability
-                # Optional: Store raw data too: sensor_data_raw=payload_dict
-            )
-            db.add(db_prediction)
-            db.commit()
-            db.refresh(db_prediction)
-            print(f"    Saved prediction result (ID: {db_prediction.id}, Status: {status}, Prob: {probability:.3f})")
+            # Every process receives all prediction payloads and scores only the streams it owns
+            if not ingest_partition.owns(stream_key(payload_dict)):
+                MESSAGES_NOT_OWNED.inc()
+                return
+            # Scored in micro-batches; the result row is queued for the writers
+            await pipeline.score(payload_dict, received_at)
 
         else:
-            print(f"    Received message on unhandled topic: {topic}")
-
-    except json.JSONDecodeError:
-        print("    Error: Could not decode JSON from payload.")
+            MESSAGES_FAILED.labels("unhandled_topic").inc()
+            logger.warning("Received message on unhandled topic: %s", topic)
+
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        MESSAGES_FAILED.labels("decode_error").inc()
+        logger.warning("Could not decode JSON from payload on topic '%s'.", topic)
+    except ValueError as e:
+        MESSAGES_FAILED.labels("invalid_payload").inc()
+        logger.warning("Rejected payload on topic '%s': %s", topic, e)
     except Exception as e:
-        print(f"    An error occurred processing message: {e}")
-        if db:
-            db.rollback() # Rollback DB changes on error
-    finally:
-        if db:
-            db.close() # Always close session
+        MESSAGES_FAILED.labels("error").inc()
+        logger.error("An error occurred processing message: %s", e)
+
+pipeline = AsyncIngestPipeline(
+    handle_message,
+    prepare_batch=update_temporal_state,
+    score_batch=score_payloads,
+    result_row=prediction_row,
+    inference_workers=INFERENCE_WORKERS,
+    writer_workers=INGEST_WRITERS,
+    queue_size=INGEST_QUEUE_SIZE,
+    put_timeout=INGEST_PUT_TIMEOUT,
+    batch_window=PREDICT_BATCH_WINDOW,
+    max_batch=PREDICT_BATCH_SIZE,
+    flush_size=INGEST_FLUSH_SIZE,
+    flush_max_latency=INGEST_MAX_LATENCY,
+    on_flush=publish_flushed_rows,
+    commit_timer=DB_COMMIT_SECONDS,
+    row_latency=MESSAGE_LATENCY_SECONDS,
+)
+
+# Counters the components keep themselves, read at scrape time
+metrics.counter_function("gasleak_ingest_rows_written_total", "Rows committed by the ingest writers.", lambda: pipeline.rows_written)
+metrics.counter_function("gasleak_ingest_rows_dropped_total", "Rows dropped because the write queue stayed full.", lambda: pipeline.rows_dropped)
+metrics.counter_function("gasleak_ingest_rows_failed_total", "Rows dropped after an insert error.", lambda: pipeline.rows_failed)
+metrics.counter_function("gasleak_mqtt_messages_dropped_total", "MQTT messages dropped because the message queue stayed full.", lambda: pipeline.messages_dropped)
+metrics.gauge_function("gasleak_ingest_queue_rows", "Rows waiting for the ingest writers.", lambda: pipeline.queue_sizes().get("rows", 0))
+metrics.gauge_function("gasleak_mqtt_queue_messages", "MQTT messages waiting to be decoded.", lambda: pipeline.queue_sizes().get("messages", 0))
+metrics.gauge_function("gasleak_prediction_queue_payloads", "Prediction payloads waiting to be scored.", lambda: pipeline.queue_sizes().get("payloads", 0))
+metrics.counter_function("gasleak_predictions_scored_total", "Prediction payloads scored.", lambda: pipeline.payloads_scored)
+metrics.counter_function("gasleak_prediction_payloads_dropped_total", "Prediction payloads dropped because the queue stayed full.", lambda: pipeline.payloads_dropped)
+metrics.counter_function("gasleak_prediction_payloads_failed_total", "Prediction payloads lost because their batch could not be scored.", lambda: pipeline.payloads_failed)
+metrics.gauge_function("gasleak_stream_clients", "Connected live-stream clients.", lambda: broadcaster.subscriber_count())
+metrics.counter_function("gasleak_stream_slow_clients_dropped_total", "Live-stream clients dropped as too slow.", lambda: broadcaster.slow_consumers_dropped)
+metrics.gauge_function("gasleak_model_loaded", "1 if a trained model is serving, 0 if the placeholder is.", lambda: served_model is not None)
+metrics.gauge_function("gasleak_ingest_slots_held", "Ingest slots whose prediction streams this process scores (held, or being handed over).", lambda: len(ingest_partition.slots))
+metrics.gauge_function("gasleak_ingest_slots_uncovered", "Ingest slots no live process could claim at the last lease renewal.", lambda: slot_leases.uncovered if slot_leases else 0)
+metrics.counter_function("gasleak_retention_rows_purged_total", "Raw rows deleted by retention.", lambda: retention_worker.rows_purged)
+
+# --- MQTT Client Logic ---
+ingest_partition = IngestPartition(INGEST_PARTITIONS, slots=(0,) if INGEST_PARTITIONS <= 1 else ()) # Slots come from the leases below
+slot_leases = SlotLeases(
+    engine, IngestSlot.__table__, INGEST_PARTITIONS, PROCESS_ID,
+    preferred=int(INGEST_PARTITION_ID) if INGEST_PARTITION_ID else None, ttl=INGEST_LEASE_TTL,
+) if INGEST_PARTITIONS > 1 else None
+
+async def apply_ingest_slots(slots: set[int], leader: bool):
+    """Scores the streams of `slots` from now on; the `leader` (holder of slot 0) runs retention."""
+    if slots != ingest_partition.slots:
+        logger.info("Ingest slots scored: %s of %d.", sorted(slots), ingest_partition.count)
+    ingest_partition.assign(slots)
+    if leader:
+        retention_worker.start() # Background rollups/purges (one process per deployment)
+    elif retention_worker.running:
+        await asyncio.to_thread(retention_worker.stop)
+
+async def slot_lease_loop():
+    """
+    Renews this process's slot leases every INGEST_HEARTBEAT seconds, claiming the slots
+    of processes that stopped. Without a renewal for INGEST_LEASE_TTL seconds (database
+    unreachable), the slots are given up locally: another process may own them by now.
+    """
+    renewed_at = time.monotonic()
+    while True:
+        try:
+            await asyncio.to_thread(slot_leases.renew)
+            renewed_at = time.monotonic()
+            if slot_leases.uncovered:
+                logger.warning("%d of %d ingest slots could not be claimed: their prediction streams are not scored.",
+                               slot_leases.uncovered, INGEST_PARTITIONS)
+            slots, leader = slot_leases.scored, 0 in slot_leases.held
+        except Exception as e:
+            logger.error("Could not renew ingest slot leases: %s", e)
+            if time.monotonic() - renewed_at >= INGEST_LEASE_TTL:
+                slots, leader = set(), False
+            else:
+                slots, leader = ingest_partition.slots, retention_worker.running
+        await apply_ingest_slots(slots, leader)
+        await asyncio.sleep(INGEST_HEARTBEAT)
+
+def mqtt_subscriptions() -> list[tuple[str, int]]:
+    """
+    Topic filters for this process. With several partitions the broker splits the
+    collection topic (shared subscription), while every process subscribes to the whole
+    prediction topic and keeps the streams it owns, so rolling features stay in one place,
+    and to the stream relay, so /stream carries every process's rows.
+    """
+    if ingest_partition.count <= 1:
+        return MQTT_SUBSCRIBE_TOPICS
+    qos = dict(MQTT_SUBSCRIBE_TOPICS)
+    return [
+        (shared_topic(MQTT_TOPIC_COLLECTION, MQTT_SHARE_GROUP), qos[MQTT_TOPIC_COLLECTION]),
+        (MQTT_TOPIC_PREDICTION, qos[MQTT_TOPIC_PREDICTION]),
+        (MQTT_TOPIC_STREAM_RELAY, 0),
+    ]
+
+async def mqtt_receive_loop():
+    """
+    Receives MQTT messages on the event loop and hands them to the pipeline (which only
+    ever waits for queue space). Reconnects after connection errors.
+    """
+    while True:
+        relay_task = None
+        try:
+            async with aiomqtt.Client(MQTT_BROKER, MQTT_PORT, keepalive=60) as mqtt_client:
+                logger.info("Connected to MQTT Broker!")
+                subscriptions = mqtt_subscriptions()
+                await mqtt_client.subscribe(subscriptions) # Subscribe to list
+                logger.info("Subscribed to topics: %s", [t[0] for t in subscriptions])
+                if stream_relay is not None:
+                    relay_task = asyncio.create_task(relay_stream_events(mqtt_client), name="stream-relay")
+                async for message in mqtt_client.messages:
+                    if message.topic.value == MQTT_TOPIC_STREAM_RELAY:
+                        receive_stream_relay(message.payload) # Already stored by another process
+                        continue
+                    await pipeline.receive(message.topic.value, message.payload)
+        except aiomqtt.MqttError as e:
+            logger.error("MQTT connection to %s failed: %s. Reconnecting in %gs...", MQTT_BROKER, e, MQTT_RECONNECT_INTERVAL)
+            await asyncio.sleep(MQTT_RECONNECT_INTERVAL)
+        finally:
+            if relay_task is not None:
+                relay_task.cancel()
+                await asyncio.gather(relay_task, return_exceptions=True)
 
 # --- FastAPI Lifespan Events ---
+def prepare_serving():
+    """Cold-start work before the API can serve: schema, then the model (benchmark.py measures it)."""
+    if DB_CREATE_SCHEMA:
+        create_schema() # Tables, and columns/indexes added since they were created
+    import_legacy_model() # One-time migration of gas_leak_model.joblib
+    load_model() # Attempt to load the active model version
+    logger.info("Initialized ML model state.")
+
 @app.on_event("startup")
 async def startup_event():
     """Actions to perform when FastAPI starts."""
-    global client
-    print(" FastAPI application startup...")
-    load_model() # Attempt to load existing model
-    print(" Initialized ML model state.")
-    print(" Setting up MQTT client...")
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1) # Specify callback API version
-    client.on_connect = on_connect
-    client.on_message = on_message
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_start() # Start MQTT network loop in background thread
-        print(f" MQTT client loop started, connecting to {MQTT_BROKER}...")
-    except Exception as e:
-        print(f" Failed to connect MQTT client on startup: {e}")
+    global mqtt_task, lease_task, model_pointer_task
+    logger.info("FastAPI application startup...")
+    prepare_serving()
+    model_pointer_task = asyncio.create_task(model_pointer_loop(), name="model-pointer")
+    await pipeline.start(create_async_db_engine(pool_size=INGEST_WRITERS)) # Start decode/scoring/writer stages
+    if slot_leases is None:
+        await apply_ingest_slots(ingest_partition.slots, leader=True)
+    else:
+        lease_task = asyncio.create_task(slot_lease_loop(), name="slot-leases") # Claims this process's slots right away
+    logger.info("Starting MQTT client, connecting to %s...", MQTT_BROKER)
+    mqtt_task = asyncio.create_task(mqtt_receive_loop(), name="mqtt-receive")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Actions to perform when FastAPI shuts down."""
-    print(" FastAPI application shutdown...")
-    if 'client' in globals() and client.is_connected():
-        client.loop_stop()
-        client.disconnect()
-        print("🔌 MQTT client disconnected.")
-    else:
-        print(" MQTT client was not connected.")
+    logger.info("FastAPI application shutdown...")
+    if 'mqtt_task' in globals():
+        mqtt_task.cancel() # Leaves the client context, which disconnects
+        await asyncio.gather(mqtt_task, return_exceptions=True)
+        logger.info("MQTT client disconnected.")
+    if 'lease_task' in globals():
+        lease_task.cancel()
+        await asyncio.gather(lease_task, return_exceptions=True)
+    if 'model_pointer_task' in globals():
+        model_pointer_task.cancel()
+        await asyncio.gather(model_pointer_task, return_exceptions=True)
+    retention_worker.stop()
+    if slot_leases is not None: # No new messages arrive: live processes take the slots over while this one drains
+        await asyncio.to_thread(slot_leases.release)
+    training_jobs.shutdown() # Don't leave an orphaned training worker behind
+    await pipeline.stop() # Score and write whatever is still queued
+    logger.info("Ingest pipeline stopped (%d rows written, %d dropped).", pipeline.rows_written,
+                pipeline.rows_dropped + pipeline.payloads_dropped + pipeline.messages_dropped)
+
+# --- Keyset Pagination Helpers ---
+def encode_cursor(timestamp: datetime.datetime, record_id: int) -> str:
+    """Opaque cursor pointing just past (older than) the given row."""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{record_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        timestamp, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(record_id)
+    except Exception:
+        raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def paginate(query, timestamp_column, id_column, response: Response, skip: int, limit: int, cursor: str | None):
+    """
+    Newest-first page of `query`. With `cursor`, seeks on (timestamp, id) so deep
+    pages cost the same as the first; `skip` (OFFSET) is kept for old clients.
+    Sets the X-Next-Cursor header when a further page may exist.
+    """
+    query = query.order_by(timestamp_column.desc(), id_column.desc())
+    if cursor:
+        timestamp, record_id = decode_cursor(cursor)
+        query = query.filter(tuple_(timestamp_column, id_column) < tuple_(timestamp, record_id))
+    elif skip:
+        query = query.offset(skip)
+    rows = query.limit(limit).all()
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(getattr(last, timestamp_column.key), last.id)
+    return rows
+
+# --- Chart Downsampling ---
+CHART_SENSOR_SERIES = ['worker_1_mean', 'worker_2_mean', 'worker_3_mean', 'humidity', 'temp'] # Series bucketed by /timeseries
+MAX_CHART_BUCKETS = 5000 # Upper bound on buckets/points returned to a chart
+
+def resolve_chart_window(start: datetime.datetime | None, end: datetime.datetime | None) -> tuple[datetime.datetime, datetime.datetime]:
+    """Defaults to the last 24 hours; rejects empty or inverted ranges."""
+    end = naive_utc(end) or datetime.datetime.utcnow()
+    start = naive_utc(start) or end - datetime.timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="'start' must be before 'end'")
+    return start, end
+
+EXPORT_TABLES = { # dataset name -> (table, timestamp column used for range filters and ordering)
+    "sensor_data": (SensorData.__table__, SensorData.__table__.c.timestamp),
+    "predictions": (PredictionResult.__table__, PredictionResult.__table__.c.prediction_timestamp),
+}
 
 # --- API Endpoints ---
 
@@ -423,48 +817,273 @@ async def shutdown_event():
 async def read_root():
     return {"message": "Welcome to the Gas Leak Detection API"}
 
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/fetchdata", response_model=list[SensorDataResponse], summary="Get Raw Sensor Data")
-def read_unlabeled_sensor_data(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Retrieves recent raw sensor data records intended for labeling/analysis."""
-    all_data = db.query(SensorData).order_by(SensorData.timestamp.desc()).offset(skip).limit(limit).all()
-    print(f"Fetched {len(all_data)} raw data records.")
+def read_unlabeled_sensor_data(response: Response, skip: int = 0, limit: int = 100, cursor: str | None = None, db: Session = Depends(get_db)):
+    """
+    Retrieves recent raw sensor data records intended for labeling/analysis.
+    For older pages, pass the returned `X-Next-Cursor` header back as `cursor`.
+    """
+    all_data = paginate(db.query(SensorData), SensorData.timestamp, SensorData.id, response, skip, limit, cursor)
+    logger.debug("Fetched %d raw data records.", len(all_data))
     return all_data # Returns empty list [] if none found
 
+@app.get("/stream", summary="Live Data Stream (Server-Sent Events)")
+async def stream_live_updates(request: Request):
+    """
+    Streams every newly stored sensor_data row ('sensor_data' events) and prediction
+    ('prediction' events) as Server-Sent Events, so dashboards don't need to poll.
+    Clients that fall too far behind are disconnected; EventSource reconnects automatically.
+    """
+    subscriber = broadcaster.subscribe()
+    logger.info("Live stream client connected (%d total).", broadcaster.subscriber_count())
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n" # Reconnect delay hint for EventSource
+            async for chunk in broadcaster.stream(subscriber):
+                if await request.is_disconnected():
+                    break
+                yield chunk
+        finally:
+            broadcaster.unsubscribe(subscriber)
+            logger.info("Live stream client disconnected (%d remaining).", broadcaster.subscriber_count())
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # Disable proxy buffering
+    )
+
+@app.get("/timeseries", response_model=TimeBucketsResponse, summary="Get Time-Bucketed Chart Data")
+def read_time_buckets(
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    bucket_seconds: float | None = Query(None, gt=0),
+    points: int = Query(300, ge=1, le=MAX_CHART_BUCKETS),
+    db: Session = Depends(get_db),
+):
+    """
+    Aggregates sensor_data and predictions in SQL into fixed-width time buckets and
+    returns min/max/mean per bucket for each worker mean, humidity, temp and the
+    leak probability. Give `bucket_seconds`, or `points` (target bucket count) to
+    derive it from the range. Defaults to the last 24 hours.
+    """
+    start, end = resolve_chart_window(start, end)
+    span = (end - start).total_seconds()
+    width = bucket_seconds or span / points
+    if span / width > MAX_CHART_BUCKETS:
+        width = span / MAX_CHART_BUCKETS
+
+    buckets = {}
+    def bucket_entry(index: int) -> dict:
+        return buckets.setdefault(index, {
+            'bucket_start': start + datetime.timedelta(seconds=index * width),
+            'sensor_count': 0,
+            'prediction_count': 0,
+        })
+
+    sensor_columns = [getattr(SensorData, name) for name in CHART_SENSOR_SERIES]
+    for row in bucket_stats_query(db, SensorData.timestamp, sensor_columns, start, end, width):
+        entry = bucket_entry(int(row[0]))
+        entry['sensor_count'] = row[1]
+        for i, name in enumerate(CHART_SENSOR_SERIES):
+            entry[f'{name}_min'], entry[f'{name}_max'], entry[f'{name}_mean'] = row[2 + 3 * i: 5 + 3 * i]
+
+    for row in bucket_stats_query(db, PredictionResult.prediction_timestamp, [PredictionResult.probability], start, end, width,
+                                  where=LIVE_PREDICTIONS):
+        entry = bucket_entry(int(row[0]))
+        entry['prediction_count'] = row[1]
+        entry['probability_min'], entry['probability_max'], entry['probability_mean'] = row[2:5]
+
+    logger.debug("Aggregated %d chart buckets of %.1fs.", len(buckets), width)
+    return {"start": start, "end": end, "bucket_seconds": width, "buckets": [buckets[i] for i in sorted(buckets)]}
+
+@app.get("/timeseries/lttb", response_model=DownsampledSeriesResponse, summary="Get Downsampled Series (LTTB)")
+def read_lttb_series(
+    field: Literal['worker_1_mean', 'worker_2_mean', 'worker_3_mean', 'humidity', 'temp', 'probability'] = 'worker_1_mean',
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    points: int = Query(500, ge=3, le=MAX_CHART_BUCKETS),
+):
+    """
+    Returns at most `points` raw samples of one series, chosen with Largest-Triangle-
+    Three-Buckets so peaks and dips survive downsampling. Only the timestamp and value
+    columns are read, straight from the cursor into NumPy arrays.
+    """
+    start, end = resolve_chart_window(start, end)
+    if field == 'probability':
+        table, timestamp_column = EXPORT_TABLES['predictions']
+    else:
+        table, timestamp_column = EXPORT_TABLES['sensor_data']
+    value_column = table.c[field]
+    statement = (
+        select(timestamp_column, value_column)
+        .where(timestamp_column >= start, timestamp_column < end, value_column.is_not(None))
+        .order_by(timestamp_column, table.c.id)
+    )
+    if field == 'probability':
+        statement = statement.where(LIVE_PREDICTIONS)
+    timestamps, values = [], []
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=50000).execute(statement)
+        for rows in result.partitions(50000):
+            ts_chunk, value_chunk = zip(*rows)
+            timestamps.append(np.array(ts_chunk, dtype='datetime64[us]'))
+            values.append(np.array(value_chunk, dtype=np.float64))
+    if not timestamps:
+        return {"field": field, "total_points": 0, "timestamps": [], "values": []}
+    ts = np.concatenate(timestamps)
+    ys = np.concatenate(values)
+    keep = lttb(ts.astype(np.int64).astype(np.float64), ys, points)
+    logger.debug("Downsampled %d '%s' points to %d.", len(ts), field, len(keep))
+    return {"field": field, "total_points": len(ts), "timestamps": ts[keep].tolist(), "values": ys[keep].tolist()}
+
 @app.get("/latest-prediction", response_model=PredictionResponse | None, summary="Get Latest Prediction")
 def get_latest_stored_prediction(db: Session = Depends(get_db)):
     """Retrieves the most recent prediction result stored in the database."""
-    latest_prediction = db.query(PredictionResult).order_by(PredictionResult.prediction_timestamp.desc()).first()
+    latest_prediction = db.query(PredictionResult).filter(LIVE_PREDICTIONS).order_by(PredictionResult.prediction_timestamp.desc()).first()
     if latest_prediction:
-        print(f"Fetched latest prediction ID: {latest_prediction.id}")
+        logger.debug("Fetched latest prediction ID: %s", latest_prediction.id)
     else:
-        print("No predictions found in database.")
+        logger.debug("No predictions found in database.")
     return latest_prediction # Returns null if none found
 
 @app.get("/fetchpredictions", response_model=list[PredictionResponse], summary="Get Prediction History")
-def read_prediction_history(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Retrieves a list of recent prediction results."""
-    all_predictions = db.query(PredictionResult).order_by(PredictionResult.prediction_timestamp.desc()).offset(skip).limit(limit).all()
-    print(f"Fetched {len(all_predictions)} prediction history records.")
+def read_prediction_history(response: Response, skip: int = 0, limit: int = 100, cursor: str | None = None,
+                            model_version: str | None = None, source: Literal["live", "backfill", "all"] = "live",
+                            db: Session = Depends(get_db)):
+    """
+    Retrieves a list of recent prediction results, optionally only those of one model version.
+    `source` picks live predictions (default), re-scored history written by backfill.py, or both.
+    For older pages, pass the returned `X-Next-Cursor` header back as `cursor`.
+    """
+    query = db.query(PredictionResult)
+    if source == "live":
+        query = query.filter(LIVE_PREDICTIONS)
+    elif source == "backfill":
+        query = query.filter(PredictionResult.sensor_data_id.is_not(None))
+    if model_version is not None:
+        query = query.filter(PredictionResult.model_version == model_version)
+    all_predictions = paginate(query, PredictionResult.prediction_timestamp, PredictionResult.id, response, skip, limit, cursor)
+    logger.debug("Fetched %d prediction history records.", len(all_predictions))
     return all_predictions # Returns empty list [] if none found
 
+@app.get("/export/{dataset}", summary="Bulk Export (Arrow IPC / Parquet)")
+def export_dataset(
+    dataset: Literal["sensor_data", "predictions"],
+    format: Literal["arrow", "parquet"] = "arrow",
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    chunk_size: int = Query(50000, ge=1000, le=500000),
+):
+    """
+    Streams a whole table (optionally limited to [start, end)) oldest-first as an
+    Arrow IPC stream or a Parquet file, straight from a server-side cursor.
+    Rows never become ORM/Pydantic objects, so memory stays flat for large pulls.
+    """
+    table, timestamp_column = EXPORT_TABLES[dataset]
+    start, end = naive_utc(start), naive_utc(end)
+    statement = select(*table.c).order_by(timestamp_column, table.c.id)
+    if start is not None:
+        statement = statement.where(timestamp_column >= start)
+    if end is not None:
+        statement = statement.where(timestamp_column < end)
+    logger.info("Starting %s export of '%s' (start=%s, end=%s).", format, dataset, start, end)
+    extension = "arrows" if format == "arrow" else "parquet"
+    return StreamingResponse(
+        iter_export(engine, statement, list(table.c), fmt=format, chunk_size=chunk_size),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{extension}"'},
+    )
+
 @app.post("/train-model", response_model=TrainingStatusResponse, status_code=http_status.HTTP_202_ACCEPTED, summary="Trigger Model Training")
-async def trigger_training(background_tasks: BackgroundTasks):
+async def trigger_training(search: bool = Query(False, description="Cross-validate a hyperparameter and threshold search instead of one fixed model")):
     """
-    Triggers the model training process in the background using data from the 'sensor_data' table.
-    Requires LABELED data (is_leak=True/False) to be present.
+    Starts model training in a separate worker process using data from the 'sensor_data' table.
+    Requires LABELED data (is_leak=True/False) to be present. Only one job runs at a time;
+    poll /train-jobs/{job_id} for progress. The new model is loaded automatically when done.
+    With `search`, the model and its WARNING/DANGER thresholds are picked by rolling-origin
+    cross-validation (slower; see model_search.py).
     """
-    print(" Received request to train model via API.")
-    # Add the long-running task to FastAPI's background tasks
-    background_tasks.add_task(train_model_task)
-    return {"message": "Model training started in background. Check backend logs for progress.", "model_exists": os.path.exists(MODEL_FILENAME)}
+    logger.info("Received request to train model via API (search=%s).", search)
+    try:
+        job = training_jobs.submit(search=search)
+    except TrainingJobConflict as e:
+        logger.warning("Training request refused: %s", e)
+        raise HTTPException(status_code=http_status.HTTP_409_CONFLICT, detail=f"{e}.")
+    if job.status == "failed":
+        raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail=job.error)
+    return {"message": f"Model training started in background (job {job.job_id}).", "model_exists": served_model is not None, "job_id": job.job_id, "active_version": served_version()}
+
+@app.get("/train-jobs", response_model=list[TrainingJobResponse], summary="List Training Jobs")
+async def list_training_jobs():
+    """Lists recent training jobs, newest first."""
+    return [job.to_dict() for job in training_jobs.list()]
+
+@app.get("/train-jobs/{job_id}", response_model=TrainingJobResponse, summary="Get Training Job Status")
+async def get_training_job(job_id: str):
+    """Returns the status, current stage and progress of a training job."""
+    job = training_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail=f"Training job {job_id} not found")
+    return job.to_dict()
 
 @app.get("/model-status", response_model=TrainingStatusResponse, summary="Check Model Status")
 async def get_model_status():
-    """Checks if a trained model file exists on the server."""
-    exists = os.path.exists(MODEL_FILENAME)
-    message = " Trained model file found." if exists else " No trained model file found. Please train the model."
-    print(f"Checked model status: {'Exists' if exists else 'Not Found'}")
-    return {"message": message, "model_exists": exists}
+    """Checks if a trained model is active in the registry (and reports any running training job)."""
+    version = served_version()
+    exists = version is not None
+    message = f" Trained model {version} is active." if exists else " No trained model found. Please train the model."
+    active = training_jobs.active_job()
+    logger.debug("Checked model status: %s", version or 'Not Found')
+    return {"message": message, "model_exists": exists, "job_id": active.job_id if active else None, "active_version": version}
+
+@app.get("/models", response_model=list[ModelVersionResponse], summary="List Model Versions")
+async def list_model_versions():
+    """Lists every published model version, newest first, with its evaluation metrics."""
+    active = model_registry.active_version()
+    versions = []
+    for version in reversed(model_registry.versions()):
+        info = model_registry.metadata(version)
+        versions.append({"version": version, "active": version == active, "created_at": info.get("created_at"), "metrics": info.get("metrics")})
+    return versions
+
+@app.post("/models/{version}/activate", response_model=TrainingStatusResponse, summary="Activate Model Version")
+def activate_model_version(version: str):
+    """Validates and hot-swaps the served model to `version` (use an older version to roll back)."""
+    if version not in model_registry.versions():
+        raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail=f"Model version {version} not found")
+    if not load_model(version):
+        raise HTTPException(status_code=http_status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Model version {version} failed validation")
+    return {"message": f" Model {version} is active.", "model_exists": True, "active_version": version}
+
+@app.patch("/label-data", response_model=BulkLabelResponse, summary="Bulk Update Data Labels")
+def update_data_labels(label_update: BulkLabelRequest):
+    """
+    Sets 'is_leak' on every record matching the given ids and/or [start, end) range and
+    all thresholds, with one set-based UPDATE. Rows already carrying the label are untouched.
+    """
+    if label_update.ids is None and label_update.start is None and label_update.end is None:
+        raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="Give 'ids' and/or a 'start'/'end' range")
+    if label_update.start is not None and label_update.end is not None and label_update.start >= label_update.end:
+        raise HTTPException(status_code=http_status.HTTP_400_BAD_REQUEST, detail="'start' must be before 'end'")
+    selection = label_selection(
+        SensorData.__table__, ids=label_update.ids, start=label_update.start, end=label_update.end,
+        thresholds=[(t.column, t.min, t.max) for t in label_update.thresholds],
+    )
+    try:
+        with engine.begin() as conn: # Change log and labels commit together
+            updated, watermark = apply_labels(conn, SensorData.__table__, LabelChange.__table__, selection, label_update.is_leak)
+    except Exception as e:
+        logger.error("Error during bulk label update: %s", e)
+        raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error during label update.")
+    logger.info("Bulk label update: %d record(s) set to is_leak=%s.", updated, label_update.is_leak)
+    return {"updated": updated, "label_watermark": watermark}
 
 @app.patch("/label-data/{record_id}", response_model=SensorDataResponse, summary="Update Data Label")
 async def update_data_label(record_id: int, label_update: LabelUpdateRequest, db: Session = Depends(get_db)):
@@ -474,22 +1093,24 @@ async def update_data_label(record_id: int, label_update: LabelUpdateRequest, db
     db_record = db.query(SensorData).filter(SensorData.id == record_id).first()
 
     if not db_record:
-        print(f" Label update failed: Record ID {record_id} not found.")
+        logger.warning("Label update failed: Record ID %d not found.", record_id)
         raise HTTPException(status_code=http_status.HTTP_404_NOT_FOUND, detail=f"Record with id {record_id} not found")
 
     # Only update if the label is actually changing
     if db_record.is_leak == label_update.is_leak:
-        print(f" Label for record ID {record_id} is already {label_update.is_leak}. No change made.")
+        logger.info("Label for record ID %d is already %s. No change made.", record_id, label_update.is_leak)
         return db_record # Return existing record without commit
 
-    print(f" Attempting to update label for record ID {record_id} to is_leak={label_update.is_leak}...")
-    db_record.is_leak = label_update.is_leak
+    logger.debug("Attempting to update label for record ID %d to is_leak=%s...", record_id, label_update.is_leak)
     try:
+        serialize_label_changes(db.connection(), LabelChange.__table__)
+        db_record.is_leak = label_update.is_leak
+        db.add(LabelChange(sensor_data_id=record_id)) # Advance the label-change watermark
         db.commit() # Save changes to DB
         db.refresh(db_record) # Refresh object with DB state
-        print(f"Successfully updated label for record ID {record_id}.")
+        logger.info("Successfully updated label for record ID %d.", record_id)
         return db_record
     except Exception as e:
         db.rollback() # Undo changes on error
-        print(f" Error updating label for record ID {record_id}: {e}")
+        logger.error("Error updating label for record ID %d: %s", record_id, e)
         raise HTTPException(status_code=http_status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error during label update.")
\ No newline at end of file
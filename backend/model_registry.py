@@ -0,0 +1,152 @@
+"""
+Versioned model registry on the local filesystem.
+
+Layout:  <root>/v0001.joblib, <root>/v0001.json (metadata), <root>/ACTIVE (pointer),
+         <root>/v0001.compiled.joblib (optional compiled form for serving, see compiled_model.py).
+Artifacts are written once and never modified; switching or rolling back the served
+model only rewrites the small ACTIVE pointer, atomically (temp file + rename).
+A publish reserves its version name with <root>/v0001.reserved and renames the artifact
+into place last, so a version is listed only once it is complete.
+"""
+import datetime
+import json
+import os
+import re
+import joblib
+import numpy as np
+
+_VERSION_RE = re.compile(r"^v(\d+)\.joblib$")
+_RESERVED_RE = re.compile(r"^v(\d+)\.reserved$")
+
+
+class InvalidModelError(ValueError):
+    """A model artifact does not match what the serving code expects."""
+
+
+def validate_model(model, known_features: list[str]) -> list[str]:
+    """
+    Checks a loaded pipeline against the features the serving code can build and the
+    binary leak labels, then smoke-tests it. Returns the model's feature names, in order.
+    """
+    if not hasattr(model, "predict_proba"):
+        raise InvalidModelError("model has no predict_proba()")
+    fitted_names = getattr(model, "feature_names_in_", None)
+    n_features = getattr(model, "n_features_in_", None)
+    if fitted_names is not None:
+        feature_names = list(fitted_names)
+    elif n_features is not None and n_features <= len(known_features):
+        feature_names = list(known_features[:n_features]) # Fitted on a bare array: assume the standard layout
+    else:
+        raise InvalidModelError(f"cannot tell which features the model expects (n_features_in_={n_features})")
+    unknown = [f for f in feature_names if f not in known_features]
+    if unknown:
+        raise InvalidModelError(f"model uses unknown features {unknown}")
+    classes = getattr(model, "classes_", None)
+    if classes is not None and list(classes) != [0, 1]:
+        raise InvalidModelError(f"model classes are {list(classes)}, expected [0, 1]")
+    probabilities = model.predict_proba(np.zeros((1, len(feature_names))))
+    if probabilities.shape != (1, 2):
+        raise InvalidModelError(f"predict_proba returned shape {probabilities.shape}, expected (1, 2)")
+    return feature_names
+
+
+class ModelRegistry:
+    """Publishes, lists, loads and activates model versions stored under `root`."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.pointer_path = os.path.join(root, "ACTIVE")
+
+    def _artifact_path(self, version: str) -> str:
+        return os.path.join(self.root, f"{version}.joblib")
+
+    def _compiled_path(self, version: str) -> str:
+        return os.path.join(self.root, f"{version}.compiled.joblib")
+
+    def _metadata_path(self, version: str) -> str:
+        return os.path.join(self.root, f"{version}.json")
+
+    def _reserved_path(self, version: str) -> str:
+        return os.path.join(self.root, f"{version}.reserved")
+
+    def _numbers(self, pattern: re.Pattern) -> list[int]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(self.root)) if m)
+
+    def versions(self) -> list[str]:
+        """All published versions, oldest first."""
+        return [f"v{n:04d}" for n in self._numbers(_VERSION_RE)]
+
+    def metadata(self, version: str) -> dict:
+        try:
+            with open(self._metadata_path(version)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def active_version(self) -> str | None:
+        try:
+            with open(self.pointer_path) as f:
+                version = f.read().strip()
+        except OSError:
+            return None
+        return version if os.path.exists(self._artifact_path(version)) else None
+
+    def publish(self, model, metadata: dict | None = None, compiled=None) -> str:
+        """
+        Writes `model` (and its `compiled` form, if given) as a new immutable version
+        (uncompressed, so it can be memory-mapped) and returns the version name. Does not activate it.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        while True:
+            # Past published and reserved names (a crashed publish leaves its reservation behind)
+            taken = self._numbers(_VERSION_RE) + self._numbers(_RESERVED_RE)
+            version = f"v{max(taken, default=0) + 1:04d}"
+            try:
+                # Claim the name atomically so concurrent publishers never share a version
+                os.close(os.open(self._reserved_path(version), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                continue
+        if compiled is not None:
+            joblib.dump(compiled, f"{self._compiled_path(version)}.tmp")
+            os.replace(f"{self._compiled_path(version)}.tmp", self._compiled_path(version))
+        info = dict(metadata or {}, version=version, compiled=compiled is not None, created_at=datetime.datetime.utcnow().isoformat())
+        self._write_atomic(self._metadata_path(version), json.dumps(info, indent=2, default=str))
+        tmp_path = f"{self._artifact_path(version)}.tmp"
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, self._artifact_path(version)) # The version appears in versions() only now, complete
+        os.remove(self._reserved_path(version))
+        return version
+
+    def load(self, version: str, mmap: bool = True):
+        """
+        Loads a version. With `mmap`, NumPy arrays stored in the artifact are mapped
+        read-only from the file, so processes loading the same version share those pages.
+        """
+        path = self._artifact_path(version)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"model version {version} not found in {self.root}")
+        return joblib.load(path, mmap_mode="r" if mmap else None)
+
+    def load_compiled(self, version: str, mmap: bool = True):
+        """Loads the compiled form of a version (memory-mapped like load()), or None if it has none."""
+        path = self._compiled_path(version)
+        if not os.path.exists(path):
+            return None
+        return joblib.load(path, mmap_mode="r" if mmap else None)
+
+    def activate(self, version: str):
+        """Points ACTIVE at `version` (atomic rename; readers see the old or the new pointer, never a mix)."""
+        if not os.path.exists(self._artifact_path(version)):
+            raise FileNotFoundError(f"model version {version} not found in {self.root}")
+        self._write_atomic(self.pointer_path, version + "\n")
+
+    def _write_atomic(self, path: str, text: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
@@ -0,0 +1,210 @@
+"""
+Rolling-origin cross-validation and hyperparameter search for the leak classifier.
+
+Every (trees, depth) configuration is fitted once per fold in a process pool. The
+feature matrix is written once to a .npy file that every worker memory-maps read-only,
+so the data is shared through the page cache instead of being pickled to each task.
+Status thresholds need no refit: each fold's out-of-fold probabilities are scored for
+every (WARNING, DANGER) pair. The best configuration maximizes
+
+    score = quality - latency_weight * log2(inference cost / cheapest inference cost)
+
+where quality is the mean of F2 for alarms (p > warning: catch leaks) and F0.5 for
+DANGER (p > danger: be sure) over the pooled out-of-fold predictions (a fold may hold
+no leak at all, where F-scores are undefined), and inference cost is the measured
+predict_proba time per row in live-sized batches, of the compiled form the API serves
+(compiled_model.py) when the fitted pipeline compiles. Doubling the cost of a
+prediction costs `latency_weight` of quality.
+
+Under a training memory limit (an address-space cap every spawned worker would
+otherwise inherit whole), the budget is divided across the pool: each worker is capped
+at limit / workers, and the pool shrinks so no share falls below
+SEARCH_WORKER_MIN_MEMORY_MB (see pool_plan).
+
+Kept free of database imports: pool workers are spawned and import this module.
+"""
+import itertools
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+import numpy as np
+from compiled_model import compile_pipeline
+from predictor import StatusThresholds
+
+SEARCH_N_ESTIMATORS = (50, 100, 200) # Trees per forest
+SEARCH_MAX_DEPTH = (None, 8, 16) # Max tree depth (None = grow until pure)
+SEARCH_WARNING_THRESHOLDS = (0.3, 0.4, 0.5) # Leak probability above which a reading is WARNING
+SEARCH_DANGER_THRESHOLDS = (0.6, 0.7, 0.8) # ... and DANGER
+LATENCY_SAMPLE_ROWS = 256 # Rows per timed predict_proba call (the live micro-batch size)
+MIN_TRAIN_FRACTION = 0.5 # The first fold trains on this share of the rows
+SEARCH_WORKER_MIN_MEMORY_MB = 1024 # Smallest address-space share of a pool worker (the interpreter and sklearn alone map ~350 MB)
+
+
+class Candidate(NamedTuple):
+    n_estimators: int
+    max_depth: int | None
+
+
+def build_pipeline(n_estimators: int = 100, max_depth: int | None = None, n_jobs: int = 1):
+    """The model pipeline (StandardScaler + RandomForest) with the given hyperparameters."""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    return Pipeline([
+        ('scaler', StandardScaler()), # Scale features
+        ('classifier', RandomForestClassifier( # Train RandomForest
+            n_estimators=n_estimators, # More trees generally better, but slower
+            max_depth=max_depth,
+            random_state=42,           # For reproducibility
+            class_weight='balanced',   # Crucial for imbalanced datasets
+            n_jobs=n_jobs              # Cores granted to the training worker
+        ))
+    ])
+
+
+def rolling_origin_splits(n_rows: int, n_folds: int, min_train_fraction: float = MIN_TRAIN_FRACTION) -> list[tuple[int, int]]:
+    """
+    Expanding-window folds over time-ordered rows, as (train_end, test_end): fold k trains
+    on rows [0, train_end) and tests on [train_end, test_end), the next block in time.
+    """
+    edges = np.linspace(int(n_rows * min_train_fraction), n_rows, max(1, n_folds) + 1).astype(int)
+    return [(int(start), int(end)) for start, end in zip(edges[:-1], edges[1:]) if end > start]
+
+
+def _fbeta(y: np.ndarray, predicted: np.ndarray, beta: float) -> float:
+    true_positives = np.count_nonzero(predicted & (y == 1))
+    false_positives = np.count_nonzero(predicted & (y == 0))
+    false_negatives = np.count_nonzero(~predicted & (y == 1))
+    b2 = beta * beta
+    denominator = (1 + b2) * true_positives + b2 * false_negatives + false_positives
+    return (1 + b2) * true_positives / denominator if denominator else 0.0
+
+
+def threshold_quality(y: np.ndarray, probabilities: np.ndarray, thresholds: StatusThresholds) -> float:
+    """Mean of F2 for alarms (p > warning) and F0.5 for DANGER (p > danger)."""
+    return (_fbeta(y, probabilities > thresholds.warning, 2.0) + _fbeta(y, probabilities > thresholds.danger, 0.5)) / 2
+
+
+def pool_plan(cores: int, memory_limit_mb: int | None) -> tuple[int, int | None]:
+    """Pool size and per-worker address-space cap (MB) for `cores` CPUs under `memory_limit_mb` (None = no cap)."""
+    if not memory_limit_mb:
+        return cores, None
+    workers = max(1, min(cores, memory_limit_mb // SEARCH_WORKER_MIN_MEMORY_MB))
+    return workers, memory_limit_mb // workers
+
+
+def _limit_memory(limit_mb: int):
+    """Pool initializer: lowers the address-space cap inherited from the training worker to this worker's share."""
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        print(f" Could not apply search worker memory limit: {e}")
+
+
+def _evaluate_fold(data_dir: str, candidate: Candidate, train_end: int, test_end: int):
+    """Pool task: fits one configuration on one fold. Returns (probabilities, fit seconds, seconds per row) or None."""
+    X = np.load(os.path.join(data_dir, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(data_dir, "y.npy"), mmap_mode="r")
+    if np.unique(y[:train_end]).size < 2:
+        return None # Nothing to learn from a single class
+    model = build_pipeline(candidate.n_estimators, candidate.max_depth)
+    started = time.perf_counter()
+    model.fit(X[:train_end], y[:train_end])
+    fit_seconds = time.perf_counter() - started
+    probabilities = model.predict_proba(X[train_end:test_end])[:, 1]
+    try:
+        scorer = compile_pipeline(model) # The form the API serves, so its cost is the one that matters
+    except ValueError:
+        scorer = model
+    sample = np.array(X[train_end:train_end + LATENCY_SAMPLE_ROWS])
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        scorer.predict_proba(sample)
+        timings.append((time.perf_counter() - started) / len(sample))
+    return probabilities, fit_seconds, min(timings)
+
+
+def search_hyperparameters(X: np.ndarray, y: np.ndarray, n_folds: int = 4, latency_weight: float = 0.02,
+                           max_workers: int | None = None, worker_memory_limit_mb: int | None = None, progress=None) -> dict:
+    """
+    Runs the search over time-ordered rows `X`/`y` and returns a summary: 'best' (the
+    winning configuration and thresholds with its scores), 'oof_y'/'oof_probabilities'
+    (its out-of-fold predictions) and 'results' (every configuration, best first).
+    Each pool worker is capped at `worker_memory_limit_mb` (see pool_plan).
+    `progress(fraction)` is called as fold fits finish.
+    """
+    splits = rolling_origin_splits(len(X), n_folds)
+    candidates = [Candidate(n, d) for n, d in itertools.product(SEARCH_N_ESTIMATORS, SEARCH_MAX_DEPTH)]
+    thresholds = [StatusThresholds(w, d) for w, d in itertools.product(SEARCH_WARNING_THRESHOLDS, SEARCH_DANGER_THRESHOLDS) if w < d]
+    folds = {} # (candidate, fold index) -> fold result
+    data_dir = tempfile.mkdtemp(prefix="gasleak-search-")
+    try:
+        np.save(os.path.join(data_dir, "X.npy"), np.ascontiguousarray(X, dtype=np.float64))
+        np.save(os.path.join(data_dir, "y.npy"), np.ascontiguousarray(y, dtype=np.int8))
+        # Spawned, not forked: the training worker holds DB connections a fork would share
+        limits = {"initializer": _limit_memory, "initargs": (worker_memory_limit_mb,)} if worker_memory_limit_mb else {}
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"), **limits) as pool:
+            futures = {
+                pool.submit(_evaluate_fold, data_dir, candidate, train_end, test_end): (candidate, index)
+                for candidate in candidates for index, (train_end, test_end) in enumerate(splits)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                folds[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done / len(futures))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    y = np.asarray(y)
+    scored = [] # (candidate, evaluated fold indexes, mean seconds per row)
+    for candidate in candidates:
+        evaluated = [i for i in range(len(splits)) if folds[(candidate, i)] is not None]
+        if evaluated:
+            scored.append((candidate, evaluated, float(np.mean([folds[(candidate, i)][2] for i in evaluated]))))
+    if not scored:
+        raise ValueError("no fold had both classes in its training rows")
+    cheapest = min(cost for _, _, cost in scored)
+
+    results = []
+    for candidate, evaluated, cost in scored:
+        penalty = latency_weight * math.log2(cost / cheapest) if cheapest > 0 else 0.0
+        fit_seconds = float(np.mean([folds[(candidate, i)][1] for i in evaluated]))
+        oof_y = np.concatenate([y[splits[i][0]:splits[i][1]] for i in evaluated])
+        oof_probabilities = np.concatenate([folds[(candidate, i)][0] for i in evaluated])
+        with_leaks = [i for i in evaluated if y[splits[i][0]:splits[i][1]].any()]
+        for status_thresholds in thresholds:
+            quality = threshold_quality(oof_y, oof_probabilities, status_thresholds)
+            # Spread across the folds that contain leaks: how stable the configuration is over time
+            fold_qualities = [
+                threshold_quality(y[splits[i][0]:splits[i][1]], folds[(candidate, i)][0], status_thresholds) for i in with_leaks
+            ]
+            results.append({
+                "n_estimators": candidate.n_estimators,
+                "max_depth": candidate.max_depth,
+                "warning": status_thresholds.warning,
+                "danger": status_thresholds.danger,
+                "quality": quality,
+                "quality_std": float(np.std(fold_qualities)) if fold_qualities else 0.0,
+                "folds": len(evaluated),
+                "fit_seconds": fit_seconds,
+                "inference_us_per_row": cost * 1e6,
+                "score": quality - penalty,
+            })
+    results.sort(key=lambda r: r["score"], reverse=True)
+    best = results[0]
+    winner = Candidate(best["n_estimators"], best["max_depth"])
+    evaluated = [i for i in range(len(splits)) if folds[(winner, i)] is not None]
+    return {
+        "best": best,
+        "oof_y": np.concatenate([y[splits[i][0]:splits[i][1]] for i in evaluated]),
+        "oof_probabilities": np.concatenate([folds[(winner, i)][0] for i in evaluated]),
+        "results": results,
+    }
@@ -0,0 +1,199 @@
+"""
+Splitting the MQTT load across several backend processes. The deployment has `count`
+ingest slots. Prediction streams (master ids) are assigned to slots on a consistent-hash
+ring, so every reading is scored and stored by the one process holding its slot, and
+changing the slot count only moves about 1/count of the streams (and their rolling
+state). Collection rows carry no per-stream state and are split by the broker instead,
+through a shared subscription.
+
+Slots are leases in a table shared by every process (see SlotLeases): a process that
+stops heartbeating loses its slots to a live process as soon as its lease expires, and a
+slot changing hands is scored by the giving process until the new owner has taken it,
+so no stream stays unowned while any backend process is running.
+"""
+import bisect
+import datetime
+import hashlib
+import logging
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    # Stable across processes and restarts, unlike the built-in (salted) hash()
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shared_topic(topic: str, group: str) -> str:
+    """MQTT shared-subscription filter: the broker delivers each message to one subscriber of `group`."""
+    return f"$share/{group}/{topic}"
+
+
+class HashRing:
+    """Consistent-hash ring with `replicas` virtual nodes per member."""
+
+    def __init__(self, members: list[str], replicas: int = 256):
+        points = sorted((_hash(f"{member}#{i}"), member) for member in members for i in range(replicas))
+        self._points = [point for point, _ in points]
+        self._members = [member for _, member in points]
+
+    def owner(self, key: str) -> str:
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._members[index]
+
+
+class IngestPartition:
+    """This process's share of the ingest load: the slots it scores out of `count`."""
+
+    MAX_CACHED_KEYS = 10000
+
+    def __init__(self, count: int = 1, slots=(0,), replicas: int = 256):
+        self.count = count
+        self.ring = HashRing([f"slot-{i}" for i in range(count)], replicas)
+        self.slots = frozenset()
+        self._names = set()
+        self._owned = {} # stream key -> bool (a deployment has few master nodes)
+        self.assign(slots)
+
+    def assign(self, slots):
+        """Replaces the scored slots (after a lease renewal); ownership is recomputed lazily."""
+        slots = frozenset(slots)
+        outside = [i for i in slots if not 0 <= i < self.count]
+        if outside:
+            raise ValueError(f"Ingest slots {outside} are outside 0..{self.count - 1}")
+        if slots != self.slots:
+            self.slots = slots
+            self._names = {f"slot-{i}" for i in slots}
+            self._owned = {}
+
+    def owns(self, key: str) -> bool:
+        owned = self._owned.get(key)
+        if owned is None:
+            if len(self._owned) >= self.MAX_CACHED_KEYS:
+                self._owned.clear()
+            owned = self._owned[key] = self.ring.owner(key) in self._names
+        return owned
+
+
+class SlotLeases:
+    """
+    The ingest slots held by `owner`, as leases in `table` (one row per slot: slot, owner,
+    heartbeat_at, requested_by). Call renew() every few seconds; it
+
+      * renews every lease the table says this process holds (and notices lost ones),
+      * hands a slot requested by a process without one straight to it, as long as this one
+        keeps a slot; the slot stays in `scored` until the new owner has renewed it,
+      * claims a slot when this process holds none: `preferred` if available, else any free
+        or expired one, else requests one from a process holding several,
+      * claims every other free or expired slot (no heartbeat for `ttl` seconds), so a slot
+        without a live owner is scored again from the next renewal of any live process.
+
+    A crashed process's streams go unscored until its lease expires (`ttl`), plus at most
+    one renewal interval. Heartbeats use this host's clock: hosts must agree on UTC to well
+    within `ttl`.
+    """
+
+    def __init__(self, engine, table, count: int, owner: str, preferred: int | None = None, ttl: float = 15.0):
+        self.engine = engine
+        self.table = table
+        self.count = count
+        self.owner = owner
+        self.preferred = preferred
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.held = set()
+        self.handing_over = {} # slot -> heartbeat_at it was handed over with, until the new owner renews it
+        self.uncovered = count # Slots without a live owner after the last renewal
+
+    @property
+    def scored(self) -> set[int]:
+        """The slots whose streams this process scores: the held ones, and those being handed over."""
+        return self.held | set(self.handing_over)
+
+    def _ensure_rows(self, conn):
+        existing = set(conn.execute(select(self.table.c.slot)).scalars())
+        missing = [{"slot": i} for i in range(self.count) if i not in existing]
+        if missing: # Free: the first renewal of any process claims them
+            try:
+                with conn.begin_nested():
+                    conn.execute(self.table.insert(), missing)
+            except IntegrityError:
+                pass # Another process created them first
+
+    def _claim(self, conn, slot: int, now: datetime.datetime) -> bool:
+        """Takes `slot` if it is free or its lease expired (atomic: one process wins)."""
+        t = self.table
+        available = or_(t.c.owner.is_(None), t.c.heartbeat_at.is_(None), t.c.heartbeat_at < now - self.ttl)
+        claimed = conn.execute(
+            update(t).where(t.c.slot == slot, available).values(owner=self.owner, heartbeat_at=now, requested_by=None)
+        ).rowcount == 1
+        if claimed:
+            logger.info("Claimed ingest slot %d of %d.", slot, self.count)
+        return claimed
+
+    def renew(self, now: datetime.datetime | None = None) -> set[int]:
+        """One lease round (see the class docstring). Returns the slots now held."""
+        now = now or datetime.datetime.utcnow()
+        t = self.table
+        with self.engine.begin() as conn:
+            self._ensure_rows(conn)
+            conn.execute(update(t).where(t.c.owner == self.owner, t.c.slot < self.count).values(heartbeat_at=now))
+            rows = {row.slot: row for row in conn.execute(select(t).where(t.c.slot < self.count))}
+            held = {slot for slot, row in rows.items() if row.owner == self.owner}
+            for slot in sorted(self.held - held):
+                logger.warning("Lost ingest slot %d to another process.", slot)
+            for slot, handed_at in list(self.handing_over.items()):
+                row = rows[slot]
+                if row.owner in (None, self.owner) or row.heartbeat_at != handed_at: # Taken over (or back)
+                    del self.handing_over[slot]
+
+            owners = {row.owner for row in rows.values()}
+            for slot in sorted(held, reverse=True):
+                requester = rows[slot].requested_by
+                if len(held) > 1 and requester is not None and requester not in owners: # Still without a slot
+                    conn.execute(update(t).where(t.c.slot == slot, t.c.owner == self.owner)
+                                 .values(owner=requester, heartbeat_at=now, requested_by=None))
+                    held.discard(slot)
+                    self.handing_over[slot] = now
+                    logger.info("Handed ingest slot %d over to %s.", slot, requester)
+
+            if not held:
+                for slot in sorted(rows, key=lambda slot: slot != self.preferred):
+                    if self._claim(conn, slot, now):
+                        held.add(slot)
+                        break
+                else:
+                    self._request(conn, rows)
+            live = {slot for slot, row in rows.items()
+                    if row.owner is not None and row.heartbeat_at is not None and row.heartbeat_at >= now - self.ttl}
+            for slot in sorted(set(rows) - live - held):
+                if self._claim(conn, slot, now):
+                    held.add(slot)
+        self.held = held
+        self.uncovered = len(set(range(self.count)) - live - held)
+        return held
+
+    def _request(self, conn, rows: dict):
+        """Asks a process holding several slots to hand one over (the preferred slot if it can)."""
+        t = self.table
+        slots_per_owner = {}
+        for slot, row in rows.items():
+            if row.owner is not None:
+                slots_per_owner.setdefault(row.owner, []).append(slot)
+        shared = [slot for slots in slots_per_owner.values() if len(slots) > 1 for slot in slots]
+        for slot in sorted(shared, key=lambda slot: slot != self.preferred):
+            if conn.execute(update(t).where(t.c.slot == slot, or_(t.c.requested_by.is_(None), t.c.requested_by == self.owner))
+                            .values(requested_by=self.owner)).rowcount:
+                return
+
+    def release(self):
+        """Gives up every held slot (on shutdown), so live processes claim them at their next renewal."""
+        self.handing_over = {}
+        if not self.held:
+            return
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(update(t).where(and_(t.c.slot.in_(sorted(self.held)), t.c.owner == self.owner))
+                         .values(owner=None, requested_by=None))
+        self.held = set()
@@ -0,0 +1,284 @@
+"""
+asyncio ingestion pipeline for the API process. Receiving, decoding, scoring and
+persisting are separate stages joined by bounded asyncio.Queues on the API's event loop:
+
+    receive -> [messages] -> decode -> [payloads] -> scoring (executor) -> [rows] -> writers (async DB pool)
+                                  \---------------------------------------> [rows]
+
+Scoring runs in an executor and writers use an async driver, so receiving never waits
+on CPU work or I/O, only on queue space: a full queue makes the producer wait up to
+`put_timeout` seconds (backpressure) before the item is dropped and counted.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+async def _gather(q: asyncio.Queue, first, max_items: int, window: float) -> list:
+    """`first` plus whatever else arrives on `q` within `window` seconds, up to `max_items`."""
+    batch = [first]
+    deadline = time.monotonic() + window
+    while len(batch) < max_items:
+        try:
+            batch.append(q.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(q.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+class AsyncIngestPipeline:
+    """
+    `handle_message(topic, payload, received_at)` is the decode stage (a coroutine): it
+    parses one message and routes it with `persist()` or `score()`.
+    Scoring: payloads are gathered for `batch_window` seconds (or `max_batch` rows) and
+    `prepare_batch(rows, received_ats)` runs on the loop, in arrival order (stateful
+    features); then `score_batch(rows)` runs in the executor and returns one result
+    tuple per row, e.g. (status, probability), and `result_row(row, *result)` gives the
+    (table, row) to persist. Up to `inference_workers` batches are scored at once.
+    Writing: rows are gathered for `flush_max_latency` seconds (or `flush_size` rows) and
+    inserted by up to `writer_workers` concurrent transactions, each on its own pooled
+    connection. `on_flush(table, rows)` is called after each commit with the written
+    rows, each carrying its new primary key under 'id'.
+    Optional histograms: `commit_timer` gets the duration of each bulk transaction,
+    `row_latency` (labelled by table name) the seconds from receipt to commit.
+    """
+
+    def __init__(self, handle_message, prepare_batch, score_batch, result_row, inference_workers=2, writer_workers=2,
+                 queue_size=10000, put_timeout=5.0, batch_window=0.01, max_batch=256, flush_size=200, flush_max_latency=0.5,
+                 on_flush=None, commit_timer=None, row_latency=None):
+        self.handle_message = handle_message
+        self.prepare_batch = prepare_batch
+        self.score_batch = score_batch
+        self.result_row = result_row
+        self.inference_workers = max(1, inference_workers)
+        self.writer_workers = max(1, writer_workers)
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self.flush_size = max(1, flush_size)
+        self.flush_max_latency = flush_max_latency
+        self.on_flush = on_flush
+        self.commit_timer = commit_timer
+        self.row_latency = row_latency
+        self.engine = None
+        self._queues = {}
+        self._tasks = []
+        self._in_flight = set()
+        self._executor = None
+        # Simple counters, useful for status/debugging
+        self.messages_dropped = 0
+        self.payloads_scored = 0
+        self.payloads_dropped = 0
+        self.payloads_failed = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, engine):
+        """Creates the queues and stage tasks on the running loop; `engine` is an AsyncEngine."""
+        if self.running:
+            return
+        self.engine = engine
+        self._queues = {name: asyncio.Queue(self.queue_size) for name in ("messages", "payloads", "rows")}
+        self._executor = ThreadPoolExecutor(self.inference_workers, thread_name_prefix="inference")
+        self._tasks = [
+            asyncio.create_task(self._decode_loop(), name="pipeline-decode"),
+            asyncio.create_task(self._score_loop(), name="pipeline-score"),
+            asyncio.create_task(self._write_loop(), name="pipeline-write"),
+        ]
+
+    async def stop(self, timeout: float = 10.0):
+        """Drains the stages in order (stop feeding `receive` first), then disposes the engine."""
+        if not self.running:
+            return
+        try:
+            async with asyncio.timeout(timeout):
+                for name in ("messages", "payloads", "rows"):
+                    await self._queues[name].join()
+        except TimeoutError:
+            logger.warning("Pipeline did not drain within %.0fs, %s item(s) left.", timeout, self.queue_sizes())
+        tasks = self._tasks + list(self._in_flight)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=True)
+        await self.engine.dispose()
+
+    def queue_sizes(self) -> dict:
+        return {name: q.qsize() for name, q in self._queues.items()}
+
+    async def _put(self, name: str, item) -> bool:
+        q = self._queues[name]
+        try:
+            q.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(q.put(item), self.put_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    # --- Producers ---
+    async def receive(self, topic: str, payload: bytes, received_at: float | None = None) -> bool:
+        """Queues one raw message; returns False if it was dropped because the queue stayed full."""
+        if await self._put("messages", (topic, payload, received_at or time.time())):
+            return True
+        self.messages_dropped += 1
+        logger.warning("Message queue full (%d messages), dropping message on '%s'.", self.queue_size, topic)
+        return False
+
+    async def score(self, row: dict, received_at: float) -> bool:
+        """Queues one payload for scoring; returns False if it was dropped."""
+        if await self._put("payloads", (row, received_at)):
+            return True
+        self.payloads_dropped += 1
+        logger.warning("Prediction queue full (%d rows), dropping payload.", self.queue_size)
+        return False
+
+    async def persist(self, table, row: dict, received_at: float) -> bool:
+        """Queues one row for `table` (a SQLAlchemy Table); returns False if it was dropped."""
+        if await self._put("rows", (table, row, received_at)):
+            return True
+        self.rows_dropped += 1
+        logger.warning("Ingest queue full (%d rows), dropping row for '%s'.", self.queue_size, table.name)
+        return False
+
+    # --- Stages ---
+    async def _decode_loop(self):
+        q = self._queues["messages"]
+        while True:
+            topic, payload, received_at = await q.get()
+            try:
+                await self.handle_message(topic, payload, received_at)
+            except Exception as e:
+                logger.error("Error handling message on '%s': %s", topic, e)
+            finally:
+                q.task_done()
+
+    async def _run_limited(self, slots: asyncio.Semaphore, coro):
+        """Runs `coro` as its own task once one of the stage's slots is free."""
+        await slots.acquire()
+        task = asyncio.create_task(coro)
+        self._in_flight.add(task)
+
+        def done(finished):
+            slots.release()
+            self._in_flight.discard(finished)
+        task.add_done_callback(done)
+
+    async def _score_loop(self):
+        q = self._queues["payloads"]
+        slots = asyncio.Semaphore(self.inference_workers)
+        while True:
+            items = await _gather(q, await q.get(), self.max_batch, self.batch_window)
+            rows = [row for row, _ in items]
+            received = [received_at for _, received_at in items]
+            try:
+                self.prepare_batch(rows, received) # Here, not in the executor, so state updates stay in arrival order
+            except Exception as e:
+                self.payloads_failed += len(rows)
+                logger.error("Error preparing prediction batch of %d: %s", len(rows), e)
+                for _ in items:
+                    q.task_done()
+                continue
+            await self._run_limited(slots, self._score_and_forward(rows, received))
+
+    async def _score_and_forward(self, rows: list[dict], received: list[float]):
+        q = self._queues["payloads"]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self.score_batch, rows)
+            self.payloads_scored += len(rows)
+            for row, scored, received_at in zip(rows, results, received):
+                table, result = self.result_row(row, *scored)
+                await self.persist(table, result, received_at)
+        except Exception as e:
+            self.payloads_failed += len(rows)
+            logger.error("Error scoring prediction batch of %d: %s", len(rows), e)
+        finally:
+            for _ in rows:
+                q.task_done()
+
+    async def _write_loop(self):
+        q = self._queues["rows"]
+        slots = asyncio.Semaphore(self.writer_workers)
+        while True:
+            batch = await _gather(q, await q.get(), self.flush_size, self.flush_max_latency)
+            await self._run_limited(slots, self._flush(batch))
+
+    async def _flush(self, batch: list):
+        # Group rows per table, keeping arrival order within each table
+        grouped = {}
+        for table, row, _ in batch:
+            grouped.setdefault(table, []).append(row)
+        try:
+            started = time.perf_counter()
+            async with self.engine.begin() as conn:
+                for table, rows in grouped.items():
+                    await self._insert(conn, table, rows) # executemany -> multi-row INSERT
+            if self.commit_timer is not None:
+                self.commit_timer.observe(time.perf_counter() - started)
+            self.rows_written += len(batch)
+        except Exception as e:
+            logger.error("Bulk insert of %d rows failed: %s. Retrying row by row.", len(batch), e)
+            await self._flush_rows_individually(grouped)
+            return
+        else:
+            if self.row_latency is not None:
+                committed_at = time.time()
+                for table, _, received_at in batch:
+                    self.row_latency.labels(table.name).observe(committed_at - received_at)
+            self._notify(grouped)
+        finally:
+            for _ in batch:
+                self._queues["rows"].task_done()
+
+    async def _insert(self, conn, table, rows: list):
+        if self.on_flush is None:
+            await conn.execute(table.insert(), rows)
+            return
+        # RETURNING the ids (in parameter order) so listeners get complete rows
+        result = await conn.execute(table.insert().returning(table.c.id, sort_by_parameter_order=True), rows)
+        for row, new_id in zip(rows, result.scalars()):
+            row['id'] = new_id
+
+    def _notify(self, grouped: dict):
+        if self.on_flush is None:
+            return
+        for table, rows in grouped.items():
+            try:
+                self.on_flush(table, rows)
+            except Exception as e:
+                logger.error("Error in ingest flush listener: %s", e)
+
+    async def _flush_rows_individually(self, grouped: dict):
+        """Fallback so one bad row does not cost the whole batch."""
+        for table, rows in grouped.items():
+            for row in rows:
+                row.pop('id', None) # May be left over from the rolled-back bulk attempt
+                try:
+                    async with self.engine.begin() as conn:
+                        await self._insert(conn, table, [row])
+                    self.rows_written += 1
+                    self._notify({table: [row]})
+                except Exception as e:
+                    self.rows_failed += 1
+                    logger.error("Dropping row for '%s' after insert error: %s", table.name, e)
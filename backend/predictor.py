@@ -0,0 +1,99 @@
+"""DataFrame-free feature packing for live predictions."""
+import math
+from typing import NamedTuple
+import numpy as np
+from temporal_features import TEMPORAL_FEATURE_NAMES
+
+# Features used by the model (MUST match training script)
+FEATURE_NAMES = [
+    'worker_1_mean', 'worker_1_min', 'worker_1_max', 'worker_1_variance',
+    'worker_2_mean', 'worker_2_min', 'worker_2_max', 'worker_2_variance',
+    'worker_3_mean', 'worker_3_min', 'worker_3_max', 'worker_3_variance',
+    'humidity', 'temp',
+    'spatial_variance', 'max_all_sensors', 'avg_all_sensors' # Engineered features
+]
+
+# Features newly trained models use: the instantaneous ones plus rolling temporal features.
+# Older models trained on FEATURE_NAMES alone keep working (the served model picks its columns).
+MODEL_FEATURE_NAMES = FEATURE_NAMES + TEMPORAL_FEATURE_NAMES
+
+WORKER_MEAN_FEATURES = ['worker_1_mean', 'worker_2_mean', 'worker_3_mean']
+ENGINEERED_FEATURES = ['spatial_variance', 'max_all_sensors', 'avg_all_sensors']
+READING_FIELDS = [f for f in FEATURE_NAMES if f not in ENGINEERED_FEATURES] # Sensor readings a payload carries
+
+
+def check_readings(payload) -> dict:
+    """
+    Returns `payload` if it is a JSON object whose readings are finite numbers (or null/missing),
+    else raises ValueError. Run per message, so a bad one is rejected on its own
+    instead of failing the whole micro-batch it would be scored in.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError(f"payload is a JSON {type(payload).__name__}, expected an object")
+    for field in READING_FIELDS:
+        value = payload.get(field)
+        if value is None:
+            continue
+        try:
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        except OverflowError: # An integer too large for a float
+            valid = False
+        if not valid:
+            raise ValueError(f"'{field}' is {value!r}, expected a finite number")
+    return payload
+
+
+class FeaturePacker:
+    """
+    Packs payload dicts straight into a float64 matrix laid out as `feature_names`.
+    Raw fields are copied per row; the engineered features are computed column-wise
+    for the whole batch (same definitions as the original per-row np.var/np.max/np.mean).
+    """
+
+    def __init__(self, feature_names: list[str]):
+        self.feature_names = list(feature_names)
+        self.raw_names = [f for f in self.feature_names if f not in ENGINEERED_FEATURES]
+        self.raw_idx = [self.feature_names.index(f) for f in self.raw_names]
+        self.mean_idx = [self.feature_names.index(f) for f in WORKER_MEAN_FEATURES]
+        self.engineered_idx = [self.feature_names.index(f) for f in ENGINEERED_FEATURES]
+
+    def empty(self, n_rows: int) -> np.ndarray:
+        """Allocates a buffer that `pack` can fill (reuse it across batches)."""
+        return np.zeros((n_rows, len(self.feature_names)), dtype=np.float64)
+
+    def pack(self, rows: list[dict], out: np.ndarray | None = None) -> np.ndarray:
+        """
+        Fills `out[:len(rows)]` (or a new array) with features and returns that view.
+        Missing/None values become 0. Engineered values are also written back into
+        each dict, since the placeholder fallback reads them from there.
+        """
+        n = len(rows)
+        if out is None or out.shape[0] < n:
+            out = self.empty(n)
+        X = out[:n]
+        raw_names = self.raw_names
+        X[:, self.raw_idx] = [[row.get(f, 0) or 0 for f in raw_names] for row in rows]
+
+        means = X[:, self.mean_idx]
+        sv_i, max_i, avg_i = self.engineered_idx
+        X[:, sv_i] = means.var(axis=1)
+        X[:, max_i] = means.max(axis=1)
+        X[:, avg_i] = means.mean(axis=1)
+
+        for row, engineered in zip(rows, X[:, self.engineered_idx].tolist()):
+            row.update(zip(ENGINEERED_FEATURES, engineered))
+        return X
+
+
+class StatusThresholds(NamedTuple):
+    """Leak probabilities above which a reading is WARNING / DANGER (a model may ship its own)."""
+    warning: float = 0.4 # Medium confidence leak
+    danger: float = 0.7 # High confidence leak
+
+
+class ServedModel(NamedTuple):
+    """The model currently serving, swapped as one reference so readers never see a mix."""
+    pipeline: object # CompiledForest, or the sklearn pipeline when it could not be compiled
+    version: str
+    feature_idx: np.ndarray | None # Columns of the packed matrix the model uses (None = all, in order)
+    thresholds: StatusThresholds = StatusThresholds()
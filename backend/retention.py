@@ -0,0 +1,176 @@
+"""
+Retention for the raw ingest tables. Closed time buckets are first rolled up into
+aggregate tables (incrementally, continuing after the newest bucket already rolled up),
+then raw rows past their retention period are deleted in small primary-key chunks,
+each in its own short transaction, so a purge never holds long locks on the hot tables.
+"""
+import datetime
+import logging
+import threading
+import time
+from typing import NamedTuple
+from sqlalchemy import and_, func, not_, select
+from downsample import bucket_index
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def align(timestamp: datetime.datetime, width_seconds: int) -> datetime.datetime:
+    """Start of the epoch-aligned bucket of `width_seconds` containing `timestamp`."""
+    seconds = (timestamp - EPOCH).total_seconds()
+    return EPOCH + datetime.timedelta(seconds=(seconds // width_seconds) * width_seconds)
+
+
+class Rollup(NamedTuple):
+    table: object # Aggregate table with a 'bucket_start' primary key
+    width_seconds: int
+    keep_days: float | None = None # Buckets older than this are purged (None = kept forever)
+
+
+class RetentionPolicy(NamedTuple):
+    table: object # Raw table
+    timestamp_column: object
+    aggregates: dict # Rollup column name -> SQL aggregate over the raw rows of a bucket
+    rollups: list[Rollup]
+    keep_days: float | None = None # Raw rows older than this are purged (None = kept forever)
+    keep_condition: object = None # Rows matching it are never purged (e.g. labeled data)
+    rollup_condition: object = None # Only rows matching it are rolled up (None = all)
+
+
+def roll_up(engine, policy: RetentionPolicy, rollup: Rollup, until: datetime.datetime, max_buckets: int = 1440) -> int:
+    """
+    Aggregates the raw rows of every bucket that ends at or before `until` and has not
+    been rolled up yet, `max_buckets` buckets per transaction. Returns buckets written.
+    """
+    ts = policy.timestamp_column
+    width = datetime.timedelta(seconds=rollup.width_seconds)
+    names = list(policy.aggregates)
+    rolled = [policy.rollup_condition] if policy.rollup_condition is not None else []
+    with engine.connect() as conn:
+        last = conn.execute(select(func.max(rollup.table.c.bucket_start))).scalar()
+    cursor = last + width if last is not None else None
+    written = 0
+    while True:
+        with engine.begin() as conn:
+            # Jump straight to the next raw row, so gaps in the data cost one query
+            first_query = select(func.min(ts)).where(*rolled)
+            if cursor is not None:
+                first_query = first_query.where(ts >= cursor)
+            first = conn.execute(first_query).scalar()
+            if first is None:
+                break
+            start = align(first, rollup.width_seconds)
+            end = min(start + width * max_buckets, until)
+            if end <= start:
+                break
+            bucket = bucket_index(ts, start, rollup.width_seconds, engine.dialect.name).label("bucket")
+            rows = conn.execute(
+                select(bucket, *policy.aggregates.values())
+                .where(ts >= start, ts < end, *rolled)
+                .group_by(bucket)
+                .order_by(bucket)
+            ).all()
+            if rows:
+                conn.execute(rollup.table.insert(), [
+                    dict(zip(names, values), bucket_start=start + width * int(index)) for index, *values in rows
+                ])
+            written += len(rows)
+            cursor = end
+    return written
+
+
+def purge(engine, table, timestamp_column, cutoff: datetime.datetime, keep_condition=None,
+          chunk_size: int = 5000, pause: float = 0.05, stop: threading.Event | None = None) -> int:
+    """
+    Deletes rows older than `cutoff` (except those matching `keep_condition`), at most
+    `chunk_size` per transaction with `pause` seconds in between. Returns rows deleted.
+    """
+    primary_key = list(table.primary_key.columns)[0]
+    condition = timestamp_column < cutoff
+    if keep_condition is not None:
+        condition = and_(condition, not_(keep_condition))
+    chunk = select(primary_key).where(condition).order_by(primary_key).limit(chunk_size)
+    deleted = 0
+    while stop is None or not stop.is_set():
+        with engine.begin() as conn:
+            count = conn.execute(table.delete().where(primary_key.in_(chunk))).rowcount
+        deleted += count
+        if count < chunk_size:
+            break
+        time.sleep(pause)
+    return deleted
+
+
+class RetentionWorker:
+    """
+    Runs rollups and purges for each policy every `interval` seconds in a background
+    thread. Buckets are rolled up `grace` seconds after they close, leaving time for
+    buffered rows to land; raw rows are never purged before they were rolled up.
+    """
+
+    def __init__(self, engine, policies: list[RetentionPolicy], interval=300.0, grace=60.0, chunk_size=5000, pause=0.05):
+        self.engine = engine
+        self.policies = policies
+        self.interval = interval
+        self.grace = grace
+        self.chunk_size = max(1, chunk_size)
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread = None
+        # Simple counters, useful for status/debugging
+        self.buckets_written = 0
+        self.rows_purged = 0
+        self.last_run_at = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Starts the background retention thread (idempotent)."""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the thread (an in-progress purge stops after its current chunk)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self, now: datetime.datetime | None = None):
+        """One pass over all policies: roll up closed buckets, then purge expired rows."""
+        now = now or datetime.datetime.utcnow()
+        for policy in self.policies:
+            rolled_until = []
+            for rollup in policy.rollups:
+                until = align(now - datetime.timedelta(seconds=self.grace), rollup.width_seconds)
+                self.buckets_written += roll_up(self.engine, policy, rollup, until)
+                rolled_until.append(until)
+            if policy.keep_days:
+                cutoff = min([now - datetime.timedelta(days=policy.keep_days)] + rolled_until)
+                self.rows_purged += self._purge(policy.table, policy.timestamp_column, cutoff, policy.keep_condition)
+            for rollup in policy.rollups:
+                if rollup.keep_days:
+                    cutoff = now - datetime.timedelta(days=rollup.keep_days)
+                    self._purge(rollup.table, rollup.table.c.bucket_start, cutoff)
+        self.last_run_at = now
+
+    def _purge(self, table, timestamp_column, cutoff, keep_condition=None) -> int:
+        deleted = purge(self.engine, table, timestamp_column, cutoff, keep_condition, self.chunk_size, self.pause, self._stop)
+        if deleted:
+            logger.info("Purged %d row(s) older than %s from '%s'.", deleted, f"{cutoff:%Y-%m-%d %H:%M}", table.name)
+        return deleted
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("Error during retention pass: %s", e)
+            self._stop.wait(self.interval)
@@ -0,0 +1,180 @@
+"""
+Temporal features over the worker sensor streams: rate of change, rolling mean/std
+and EWMA. The same definitions exist twice, and must stay in sync:
+
+  * TemporalFeatureEngine  - incremental, O(1) per message, for live prediction
+  * add_temporal_features  - vectorized over a DataFrame, for training
+
+Definitions, per source column x (missing values count as 0, like the raw features):
+  <x>_delta      x[t] - x[t-1]                      (0 for the first value of a segment)
+  <x>_roll_mean  mean of the last `window` values   (fewer at the start of a segment)
+  <x>_roll_std   population std (ddof=0) of the same values
+  <x>_ewma       alpha * x[t] + (1 - alpha) * ewma[t-1], starting at x[0]
+A segment restarts whenever consecutive readings are more than `max_gap` seconds apart.
+Each master node (STREAM_KEY_FIELD) is its own stream, with its own segments.
+"""
+import math
+import os
+import threading
+import numpy as np
+
+TEMPORAL_SOURCES = ['worker_1_mean', 'worker_2_mean', 'worker_3_mean']
+TEMPORAL_WINDOW = int(os.getenv("TEMPORAL_WINDOW", "10")) # Readings per rolling window
+TEMPORAL_ALPHA = float(os.getenv("TEMPORAL_ALPHA", "0.3")) # EWMA smoothing factor
+TEMPORAL_MAX_GAP = float(os.getenv("TEMPORAL_MAX_GAP", "300")) # Seconds without data before the history resets
+STREAM_KEY_FIELD = "master_id" # Payload field (and sensor_data column) separating streams from different master nodes
+DEFAULT_STREAM = "default" # Stream of payloads/rows without a master id
+
+
+def temporal_config() -> dict:
+    """Parameters the features were computed with (stored with each trained model)."""
+    return {"sources": TEMPORAL_SOURCES, "window": TEMPORAL_WINDOW, "alpha": TEMPORAL_ALPHA, "max_gap": TEMPORAL_MAX_GAP}
+
+
+def temporal_context_rows(window: int = TEMPORAL_WINDOW, alpha: float = TEMPORAL_ALPHA, tolerance: float = 1e-12) -> int:
+    """
+    Rows of history that determine the features of the next row: the rolling window, or
+    more for the EWMA, whose weight on older rows, (1 - alpha)^k, has fallen below `tolerance`.
+    Used to compute the features of a chunk of rows without reading everything before it.
+    """
+    if 0 < alpha < 1:
+        return max(window, math.ceil(math.log(tolerance) / math.log1p(-alpha)))
+    return max(1, window)
+
+
+def temporal_feature_names(sources: list[str] = TEMPORAL_SOURCES) -> list[str]:
+    names = []
+    for source in sources:
+        names += [f"{source}_delta", f"{source}_roll_mean", f"{source}_roll_std", f"{source}_ewma"]
+    return names
+
+
+TEMPORAL_FEATURE_NAMES = temporal_feature_names()
+
+
+def stream_key(row: dict) -> str:
+    """The stream a payload belongs to (its master node), 'default' when it doesn't say."""
+    key = row.get(STREAM_KEY_FIELD)
+    return DEFAULT_STREAM if key is None else str(key)
+
+
+class _SourceState:
+    """Ring buffer plus running sums for one source column of one stream."""
+    __slots__ = ("buffer", "pos", "count", "shift", "sum", "sumsq", "last", "ewma")
+
+    def __init__(self, window: int):
+        self.buffer = [0.0] * window
+        self.pos = 0
+        self.count = 0
+        self.shift = 0.0 # Sums are kept relative to the segment's first value (avoids cancellation)
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.last = 0.0
+        self.ewma = 0.0
+
+    def push(self, x: float, window: int, alpha: float) -> tuple[float, float, float, float]:
+        if self.count == 0:
+            self.shift = x
+            delta = 0.0
+            self.ewma = x
+        else:
+            delta = x - self.last
+            self.ewma = alpha * x + (1.0 - alpha) * self.ewma
+        d = x - self.shift
+        if self.count == window:
+            old = self.buffer[self.pos]
+            self.sum -= old
+            self.sumsq -= old * old
+        else:
+            self.count += 1
+        self.buffer[self.pos] = d
+        self.sum += d
+        self.sumsq += d * d
+        self.pos = (self.pos + 1) % window
+        if self.pos == 0:
+            # Once per wrap, re-sum exactly so rounding error can't accumulate
+            values = self.buffer[:self.count]
+            self.sum = math.fsum(values)
+            self.sumsq = math.fsum(v * v for v in values)
+        self.last = x
+        mean = self.sum / self.count
+        variance = max(self.sumsq / self.count - mean * mean, 0.0)
+        return delta, mean + self.shift, math.sqrt(variance), self.ewma
+
+
+class TemporalFeatureEngine:
+    """
+    Keeps per-stream, per-source rolling state in memory and adds the temporal
+    features to each payload as it arrives. Feed each stream in arrival order.
+    """
+
+    def __init__(self, sources: list[str] = TEMPORAL_SOURCES, window: int = TEMPORAL_WINDOW,
+                 alpha: float = TEMPORAL_ALPHA, max_gap: float = TEMPORAL_MAX_GAP):
+        self.sources = list(sources)
+        self.window = max(1, window)
+        self.alpha = alpha
+        self.max_gap = max_gap
+        self._streams = {} # stream key -> (last timestamp, [state per source])
+        self._lock = threading.Lock()
+
+    def update(self, row: dict, timestamp: float, key: str | None = None) -> dict:
+        """
+        Advances the stream `key` (default: the row's STREAM_KEY_FIELD) with `row`, seen at
+        `timestamp` (seconds), and writes the temporal features into the row.
+        """
+        if key is None:
+            key = stream_key(row)
+        with self._lock:
+            previous = self._streams.get(key)
+            if previous is None or timestamp - previous[0] > self.max_gap:
+                states = [_SourceState(self.window) for _ in self.sources]
+            else:
+                states = previous[1]
+            self._streams[key] = (timestamp, states)
+            for source, state in zip(self.sources, states):
+                delta, mean, std, ewma = state.push(float(row.get(source, 0) or 0), self.window, self.alpha)
+                row[f"{source}_delta"] = delta
+                row[f"{source}_roll_mean"] = mean
+                row[f"{source}_roll_std"] = std
+                row[f"{source}_ewma"] = ewma
+        return row
+
+    def reset(self, key: str | None = None):
+        with self._lock:
+            if key is None:
+                self._streams.clear()
+            else:
+                self._streams.pop(key, None)
+
+
+def add_temporal_features(df: "pd.DataFrame", timestamps: np.ndarray, streams: np.ndarray | None = None,
+                          sources: list[str] = TEMPORAL_SOURCES, window: int = TEMPORAL_WINDOW,
+                          alpha: float = TEMPORAL_ALPHA, max_gap: float = TEMPORAL_MAX_GAP) -> "pd.DataFrame":
+    """
+    Adds the temporal feature columns to `df` (rows in time order), using `timestamps`
+    (datetime64) to split segments at gaps longer than `max_gap`. `streams` holds each
+    row's stream key (see stream_key()); streams are computed separately, like the live
+    engine keeps one state per stream. None = one stream.
+    """
+    import pandas as pd # Training/backfill only: the API process never loads pandas
+    seconds = np.asarray(timestamps, dtype="datetime64[us]").astype(np.int64) / 1e6
+    codes = pd.factorize(np.asarray(streams))[0] if streams is not None else np.zeros(len(seconds), dtype=np.int64)
+    order = np.argsort(codes, kind="stable") # Each stream's rows together, still in time order
+    codes, seconds = codes[order], seconds[order]
+    starts = (np.diff(codes) != 0) | (np.diff(seconds) > max_gap)
+    segment = np.concatenate([[0], np.cumsum(starts)]) if len(seconds) else np.empty(0, dtype=np.int64)
+    window = max(1, window)
+    for source in sources:
+        x = pd.Series(df[source].fillna(0).to_numpy(dtype=np.float64)[order])
+        grouped = x.groupby(segment)
+        rolling = grouped.rolling(window, min_periods=1)
+        for name, values in (
+            (f"{source}_delta", grouped.diff().fillna(0)),
+            (f"{source}_roll_mean", rolling.mean()),
+            (f"{source}_roll_std", rolling.std(ddof=0)),
+            (f"{source}_ewma", grouped.ewm(alpha=alpha, adjust=False).mean()),
+        ):
+            column = np.empty(len(order))
+            column[order] = values.to_numpy() # Back to the rows' original order
+            df[name] = column
+    return df
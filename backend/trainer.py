@@ -0,0 +1,273 @@
+"""
+Model training pipeline. Runs inside a dedicated worker process (see training_jobs.py),
+so the sklearn/pandas work never competes with the API process for the GIL, or as its
+own entry point, away from the API hosts entirely:
+
+    python trainer.py [--search] [--activate]
+
+The API process never imports this module (nor sklearn/pandas): it serves the compiled model.
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.metrics import classification_report
+from database import engine, SensorData, LabelChange, SENSOR_DATA_COLUMNS
+from predictor import FEATURE_NAMES, MODEL_FEATURE_NAMES, StatusThresholds
+from model_search import build_pipeline, pool_plan, search_hyperparameters
+from compiled_model import compile_verified
+from temporal_features import temporal_config
+from training_data import load_training_arrays, model_feature_frame
+from model_registry import ModelRegistry, validate_model
+
+TARGET_COLUMN = "is_leak" # Label column in sensor_data
+COMPILE_CHECK_ROWS = 5000 # Most recent rows the compiled model must score exactly like the pipeline
+
+
+class TrainingError(Exception):
+    """Training could not produce a model (e.g. not enough labeled data)."""
+
+
+def train_model(registry_dir: str, cache_path: str | None = None, chunk_size: int = 50000, n_jobs: int = -1, progress=None,
+                search: bool = False, cv_folds: int = 4, latency_weight: float = 0.02, memory_limit_mb: int | None = None) -> dict:
+    """
+    Fetches LABELED data, trains, evaluates, and publishes the model pipeline as a new
+    (not yet active) version in the registry at `registry_dir`. With `search`, the
+    hyperparameters and status thresholds come from a cross-validated search instead,
+    whose pool workers split `memory_limit_mb` between them.
+    `progress(stage, fraction)` is called as training advances. Returns a summary dict.
+    """
+    report_progress = progress or (lambda stage, fraction: None)
+    print("\n Starting model training...")
+
+    # 1. Load ALL labeled rows (is_leak True/False) as typed NumPy columns.
+    # Streams from a server-side cursor and only reads rows that are new or relabeled since the cached copy.
+    report_progress("loading data", 0.05)
+    raw_feature_names = [f for f in FEATURE_NAMES if f in SENSOR_DATA_COLUMNS]
+    arrays = load_training_arrays(
+        engine, SensorData.__table__, LabelChange.__table__, raw_feature_names, TARGET_COLUMN,
+        cache_path=cache_path, chunk_size=chunk_size,
+    )
+
+    if len(arrays) < 20: # Need a reasonable amount of data
+        raise TrainingError("Not enough labeled data found in 'sensor_data' table for training (need at least 20 rows).")
+
+    # 2. Wrap the columns in a DataFrame (no per-row objects)
+    df = pd.DataFrame(arrays.features, columns=raw_feature_names, copy=False)
+    df[TARGET_COLUMN] = arrays.labels.astype(int) # Already ordered by timestamp
+
+    # 3. Check for both classes
+    label_counts = df[TARGET_COLUMN].value_counts()
+    print("\n Label Distribution for Training:")
+    print(label_counts)
+    if len(label_counts) < 2 or 1 not in label_counts or 0 not in label_counts:
+        raise TrainingError(f"Training requires examples of both '{TARGET_COLUMN}=0' and '{TARGET_COLUMN}=1'. Found: {list(label_counts.index)}.")
+
+    # 4. Feature Engineering (MUST MATCH PREDICTION)
+    report_progress("feature engineering", 0.25)
+    print(" Performing feature engineering...")
+    # 5. Prepare data for model (engineered + temporal features, NaNs filled; see training_data.py)
+    X = model_feature_frame(df, arrays.timestamps, arrays.streams)
+    y = df[TARGET_COLUMN]
+
+    # 6-8. Fit and evaluate: one temporal holdout split, or a cross-validated search
+    if search:
+        pipeline, summary, extra_metadata = search_and_fit(X, y, n_jobs, cv_folds, latency_weight, report_progress, memory_limit_mb)
+    else:
+        pipeline, summary = fit_with_holdout(X, y, n_jobs, report_progress)
+        extra_metadata = {"thresholds": StatusThresholds()._asdict()}
+
+    # 9. Compile the pipeline for serving (flat arrays, scaler folded in), checked against predict_proba
+    report_progress("compiling model", 0.9)
+    try:
+        compiled = compile_verified(pipeline, X.tail(COMPILE_CHECK_ROWS).to_numpy(np.float64))
+        print(f" Compiled the pipeline for serving ({compiled.n_nodes} nodes, depth {compiled.depth}).")
+    except ValueError as e:
+        compiled = None # The API serves the sklearn pipeline instead
+        print(f" Could not compile the pipeline for serving: {e}")
+
+    # 10. Publish the Trained Pipeline as a new registry version (activation happens in the API process)
+    report_progress("saving model", 0.95)
+    registry = ModelRegistry(registry_dir)
+    version = registry.publish(pipeline, compiled=compiled, metadata={
+        "feature_names": MODEL_FEATURE_NAMES,
+        "temporal_features": temporal_config(),
+        "data_max_id": arrays.max_id,
+        "label_watermark": arrays.watermark,
+        "sklearn_version": sklearn.__version__,
+        "metrics": summary,
+        **extra_metadata,
+    })
+    print(f"\n Model pipeline published as version {version} in {registry_dir}.")
+    return dict(summary, version=version)
+
+
+def fit_with_holdout(X: pd.DataFrame, y: pd.Series, n_jobs: int, report_progress) -> tuple:
+    """Fits the default configuration on the first 80% of rows and evaluates it on the rest."""
+    # 6. Temporal Train/Test Split (Important!)
+    print(" Splitting data temporally (80% train, 20% test)...")
+    split_index = int(len(X) * 0.8)
+    X_train, X_test = X.iloc[:split_index], X.iloc[split_index:]
+    y_train, y_test = y.iloc[:split_index], y.iloc[split_index:]
+
+    if X_train.empty or X_test.empty:
+        raise TrainingError("Not enough data for a meaningful train/test split after filtering.")
+
+    print(f"   Train set size: {len(X_train)}")
+    print(f"   Test set size: {len(X_test)}")
+
+    # 7. Define and Train Model Pipeline
+    report_progress("fitting model", 0.35)
+    print(" Defining model pipeline (StandardScaler + RandomForest)...")
+    pipeline = build_pipeline(n_estimators=100, n_jobs=n_jobs)
+
+    print(" Training the model pipeline...")
+    pipeline.fit(X_train, y_train)
+    print(" Training complete.")
+
+    # 8. Evaluate Model on Test Set
+    report_progress("evaluating", 0.85)
+    print("\n Evaluating model on the unseen test set...")
+    y_pred_test = pipeline.predict(X_test)
+    print("\n Classification Report (Test Set):")
+    # Ensure target names match your classes (0 and 1)
+    target_names = ['No Leak (0)', 'Leak (1)']
+    print(classification_report(y_test, y_pred_test, target_names=target_names, zero_division=0))
+    report = classification_report(y_test, y_pred_test, target_names=target_names, zero_division=0, output_dict=True)
+    summary = {
+        "train_rows": len(X_train),
+        "test_rows": len(X_test),
+        "accuracy": report["accuracy"],
+        "leak_precision": report["Leak (1)"]["precision"],
+        "leak_recall": report["Leak (1)"]["recall"],
+    }
+    return pipeline, summary
+
+
+def search_and_fit(X: pd.DataFrame, y: pd.Series, n_jobs: int, cv_folds: int, latency_weight: float, report_progress,
+                   memory_limit_mb: int | None = None) -> tuple:
+    """
+    Picks trees, depth and WARNING/DANGER thresholds by rolling-origin cross-validation
+    (see model_search.py), then refits the winner on all rows. Reported metrics are
+    out-of-fold: a reading counts as flagged when it reaches WARNING. Under
+    `memory_limit_mb` the pool gets fewer workers than cores if their shares would be too small.
+    """
+    cores = n_jobs if n_jobs > 0 else len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers, worker_memory_mb = pool_plan(cores, memory_limit_mb)
+    print(f" Cross-validating the hyperparameter search ({cv_folds} rolling-origin folds, {workers} worker processes"
+          + (f", {worker_memory_mb} MB each" if worker_memory_mb else "") + ")...")
+    report_progress("cross-validating", 0.3)
+    try:
+        result = search_hyperparameters(
+            X.to_numpy(np.float64), y.to_numpy(np.int8), n_folds=cv_folds, latency_weight=latency_weight,
+            max_workers=workers, worker_memory_limit_mb=worker_memory_mb, progress=lambda fraction: report_progress("cross-validating", 0.3 + 0.5 * fraction),
+        )
+    except ValueError as e:
+        raise TrainingError(f"Cross-validation failed: {e}.")
+    best = result["best"]
+    print(f" Best configuration: {best['n_estimators']} trees, max depth {best['max_depth']}, "
+          f"WARNING > {best['warning']}, DANGER > {best['danger']} "
+          f"(quality {best['quality']:.3f} +/- {best['quality_std']:.3f}, {best['inference_us_per_row']:.1f} us/row)")
+
+    report_progress("fitting model", 0.8)
+    print(" Training the best configuration on all rows...")
+    pipeline = build_pipeline(best["n_estimators"], best["max_depth"], n_jobs=n_jobs)
+    pipeline.fit(X, y)
+
+    oof_y, flagged = result["oof_y"], result["oof_probabilities"] > best["warning"]
+    true_positives = int(np.count_nonzero(flagged & (oof_y == 1)))
+    summary = {
+        "train_rows": len(X),
+        "test_rows": len(oof_y), # Out-of-fold predictions
+        "accuracy": float(np.mean(flagged == (oof_y == 1))),
+        "leak_precision": true_positives / max(1, int(np.count_nonzero(flagged))),
+        "leak_recall": true_positives / max(1, int(np.count_nonzero(oof_y == 1))),
+        "cv_folds": best["folds"],
+        "cv_quality": best["quality"],
+        "cv_quality_std": best["quality_std"],
+        "inference_us_per_row": best["inference_us_per_row"],
+    }
+    metadata = {
+        "thresholds": {"warning": best["warning"], "danger": best["danger"]},
+        "hyperparameters": {"n_estimators": best["n_estimators"], "max_depth": best["max_depth"]},
+        "search": {"latency_weight": latency_weight, "top_results": result["results"][:10]},
+    }
+    return pipeline, summary, metadata
+
+
+def apply_resource_limits(max_cores: int | None, memory_limit_mb: int | None, nice: int = 0):
+    """
+    Confines the current (worker) process: pins it to `max_cores` CPUs, caps its
+    address space at `memory_limit_mb` and lowers its scheduling priority.
+    Limits the platform doesn't support are skipped.
+    """
+    if max_cores and hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        # Take the highest-numbered CPUs, leaving the low ones to the API process
+        os.sched_setaffinity(0, cpus[-max_cores:])
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f" Could not apply training memory limit: {e}")
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+def run_training_job(job_id: str, events, registry_dir: str, cache_path: str | None, chunk_size: int,
+                     max_cores: int | None, memory_limit_mb: int | None, nice: int,
+                     search: bool = False, cv_folds: int = 4, latency_weight: float = 0.02):
+    """
+    Worker process entry point. Reports ("progress", stage, fraction), then
+    ("succeeded", summary) or ("failed", message) on the `events` queue.
+    """
+    try:
+        apply_resource_limits(max_cores, memory_limit_mb, nice)
+        summary = train_model(
+            registry_dir, cache_path=cache_path, chunk_size=chunk_size, n_jobs=max_cores or -1,
+            progress=lambda stage, fraction: events.put(("progress", stage, fraction)),
+            search=search, cv_folds=cv_folds, latency_weight=latency_weight, memory_limit_mb=memory_limit_mb,
+        )
+        events.put(("succeeded", summary))
+    except TrainingError as e:
+        print(f" Training job {job_id} aborted: {e}")
+        events.put(("failed", str(e)))
+    except MemoryError:
+        print(f" Training job {job_id} ran out of memory.")
+        events.put(("failed", f"Training exceeded the memory limit ({memory_limit_mb} MB)."))
+    except Exception as e:
+        print(f" An error occurred during training job {job_id}: {e}")
+        events.put(("failed", str(e)))
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Trains a model on the labeled sensor_data and publishes it as a new registry version.")
+    parser.add_argument("--registry-dir", default=os.getenv("MODEL_REGISTRY_DIR", "model_registry"), help="model registry directory")
+    parser.add_argument("--cache", default=os.getenv("TRAINING_CACHE_FILENAME", "training_data_cache.npz"), help="training data cache file")
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("TRAINING_CHUNK_SIZE", "50000")), help="rows per cursor chunk")
+    parser.add_argument("--cores", type=int, default=-1, help="CPUs to train with (-1 = all)")
+    parser.add_argument("--search", action="store_true", help="cross-validated hyperparameter and threshold search")
+    parser.add_argument("--cv-folds", type=int, default=int(os.getenv("TRAINING_CV_FOLDS", "4")), help="rolling-origin folds of the search")
+    parser.add_argument("--latency-weight", type=float, default=float(os.getenv("TRAINING_LATENCY_WEIGHT", "0.02")),
+                        help="quality traded per doubling of inference cost in the search")
+    parser.add_argument("--activate", action="store_true",
+                        help="serve the new version: running API processes pick up the ACTIVE pointer within seconds")
+    args = parser.parse_args(argv)
+    try:
+        summary = train_model(args.registry_dir, cache_path=args.cache, chunk_size=args.chunk_size, n_jobs=args.cores,
+                              search=args.search, cv_folds=args.cv_folds, latency_weight=args.latency_weight)
+    except TrainingError as e:
+        parser.exit(1, f" Training aborted: {e}\n")
+    if args.activate:
+        registry = ModelRegistry(args.registry_dir)
+        version = summary["version"]
+        validate_model(registry.load_compiled(version) or registry.load(version), MODEL_FEATURE_NAMES)
+        registry.activate(version)
+        print(f" Activated model version {version}.")
+
+
+if __name__ == "__main__":
+    main_cli()
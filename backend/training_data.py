@@ -0,0 +1,181 @@
+"""
+Chunked, columnar loading of labeled sensor_data for training, with an
+incremental on-disk cache keyed by (max row id, label-change watermark), and the
+model's feature matrix built from those columns (shared with the backfill job).
+
+Ids are taken when a row is inserted, not when it commits: with concurrent ingest
+transactions a row can become visible after rows with higher ids. So every load
+re-reads the last CACHE_REREAD_ROWS ids below the cached max id. Label changes commit
+in id order (apply_labels serializes them), so their watermark needs no margin.
+Retention deletes old unreviewed rows: when fewer cached rows still exist than the cache
+holds, the surviving ids are read (one column) and the purged rows dropped.
+"""
+import os
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from predictor import MODEL_FEATURE_NAMES
+from temporal_features import DEFAULT_STREAM, STREAM_KEY_FIELD, add_temporal_features
+
+CACHE_REREAD_ROWS = 10000 # Ids below the cached max id read again (ingest commits late by far fewer)
+
+
+class TrainingArrays(NamedTuple):
+    """Labeled rows as typed NumPy columns, ordered by (timestamp, id)."""
+    ids: np.ndarray # int64
+    timestamps: np.ndarray # datetime64[us]
+    streams: np.ndarray # str, the stream key (master id) of each row
+    features: np.ndarray # float64, shape (n_rows, len(columns)); NULL -> NaN
+    labels: np.ndarray # int8 (0 / 1)
+    columns: list[str]
+    max_id: int # Highest sensor_data id covered
+    watermark: int # Highest label_changes id covered
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _empty(columns: list[str]) -> TrainingArrays:
+    return TrainingArrays(
+        np.empty(0, dtype=np.int64),
+        np.empty(0, dtype="datetime64[us]"),
+        np.empty(0, dtype=str),
+        np.empty((0, len(columns)), dtype=np.float64),
+        np.empty(0, dtype=np.int8),
+        list(columns), 0, 0,
+    )
+
+
+def read_cache(path: str, columns: list[str]) -> TrainingArrays | None:
+    """Returns the cached arrays, or None if missing, unreadable or built for other columns (or without streams)."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if data["columns"].tolist() != list(columns) or "streams" not in data.files:
+                return None
+            return TrainingArrays(
+                data["ids"], data["timestamps"], data["streams"], data["features"], data["labels"],
+                list(columns), int(data["max_id"]), int(data["watermark"]),
+            )
+    except Exception as e:
+        print(f" Ignoring unreadable training cache '{path}': {e}")
+        return None
+
+
+def write_cache(path: str, arrays: TrainingArrays):
+    """Writes the cache atomically (temp file + rename), so a crash never leaves a torn file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f, ids=arrays.ids, timestamps=arrays.timestamps, streams=arrays.streams, features=arrays.features,
+            labels=arrays.labels, columns=np.array(arrays.columns),
+            max_id=arrays.max_id, watermark=arrays.watermark,
+        )
+    os.replace(tmp_path, path)
+
+
+def row_columns(sensor_table, columns: list[str], label_column: str | None = None) -> list:
+    """The columns stream_rows() reads: id, timestamp, stream key, `columns`, then the label if given."""
+    selected = [sensor_table.c.id, sensor_table.c.timestamp, sensor_table.c[STREAM_KEY_FIELD]] + [sensor_table.c[c] for c in columns]
+    return selected + [sensor_table.c[label_column]] if label_column else selected
+
+
+def stream_rows(conn, statement, n_features: int, chunk_size: int, labels: bool = True):
+    """
+    Reads (id, timestamp, stream key, *features, label) rows (see row_columns()) from a
+    server-side cursor into column chunks. Without `labels` the statement selects no label
+    column, and chunks have none. A NULL stream key is the default stream.
+    """
+    result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+    for rows in result.partitions(chunk_size):
+        columns = list(zip(*rows))
+        chunk = (
+            np.array(columns[0], dtype=np.int64),
+            np.array(columns[1], dtype="datetime64[us]"),
+            np.array([DEFAULT_STREAM if key is None else key for key in columns[2]], dtype=str),
+            np.array(columns[3:3 + n_features], dtype=np.float64).T.reshape(len(rows), n_features),
+        )
+        yield chunk + (np.array(columns[-1], dtype=np.int8),) if labels else chunk
+
+
+def model_feature_frame(df: pd.DataFrame, timestamps: np.ndarray, streams: np.ndarray | None = None) -> pd.DataFrame:
+    """
+    Adds the engineered and temporal features to `df` (raw sensor columns, rows in time
+    order, from the streams `streams`) and returns the model input: MODEL_FEATURE_NAMES,
+    missing values as 0.
+    """
+    df['spatial_variance'] = df[['worker_1_mean', 'worker_2_mean', 'worker_3_mean']].var(axis=1, skipna=True).fillna(0)
+    df['max_all_sensors'] = df[['worker_1_mean', 'worker_2_mean', 'worker_3_mean']].max(axis=1, skipna=True).fillna(0)
+    df['avg_all_sensors'] = df[['worker_1_mean', 'worker_2_mean', 'worker_3_mean']].mean(axis=1, skipna=True).fillna(0)
+    # Temporal features: same definitions the live TemporalFeatureEngine computes incrementally
+    add_temporal_features(df, timestamps, streams)
+    return df[MODEL_FEATURE_NAMES].fillna(0) # Fill any missing sensor readings with 0
+
+
+def load_training_arrays(engine, sensor_table, changes_table, columns: list[str], label_column: str,
+                         cache_path: str | None = None, chunk_size: int = 50000,
+                         reread_rows: int = CACHE_REREAD_ROWS) -> TrainingArrays:
+    """
+    Loads every row of `sensor_table` whose `label_column` is not NULL. With a cache,
+    only rows with id > cached max_id - `reread_rows` and rows relabeled since the cached
+    watermark (ids logged in `changes_table` as sensor_data_id) are read from the database.
+    """
+    n_features = len(columns)
+    cached = read_cache(cache_path, columns) if cache_path else None
+    base = cached or _empty(columns)
+    id_col = sensor_table.c.id
+    label_col = sensor_table.c[label_column]
+    selected = row_columns(sensor_table, columns, label_column)
+
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(id_col))).scalar() or 0
+        watermark = conn.execute(select(func.max(changes_table.c.id))).scalar() or 0
+        # Cached rows above this id may have missed rows that committed late: read them again
+        reread_from = max(0, base.max_id - reread_rows)
+
+        chunks = []
+        changed_ids = np.empty(0, dtype=np.int64)
+        if cached is not None and watermark > cached.watermark:
+            changed_ids = np.array(conn.execute(
+                select(changes_table.c.sensor_data_id).distinct()
+                .where(changes_table.c.id > cached.watermark, changes_table.c.sensor_data_id <= reread_from)
+            ).scalars().all(), dtype=np.int64)
+            # Re-read relabeled rows in id batches (keeps IN lists bounded)
+            for i in range(0, len(changed_ids), chunk_size):
+                batch = changed_ids[i:i + chunk_size].tolist()
+                statement = select(*selected).where(id_col.in_(batch), label_col.is_not(None))
+                chunks.extend(stream_rows(conn, statement, n_features, chunk_size))
+
+        # New rows since the cache was built, and the re-read margin below them
+        statement = (
+            select(*selected)
+            .where(id_col > reread_from, id_col <= max_id, label_col.is_not(None))
+            .order_by(id_col)
+        )
+        chunks.extend(stream_rows(conn, statement, n_features, chunk_size))
+
+        keep = (base.ids <= reread_from) & ~np.isin(base.ids, changed_ids)
+        old_rows = select(id_col).where(id_col <= reread_from, label_col.is_not(None))
+        n_old = conn.execute(select(func.count()).select_from(old_rows.subquery())).scalar() if cached is not None else 0
+        if n_old != np.count_nonzero(base.ids <= reread_from):
+            existing = np.array(conn.execute(old_rows).scalars().all(), dtype=np.int64)
+            purged = (base.ids <= reread_from) & ~np.isin(base.ids, existing) # Deleted by retention since the cache was built
+            keep &= ~purged
+            print(f" Dropped {np.count_nonzero(purged)} purged rows from the training cache.")
+
+    ids = np.concatenate([base.ids[keep]] + [c[0] for c in chunks])
+    timestamps = np.concatenate([base.timestamps[keep]] + [c[1] for c in chunks])
+    streams = np.concatenate([base.streams[keep]] + [c[2] for c in chunks])
+    features = np.concatenate([base.features[keep]] + [c[3] for c in chunks])
+    labels = np.concatenate([base.labels[keep]] + [c[4] for c in chunks])
+
+    order = np.lexsort((ids, timestamps)) # Temporal order (ties broken by id)
+    arrays = TrainingArrays(ids[order], timestamps[order], streams[order], features[order], labels[order],
+                            list(columns), int(max_id), int(watermark))
+    loaded = sum(len(c[0]) for c in chunks)
+    print(f" Loaded {loaded} new, relabeled or re-checked rows from the database ({len(arrays)} labeled rows total).")
+    if cache_path:
+        write_cache(cache_path, arrays)
+    return arrays
@@ -0,0 +1,260 @@
+"""
+Runs training jobs in a separate, resource-limited worker process and tracks their status.
+
+Job records live as JSON files in a directory shared by every API process (`state_dir`,
+like the model registry), so any `uvicorn --workers N` process can report a job another
+one started. Only one job runs per directory: the process running it holds an exclusive
+lock on `<state_dir>/RUNNING.lock` until the job has finished.
+"""
+import datetime
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{12}$")
+_TIMESTAMP_FIELDS = ("created_at", "started_at", "finished_at")
+
+
+def _worker_entry(*args, **kwargs):
+    """Spawned process target; imports the training stack only inside the worker."""
+    from trainer import run_training_job
+    run_training_job(*args, **kwargs)
+
+
+class TrainingJobConflict(Exception):
+    """A training job is already queued or running."""
+
+    def __init__(self, job=None):
+        super().__init__(f"Training job {job.job_id} is already {job.status}" if job else "A training job is already running")
+        self.job = job
+
+
+class TrainingJob:
+    """Status record for one training run (stored by the manager as <job_id>.json)."""
+
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.status = "queued" # queued -> running -> succeeded / failed
+        self.stage = None
+        self.progress = 0.0
+        self.created_at = datetime.datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.result = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ("queued", "running")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "result": self.result,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TrainingJob":
+        job = cls.__new__(cls)
+        for key, value in data.items():
+            if key in _TIMESTAMP_FIELDS and value is not None:
+                value = datetime.datetime.fromisoformat(value)
+            setattr(job, key, value)
+        return job
+
+
+class TrainingJobManager:
+    """
+    Starts one spawned worker process per training job and refuses to start a
+    second job while one is active in any process sharing `state_dir`. A monitor
+    thread relays the worker's progress events into the job record;
+    `on_success(result)` runs in the submitting process once a model is published.
+    """
+
+    def __init__(self, job_kwargs: dict, state_dir: str, on_success=None, history: int = 20):
+        self.job_kwargs = job_kwargs # Passed to trainer.run_training_job
+        self.state_dir = state_dir
+        self.on_success = on_success
+        self.history = history
+        self._context = multiprocessing.get_context("spawn") # Fresh interpreter: no inherited threads/DB connections
+        self._lock_path = os.path.join(state_dir, "RUNNING.lock")
+        self._run_lock = None # Open, locked RUNNING.lock while this process runs a job
+        self._current = None # The job this process runs
+        self._processes = {}
+        self._lock = threading.Lock()
+
+    def submit(self, **options) -> TrainingJob:
+        """Starts a job; `options` are passed to trainer.run_training_job on top of `job_kwargs`."""
+        with self._lock:
+            os.makedirs(self.state_dir, exist_ok=True)
+            run_lock = self._try_lock()
+            if run_lock is None:
+                raise TrainingJobConflict(self.active_job())
+            self._run_lock = run_lock
+            self._fail_orphans()
+            job = self._current = TrainingJob()
+            self._save(job)
+            self._trim_history()
+        events = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_entry,
+            args=(job.job_id, events),
+            kwargs=dict(self.job_kwargs, **options),
+            name=f"trainer-{job.job_id}",
+        )
+        try:
+            process.start()
+        except Exception as e:
+            self._finish(job, "failed", error=f"Could not start training worker: {e}")
+            return job
+        self._processes[job.job_id] = process
+        job.status = "running"
+        job.started_at = datetime.datetime.utcnow()
+        self._save(job)
+        threading.Thread(target=self._monitor, args=(job, process, events), name=f"monitor-{job.job_id}", daemon=True).start()
+        logger.info("Started training job %s in worker process %s.", job.job_id, process.pid)
+        return job
+
+    def get(self, job_id: str) -> TrainingJob | None:
+        if not _JOB_ID_RE.match(job_id):
+            return None
+        return self._read(os.path.join(self.state_dir, f"{job_id}.json"))
+
+    def list(self) -> list[TrainingJob]:
+        if not os.path.isdir(self.state_dir):
+            return []
+        jobs = [self.get(name[:-5]) for name in os.listdir(self.state_dir) if name.endswith(".json")]
+        return sorted((j for j in jobs if j is not None), key=lambda j: j.created_at, reverse=True)
+
+    def active_job(self) -> TrainingJob | None:
+        current = self._current
+        if current is not None and current.active:
+            return current
+        if not self._locked_elsewhere():
+            return None
+        return next((j for j in self.list() if j.active), None)
+
+    def shutdown(self, timeout: float = 5.0):
+        """Terminates any running worker (called on API shutdown)."""
+        for job_id, process in list(self._processes.items()):
+            if process.is_alive():
+                logger.info("Terminating training job %s...", job_id)
+                process.terminate()
+                process.join(timeout)
+
+    def _monitor(self, job: TrainingJob, process, events):
+        while True:
+            try:
+                self._handle_event(job, events.get(timeout=0.5))
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+        # Drain anything sent right before the worker exited
+        while True:
+            try:
+                self._handle_event(job, events.get_nowait())
+            except queue.Empty:
+                break
+        process.join()
+        self._processes.pop(job.job_id, None)
+        if job.active: # Worker died without reporting (killed, crashed)
+            self._finish(job, "failed", error=f"Training worker exited unexpectedly (exit code {process.exitcode}).")
+
+    def _handle_event(self, job: TrainingJob, event: tuple):
+        kind = event[0]
+        if kind == "progress":
+            job.stage, job.progress = event[1], event[2]
+            self._save(job)
+        elif kind == "succeeded":
+            # Hand the model over first, so 'succeeded' means the new model is already serving
+            if self.on_success is not None:
+                try:
+                    self.on_success(event[1])
+                except Exception as e:
+                    logger.error("Error handing trained model to the API process: %s", e)
+                    self._finish(job, "failed", result=event[1], error=f"Training finished, but the new model was not activated: {e}")
+                    return
+            self._finish(job, "succeeded", result=event[1])
+        elif kind == "failed":
+            self._finish(job, "failed", error=event[1])
+
+    def _finish(self, job: TrainingJob, status: str, result: dict | None = None, error: str | None = None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = datetime.datetime.utcnow()
+        if status == "succeeded":
+            job.stage, job.progress = "done", 1.0
+        self._save(job)
+        with self._lock:
+            if self._current is job and self._run_lock is not None:
+                self._run_lock.close() # Releases the lock: other processes may start a job now
+                self._run_lock = None
+        log = logger.info if status == "succeeded" else logger.warning
+        log("Training job %s %s.%s", job.job_id, status, f" {error}" if error else "")
+
+    def _try_lock(self):
+        """RUNNING.lock, opened and exclusively locked, or None if another job holds it."""
+        lock_file = open(self._lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _locked_elsewhere(self) -> bool:
+        if not os.path.exists(self._lock_path):
+            return False
+        lock_file = self._try_lock()
+        if lock_file is None:
+            return True
+        lock_file.close()
+        return False
+
+    def _fail_orphans(self):
+        """Marks jobs still 'queued'/'running' as failed: the process running them exited (the lock was free)."""
+        for job in self.list():
+            if job.active:
+                job.status = "failed"
+                job.error = "The API process running this job exited before it finished."
+                job.finished_at = datetime.datetime.utcnow()
+                self._save(job)
+
+    def _save(self, job: TrainingJob):
+        """Writes the job record atomically (temp file + rename), so readers never see a torn file."""
+        path = os.path.join(self.state_dir, f"{job.job_id}.json")
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job.to_dict(), f, default=lambda value: value.isoformat() if isinstance(value, datetime.datetime) else str(value))
+        os.replace(tmp_path, path)
+
+    def _read(self, path: str) -> TrainingJob | None:
+        try:
+            with open(path) as f:
+                return TrainingJob.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _trim_history(self):
+        finished = [j for j in self.list() if not j.active]
+        for job in finished[self.history:]:
+            try:
+                os.remove(os.path.join(self.state_dir, f"{job.job_id}.json"))
+            except OSError:
+                pass
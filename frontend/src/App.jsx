@@ -9,7 +9,9 @@ const API_URL_DATA = `${API_BASE_URL}/fetchdata`; // Endpoint to get raw data fo
 const API_URL_PREDICTION = `${API_BASE_URL}/latest-prediction`; // Endpoint to get the latest prediction result
 const API_URL_TRAIN = `${API_BASE_URL}/train-model`; // Endpoint to trigger model training
 const API_URL_MODEL_STATUS = `${API_BASE_URL}/model-status`; // Endpoint to check if a trained model exists
+const API_URL_TRAIN_JOBS = `${API_BASE_URL}/train-jobs`; // Base endpoint for training job status (needs /<job_id>)
 const API_URL_LABEL_UPDATE = `${API_BASE_URL}/label-data`; // Base endpoint to update labels (needs /<record_id>)
+const API_URL_STREAM = `${API_BASE_URL}/stream`; // Server-Sent Events stream of new sensor data and predictions
 
 const HISTORY_LENGTH = 50; // Maximum number of data points to display in charts and table
 
@@ -127,11 +129,50 @@ function App() {
         fetchApiData();
         checkModelStatus();
 
-        // Set up polling interval to automatically refresh data
-        const intervalId = setInterval(fetchApiData, 3000); // Refresh data every 3 seconds
+        // --- Live Updates via Server-Sent Events ---
+        // The backend pushes every new row, so we only poll while the stream is down.
+        let pollIntervalId = null;
+        const startPolling = () => {
+            if (pollIntervalId === null) {
+                pollIntervalId = setInterval(fetchApiData, 3000); // Fallback: refresh data every 3 seconds
+            }
+        };
+        const stopPolling = () => {
+            if (pollIntervalId !== null) {
+                clearInterval(pollIntervalId);
+                pollIntervalId = null;
+            }
+        };
 
-        // Cleanup function: Clear the interval when the component unmounts to prevent memory leaks
-        return () => clearInterval(intervalId);
+        const eventSource = new EventSource(API_URL_STREAM);
+        eventSource.onopen = () => {
+            stopPolling();
+            fetchApiData(); // Catch up on anything missed while disconnected
+        };
+        eventSource.onerror = () => {
+            // EventSource reconnects on its own; poll in the meantime
+            console.warn("Live stream unavailable, falling back to polling.");
+            startPolling();
+        };
+        eventSource.addEventListener('sensor_data', (event) => {
+            const record = JSON.parse(event.data);
+            setLatestData(record);
+            // Append newest record, keeping oldest-first order for charting
+            setDataHistory(prev => [...prev, record].slice(-HISTORY_LENGTH));
+            setLastUpdated(new Date());
+        });
+        eventSource.addEventListener('prediction', (event) => {
+            const predictionData = JSON.parse(event.data);
+            setPrediction(predictionData);
+            setStatus(predictionData.status.toLowerCase());
+            setLastUpdated(new Date());
+        });
+
+        // Cleanup function: Close the stream and any polling interval when the component unmounts
+        return () => {
+            eventSource.close();
+            stopPolling();
+        };
      // eslint-disable-next-line react-hooks/exhaustive-deps
     }, []); // Empty dependency array ensures this effect runs only once after initial render
 
@@ -160,22 +201,34 @@ function App() {
             // Display the success message from the backend
             setTrainingMessage(result.message || '✅ Training initiated successfully.');
 
-            // Since training runs in the background, re-check the model status after a delay
-            // to update the "Model Ready/No Model" indicator.
-            setTimeout(async () => {
-                 console.log("Re-checking model status after training request...");
-                 try {
+            // Training runs in a worker process; poll the job until it finishes,
+            // then refresh the "Model Ready/No Model" indicator.
+            const pollJob = async () => {
+                try {
+                    const jobRes = await fetch(`${API_URL_TRAIN_JOBS}/${result.job_id}`);
+                    if (!jobRes.ok) throw new Error(`HTTP error fetching training job! Status: ${jobRes.status}`);
+                    const job = await jobRes.json();
+                    if (job.status === 'queued' || job.status === 'running') {
+                        setTrainingMessage(`⏳ Training (job ${job.job_id}): ${job.stage || 'starting'} – ${Math.round(job.progress * 100)}%`);
+                        setTimeout(pollJob, 2000);
+                        return;
+                    }
+                    if (job.status === 'succeeded') {
+                        setTrainingMessage(`✅ Training complete. Test accuracy: ${(job.result.accuracy * 100).toFixed(1)}%`);
+                    } else {
+                        setTrainingMessage(`❌ Training failed: ${job.error}`);
+                    }
                     const statusRes = await fetch(API_URL_MODEL_STATUS);
                     if (statusRes.ok) {
                         const statusData = await statusRes.json();
                         setModelExists(statusData.model_exists);
-                        // Append the latest model status message to the initial feedback
-                        // Keep the original initiation message and add the current status
-                        setTrainingMessage(prev => `${prev.split('|')[0].trim()} | ${statusData.message}`);
                     }
-                } catch (e) { console.error("Failed to refresh model status after training:", e);}
-                 setIsTraining(false); // Re-enable the train button
-            }, 15000); // Check again after 15 seconds (adjust based on typical training time)
+                } catch (e) {
+                    console.error("Failed to check training job status:", e);
+                }
+                setIsTraining(false); // Re-enable the train button
+            };
+            setTimeout(pollJob, 2000);
 
         } catch (e) {
             // Handle network errors or errors thrown from the backend response
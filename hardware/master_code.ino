@@ -12,6 +12,7 @@ const char* password = "adhithya365"; //
 const char* mqtt_server = "test.mosquitto.org"; //
 const char* publish_topic_collection = "master/backend/collection"; // Topic for storing raw data
 const char* publish_topic_prediction = "master/backend/prediction"; // Topic for running prediction
+const char* master_id = "master-1"; // Unique per master node: the backend keeps each master's readings as a separate stream
 
 // --- Subscribe topics ---
 const char* subscribe_topic_1 = "worker-1/data"; //
@@ -121,6 +122,8 @@ void callback(char* topic, byte* payload, unsigned int length) { //
       Serial.println("Mode Pin HIGH/Floating -> Publishing for Prediction.");
     }
 
+    outgoingDoc["master_id"] = master_id; // Stream key (backend partitions prediction streams by it)
+
     // Serialize and publish
     char jsonBuffer[512]; // Use buffer size matching StaticJsonDocument
     serializeJson(outgoingDoc, jsonBuffer); //